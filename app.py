@@ -1,6 +1,8 @@
 import streamlit as st
 import pandas as pd
-from utils import cargar_datos, obtener_regiones_disponibles
+from utils import obtener_geometrias, cargar_cubo, obtener_regiones_disponibles
+from calentamiento import iniciar_calentamiento, estado_calentamiento, cubo_progresivo
+from instrumentacion import iniciar_exportador_metricas
 
 # Configuración de página
 st.set_page_config(
@@ -45,54 +47,104 @@ st.markdown("""
 </div>
 """, unsafe_allow_html=True)
 
-# Cargar datos
+# Calentamiento de cachés en segundo plano (una vez por proceso)
+iniciar_calentamiento()
+iniciar_exportador_metricas()
+datos_listos = estado_calentamiento()['fin'] is not None
+
+@st.fragment(run_every=None if datos_listos else 2)
+def mostrar_estado_datos():
+    """Indicador de preparación de los datos; se refresca solo hasta que terminan de cargarse."""
+    estado = estado_calentamiento()
+    if estado['fin'] is not None and not datos_listos:
+        # Terminó mientras se mostraba el progreso: rerun completo para dejar de refrescar
+        st.rerun()
+    if estado['error']:
+        st.warning(f"⚠️ No se pudieron preparar todos los datos: {estado['error']}")
+    elif estado['listo']:
+        st.success(f"✅ Datos listos (preparados en {estado['fin'] - estado['inicio']:.0f} s)")
+    else:
+        st.progress(estado['completadas'] / estado['total'],
+                    text=f"⏳ Preparando datos en segundo plano: {estado['etapa'] or '...'} "
+                         f"({estado['completadas']}/{estado['total']})")
+
+mostrar_estado_datos()
+
+# Cargar datos (mientras se construye el cubo, se usan sus cifras parciales)
+progresivo = cubo_progresivo()
 try:
     with st.spinner("Cargando datos del censo..."):
-        regiones, comunas, censo = cargar_datos()
+        regiones, comunas = obtener_geometrias()
+        cubo = cargar_cubo() if progresivo is None else None
         regiones_lista = obtener_regiones_disponibles(regiones)
 except Exception as e:
     st.error(f"Error al cargar los datos: {str(e)}")
     st.stop()
 
-# Información general en columnas
-col1, col2, col3, col4 = st.columns(4)
+def mostrar_metricas(cubo):
+    """Tarjetas con las cifras generales del censo (o de lo leído hasta ahora)."""
+    col1, col2, col3, col4 = st.columns(4)
 
-with col1:
-    st.markdown("""
-    <div class="metric-card">
-        <h3>📊 Total Población</h3>
-        <h2>{:,}</h2>
-        <p>personas registradas</p>
-    </div>
-    """.format(len(censo)), unsafe_allow_html=True)
+    with col1:
+        st.markdown("""
+        <div class="metric-card">
+            <h3>📊 Total Población</h3>
+            <h2>{:,}</h2>
+            <p>personas registradas</p>
+        </div>
+        """.format(int(cubo['poblacion'].sum())), unsafe_allow_html=True)
 
-with col2:
-    st.markdown("""
-    <div class="metric-card">
-        <h3>🏛️ Regiones</h3>
-        <h2>{}</h2>
-        <p>regiones disponibles</p>
-    </div>
-    """.format(len(regiones_lista)), unsafe_allow_html=True)
-
-with col3:
-    st.markdown("""
-    <div class="metric-card">
-        <h3>🏘️ Comunas</h3>
-        <h2>{}</h2>
-        <p>comunas registradas</p>
-    </div>
-    """.format(len(comunas)), unsafe_allow_html=True)
-
-with col4:
-    edad_promedio = censo['edad'].mean()
-    st.markdown("""
-    <div class="metric-card">
-        <h3>👥 Edad Promedio</h3>
-        <h2>{:.1f}</h2>
-        <p>años</p>
-    </div>
-    """.format(edad_promedio), unsafe_allow_html=True)
+    with col2:
+        st.markdown("""
+        <div class="metric-card">
+            <h3>🏛️ Regiones</h3>
+            <h2>{}</h2>
+            <p>regiones disponibles</p>
+        </div>
+        """.format(len(regiones_lista)), unsafe_allow_html=True)
+
+    with col3:
+        st.markdown("""
+        <div class="metric-card">
+            <h3>🏘️ Comunas</h3>
+            <h2>{}</h2>
+            <p>comunas registradas</p>
+        </div>
+        """.format(len(comunas)), unsafe_allow_html=True)
+
+    with col4:
+        edad_promedio = (cubo['edad'] * cubo['poblacion']).sum() / cubo['poblacion'].sum()
+        st.markdown("""
+        <div class="metric-card">
+            <h3>👥 Edad Promedio</h3>
+            <h2>{:.1f}</h2>
+            <p>años</p>
+        </div>
+        """.format(edad_promedio), unsafe_allow_html=True)
+
+@st.fragment(run_every=2)
+def mostrar_metricas_parciales():
+    """Cifras generales de lo leído del censo hasta ahora; se refrescan solas hasta tener el cubo completo."""
+    progresivo = cubo_progresivo()
+    if progresivo is None:
+        # El cubo completo ya está disponible: rerun completo para usarlo
+        st.rerun()
+    cubo_parcial, avance = progresivo
+    if cubo_parcial is None:
+        st.info("⏳ Esperando los primeros datos del censo...")
+        return
+    personas = int(cubo_parcial['poblacion'].sum())
+    if avance is None:
+        st.progress(0.0, text=f"📥 Cifras parciales: {personas:,} personas leídas del censo")
+    else:
+        st.progress(avance, text=f"📥 Cifras parciales: {avance:.0%} del censo leído ({personas:,} personas)")
+    mostrar_metricas(cubo_parcial)
+
+# Información general en columnas
+if progresivo is None:
+    mostrar_metricas(cubo)
+else:
+    mostrar_metricas_parciales()
 
 # Información del proyecto
 st.markdown("""
@@ -0,0 +1,297 @@
+"""
+Benchmarks de los pipelines de datos y de mapas, sin red ni servidor.
+
+Genera un censo sintético (mismo esquema que el microdato: REGION, PROVINCIA,
+COMUNA, P08, P09, P16, ESCOLARIDAD) y polígonos sintéticos de regiones y
+comunas en un directorio temporal, apunta la app a él (`CENSO_DATOS`, con
+`CENSO_SIN_RED=1`) y mide cada etapa: tiempo de pared, pico de memoria y
+tamaño de la salida.
+
+Ejemplos:
+    python benchmarks.py
+    python benchmarks.py --filas 2000000 --repeticiones 5 --json base.json
+    python benchmarks.py --filas 2000000 --comparar base.json
+"""
+import argparse
+import json
+import logging
+import os
+import shutil
+import statistics
+import tempfile
+import time
+import tracemalloc
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely
+
+# Cantidad de comunas por región (códigos 1 a 16), como en el censo 2017
+COMUNAS_POR_REGION = [7, 9, 9, 15, 38, 33, 30, 33, 32, 30, 10, 11, 52, 12, 4, 21]
+
+def generar_censo_sintetico(filas, semilla=42, comunas_por_region=COMUNAS_POR_REGION):
+    """
+    Censo sintético con el esquema del microdato de personas.
+
+    Las comunas tienen tamaños log-normales (unas pocas muy pobladas, como en
+    el censo real) y los códigos siguen la forma región·1000 + provincia·100 + n.
+
+    Args:
+        filas: Cantidad de personas
+        semilla: Semilla del generador (resultado reproducible)
+        comunas_por_region: Comunas de cada región, en orden de código
+
+    Returns:
+        DataFrame con columnas REGION, PROVINCIA, COMUNA, P08, P09, P16, ESCOLARIDAD
+    """
+    rng = np.random.default_rng(semilla)
+    region = np.repeat(np.arange(1, len(comunas_por_region) + 1), comunas_por_region)
+    numero = np.concatenate([np.arange(1, n + 1) for n in comunas_por_region])
+    provincia = region * 10 + 1 + (numero - 1) // 10
+    comuna = region * 1000 + (provincia % 10) * 100 + numero
+
+    pesos = rng.lognormal(mean=0, sigma=1.2, size=len(comuna))
+    elegida = rng.choice(len(comuna), size=filas, p=pesos / pesos.sum())
+    edad = np.minimum(rng.exponential(scale=35, size=filas), 100).astype(np.uint8)
+    return pd.DataFrame({
+        "REGION": region[elegida].astype(np.int8),
+        "PROVINCIA": provincia[elegida].astype(np.int16),
+        "COMUNA": comuna[elegida].astype(np.int32),
+        "P08": rng.integers(1, 3, size=filas, dtype=np.uint8),
+        "P09": edad,
+        "P16": rng.choice([1, 2, 98, 99], size=filas, p=[0.12, 0.85, 0.02, 0.01]).astype(np.uint8),
+        "ESCOLARIDAD": np.where(rng.random(filas) < 0.03, 99,
+                                rng.integers(0, 22, size=filas)).astype(np.uint8),
+    })
+
+def generar_poligonos_sinteticos(censo, semilla=42, largo_segmento=0.01):
+    """
+    Regiones y comunas sintéticas, con la forma de los shapefiles del release.
+
+    Cada región es una franja de latitud (de norte a sur, como Chile) partida
+    en comunas por un diagrama de Voronoi, así que las comunas vecinas
+    comparten bordes exactos. `largo_segmento` (grados) densifica los bordes
+    para que la simplificación tenga trabajo de verdad.
+
+    Returns:
+        Tupla (regiones, comunas) de GeoDataFrames en EPSG:4326, con las
+        columnas originales (`codregion`, `Region`, `cod_comuna`, `Comuna`, ...)
+    """
+    rng = np.random.default_rng(semilla)
+    pares = censo[["REGION", "PROVINCIA", "COMUNA"]].drop_duplicates().sort_values("COMUNA")
+    filas_comunas = []
+    for i, (region, grupo) in enumerate(pares.groupby("REGION")):
+        franja = shapely.box(-75.0, -18.0 - 2.5 * (i + 1), -67.0, -18.0 - 2.5 * i)
+        minx, miny, maxx, maxy = franja.bounds
+        puntos = shapely.points(rng.uniform(minx, maxx, len(grupo)), rng.uniform(miny, maxy, len(grupo)))
+        celdas = shapely.get_parts(shapely.voronoi_polygons(shapely.multipoints(puntos), extend_to=franja))
+        # Cada celda de Voronoi corresponde al punto que contiene
+        for (_, comuna), punto in zip(grupo.iterrows(), puntos):
+            celda = celdas[shapely.contains(celdas, punto)][0]
+            filas_comunas.append({
+                "cod_comuna": int(comuna["COMUNA"]),
+                "codregion": int(region),
+                "Comuna": f"Comuna {comuna['COMUNA']}",
+                "Provincia": f"Provincia {comuna['PROVINCIA']}",
+                "geometry": shapely.segmentize(shapely.intersection(celda, franja), largo_segmento),
+            })
+    comunas = gpd.GeoDataFrame(filas_comunas, crs=4326)
+    regiones = comunas.dissolve(by="codregion", as_index=False)[["codregion", "geometry"]]
+    regiones["Region"] = "Región " + regiones["codregion"].astype(str)
+    return regiones, comunas
+
+def escribir_datos_sinteticos(directorio, filas, semilla=42):
+    """
+    Escribe en `directorio` el CSV y los shapefiles con la estructura `data/` del README.
+
+    Returns:
+        Ruta del CSV escrito
+    """
+    censo = generar_censo_sintetico(filas, semilla)
+    regiones, comunas = generar_poligonos_sinteticos(censo, semilla)
+    ruta_csv = os.path.join(directorio, "Microdato_Censo2017-Personas.csv")
+    censo.to_csv(ruta_csv, sep=";", index=False, encoding="latin1")
+    os.makedirs(os.path.join(directorio, "Regiones"), exist_ok=True)
+    os.makedirs(os.path.join(directorio, "Comunas"), exist_ok=True)
+    regiones.to_file(os.path.join(directorio, "Regiones", "Regional.shp"))
+    comunas.to_file(os.path.join(directorio, "Comunas", "comunas.shp"))
+    return ruta_csv
+
+def tamano_salida(resultado):
+    """
+    Tamaño en bytes de la salida de una etapa.
+
+    GeoDataFrames y diccionarios se miden serializados a JSON (lo que viaja
+    al navegador) y los textos por sus bytes; los DataFrames y arreglos por
+    su memoria; las tuplas (y los diccionarios de arreglos, como los
+    índices) suman sus partes.
+    """
+    if isinstance(resultado, gpd.GeoDataFrame):
+        return len(resultado.to_json().encode())
+    if isinstance(resultado, pd.DataFrame):
+        return int(resultado.memory_usage(deep=True).sum())
+    if isinstance(resultado, np.ndarray):
+        return int(resultado.nbytes)
+    if isinstance(resultado, dict):
+        try:
+            return len(json.dumps(resultado, separators=(",", ":")).encode())
+        except TypeError:
+            return sum(tamano_salida(parte) for parte in resultado.values())
+    if isinstance(resultado, str):
+        return len(resultado.encode())
+    if isinstance(resultado, (tuple, list)):
+        return sum(tamano_salida(parte) for parte in resultado)
+    return 0
+
+def medir(funcion, repeticiones=3, preparar=None):
+    """
+    Mide una etapa.
+
+    Los tiempos se toman sin `tracemalloc` (que los distorsiona); el pico de
+    memoria sale de una ejecución adicional trazada. Solo cuenta memoria
+    reservada por Python y NumPy: la de Arrow no es visible para tracemalloc.
+
+    Args:
+        funcion: Etapa a medir, sin argumentos
+        repeticiones: Ejecuciones cronometradas
+        preparar: Función a llamar antes de cada ejecución (p. ej. vaciar cachés)
+
+    Returns:
+        Diccionario con segundos (mínimo y mediana), pico_mb y salida_kb
+    """
+    tiempos = []
+    for _ in range(repeticiones):
+        if preparar:
+            preparar()
+        inicio = time.perf_counter()
+        resultado = funcion()
+        tiempos.append(time.perf_counter() - inicio)
+
+    if preparar:
+        preparar()
+    tracemalloc.start()
+    funcion()
+    pico = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {
+        "segundos_min": min(tiempos),
+        "segundos_mediana": statistics.median(tiempos),
+        "pico_mb": pico / 1024 ** 2,
+        "salida_kb": tamano_salida(resultado) / 1024,
+    }
+
+def ejecutar_benchmarks(directorio, repeticiones=3):
+    """
+    Corre todas las etapas sobre los datos sintéticos de `directorio`.
+
+    `utils` se importa aquí, después de fijar `CENSO_DATOS`, para que todas
+    sus rutas apunten al directorio temporal.
+
+    Returns:
+        Diccionario etapa → métricas (ver `medir`)
+    """
+    os.environ["CENSO_DATOS"] = directorio
+    os.environ["CENSO_SIN_RED"] = "1"
+    logging.getLogger("streamlit").setLevel(logging.ERROR)
+
+    import streamlit as st
+    import utils
+    from cubo import construir_cubo, conteo_por_tramos, histograma_acumulado, tramos_edad
+    from filtros import contar
+    from geometrias import capa_geojson, construir_geometrias_simplificadas
+
+    def vaciar_cache():
+        st.cache_data.clear()
+        st.cache_resource.clear()
+
+    def vaciar_cache_y_disco():
+        vaciar_cache()
+        shutil.rmtree(utils.DIR_CACHE, ignore_errors=True)
+
+    resultados = {}
+    resultados["cargar_datos (ingesta CSV)"] = medir(utils.cargar_datos, 1, vaciar_cache_y_disco)
+    resultados["cargar_datos (caché en disco)"] = medir(utils.cargar_datos, repeticiones, vaciar_cache)
+
+    regiones, comunas, censo = utils.cargar_datos()
+    region_id = int(censo['region_id'].iloc[len(censo) // 2])
+    bins_edad, labels_edad = tramos_edad(5, hasta=80)
+    etapas = {
+        "filtrar región (máscara)": lambda: censo[censo['region_id'] == region_id],
+        "censo_region (tramo contiguo)": lambda: utils.censo_region(censo, region_id),
+        "indice_bits (construcción)": lambda: utils.indice_bits(censo),
+        "conteo cruzado (máscaras)": lambda: int(((censo['sexo'] == 2) & censo['edad'].between(18, 44)
+                                                   & censo['escolaridad'].between(12, 21)).sum()),
+        "conteo cruzado (mapas de bits)": lambda: contar(
+            indice, sexo=[2], tramo_edad=['18-29', '30-44'], escolaridad=list(range(12, 22))),
+        "reagrupar edades (pd.cut)": lambda: censo.groupby(
+            [pd.cut(censo['edad'], bins_edad, right=False, labels=labels_edad), censo['sexo']],
+            observed=True).size(),
+        "reagrupar edades (histograma acumulado)": lambda: conteo_por_tramos(
+            edades, bins_edad, labels_edad, por=['sexo']),
+        "procesar_datos_comuna": lambda: utils.procesar_datos_comuna(censo),
+        "procesar_datos_region": lambda: utils.procesar_datos_region(censo),
+        "crear_datos_optimizados": lambda: utils.crear_datos_optimizados(censo),
+        "construir_cubo": lambda: construir_cubo(censo),
+    }
+    indice = utils.indice_bits(censo)
+    edades = histograma_acumulado(construir_cubo(censo), ['region_id', 'comuna_id', 'sexo'])
+    for nombre, etapa in etapas.items():
+        preparar = utils.indice_bits.clear if nombre.startswith("indice_bits") else st.cache_data.clear
+        resultados[nombre] = medir(etapa, repeticiones, preparar)
+
+    estadisticas = utils.procesar_datos_comuna(censo)
+    mapa = comunas.merge(estadisticas, on="comuna_id")
+    campos = ["poblacion_total", "edad_promedio", "edad_mediana", "pct_mujeres"]
+    etapas_mapa = {
+        "optimizar_geometrias_para_web": lambda: utils.optimizar_geometrias_para_web(comunas),
+        "preparar_datos_mapa_ligeros": lambda: utils.preparar_datos_mapa_ligeros(mapa, campos),
+        "geometrias simplificadas (3 niveles)": lambda: construir_geometrias_simplificadas(
+            regiones, comunas, os.path.join(directorio, "geometrias_bench")),
+    }
+    for nombre, etapa in etapas_mapa.items():
+        resultados[nombre] = medir(etapa, repeticiones, st.cache_data.clear)
+
+    construir_geometrias_simplificadas(regiones, comunas)
+    resultados["capa_geojson (comunas, media)"] = medir(
+        lambda: capa_geojson("comunas", "media"), repeticiones, capa_geojson.clear)
+    return resultados
+
+def imprimir_resultados(resultados, anteriores=None):
+    """Tabla de resultados; con `anteriores`, agrega la razón contra la mediana previa."""
+    print(f"{'Etapa':<40}{'min (s)':>10}{'mediana (s)':>13}{'pico (MB)':>11}{'salida (KB)':>13}"
+          + (f"{'vs. base':>10}" if anteriores else ""))
+    for nombre, m in resultados.items():
+        linea = (f"{nombre:<40}{m['segundos_min']:>10.3f}{m['segundos_mediana']:>13.3f}"
+                 f"{m['pico_mb']:>11.1f}{m['salida_kb']:>13.1f}")
+        if anteriores and nombre in anteriores:
+            linea += f"{m['segundos_mediana'] / max(anteriores[nombre]['segundos_mediana'], 1e-9):>9.2f}x"
+        print(linea)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks de los pipelines de datos y de mapas.")
+    parser.add_argument("--filas", type=int, default=500000, help="Personas del censo sintético")
+    parser.add_argument("--repeticiones", type=int, default=3, help="Ejecuciones cronometradas por etapa")
+    parser.add_argument("--semilla", type=int, default=42, help="Semilla de los datos sintéticos")
+    parser.add_argument("--json", default=None, help="Guarda los resultados en este archivo")
+    parser.add_argument("--comparar", default=None, help="Resultados previos (JSON) contra los que comparar")
+    args = parser.parse_args()
+
+    directorio = tempfile.mkdtemp(prefix="censo_bench_")
+    try:
+        print(f"Generando {args.filas:,} personas y polígonos sintéticos en {directorio}...")
+        escribir_datos_sinteticos(directorio, args.filas, args.semilla)
+        resultados = ejecutar_benchmarks(directorio, args.repeticiones)
+    finally:
+        shutil.rmtree(directorio, ignore_errors=True)
+
+    anteriores = None
+    if args.comparar:
+        with open(args.comparar, encoding="utf-8") as f:
+            anteriores = json.load(f)["resultados"]
+    imprimir_resultados(resultados, anteriores)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"filas": args.filas, "repeticiones": args.repeticiones,
+                       "resultados": resultados}, f, indent=2, ensure_ascii=False)
+        print(f"Resultados guardados en: {args.json}")
@@ -0,0 +1,123 @@
+"""
+Calentamiento de los cachés de datos.
+
+Ejecuta de antemano todas las cargas costosas (copia columnar y Arrow del
+censo, cubo, estadísticas comunales, geometrías simplificadas y sus GeoJSON,
+índices de muestreo y de filtros) para que ningún visitante pague el arranque en frío.
+
+- `python calentamiento.py` deja listos los archivos de `data/cache/` antes de
+  levantar el servidor (p. ej. en el despliegue, antes de `streamlit run`).
+- `iniciar_calentamiento()` llena en un hilo de fondo los cachés en memoria del
+  proceso del servidor; la primera página que se abre lo dispara y las demás
+  solo consultan su estado.
+- `cubo_progresivo()` entrega, mientras tanto, el cubo con lo que va leído del
+  censo, para que las páginas muestren cifras parciales en vez de esperar.
+"""
+import threading
+import time
+
+import streamlit as st
+
+from utils import (CUBO_PARCIAL, cargar_cubo, cargar_datos, cargar_estadisticas_comunales,
+                   cubo_disponible, indice_bits, indice_muestreo, obtener_geometrias)
+from geometrias import CAPAS, NIVELES_SIMPLIFICACION, capa_geojson, tamano_capa_geojson
+
+def _calentar_geojson():
+    for capa in CAPAS:
+        for nivel in NIVELES_SIMPLIFICACION:
+            capa_geojson(capa, nivel)
+            tamano_capa_geojson(capa, nivel)
+
+def _calentar_muestreo():
+    regiones, comunas, censo = cargar_datos()
+    indice_muestreo(censo, 'region_id')
+    indice_bits(censo)
+
+# Etapas en orden: primero lo que necesita el primer render de las páginas
+ETAPAS = [
+    ("Geometrías", obtener_geometrias),
+    ("Cubo de conteos", cargar_cubo),
+    ("Estadísticas comunales", cargar_estadisticas_comunales),
+    ("Geometrías para el mapa", _calentar_geojson),
+    ("Microdatos e índices de muestreo y filtros", _calentar_muestreo),
+]
+
+def calentar(estado=None):
+    """
+    Ejecuta todas las etapas de `ETAPAS` en orden.
+
+    Args:
+        estado: Diccionario de `estado_calentamiento` a actualizar (opcional)
+
+    Returns:
+        Diccionario con la duración en segundos de cada etapa
+    """
+    duraciones = {}
+    for nombre, etapa in ETAPAS:
+        if estado is not None:
+            estado["etapa"] = nombre
+        inicio = time.perf_counter()
+        etapa()
+        duraciones[nombre] = time.perf_counter() - inicio
+        if estado is not None:
+            estado["completadas"] += 1
+    return duraciones
+
+def _calentar_en_fondo(estado):
+    try:
+        calentar(estado)
+    except Exception as e:
+        estado["error"] = str(e)
+    finally:
+        estado["etapa"] = None
+        estado["fin"] = time.time()
+
+@st.cache_resource
+def iniciar_calentamiento():
+    """
+    Lanza (una sola vez por proceso) el calentamiento en un hilo de fondo.
+
+    Los cachés de `st.cache_resource` son del proceso, así que lo que carga el
+    hilo queda disponible para todas las sesiones. Si una sesión pide un dato
+    que el hilo está calculando, espera a ese mismo cálculo en vez de repetirlo.
+
+    Returns:
+        Diccionario de estado (ver `estado_calentamiento`)
+    """
+    estado = {"etapa": None, "completadas": 0, "total": len(ETAPAS),
+              "error": None, "inicio": time.time(), "fin": None}
+    threading.Thread(target=_calentar_en_fondo, args=(estado,),
+                     name="calentamiento", daemon=True).start()
+    return estado
+
+def estado_calentamiento():
+    """
+    Estado del calentamiento en segundo plano.
+
+    Returns:
+        Diccionario con `etapa` (en curso o None), `completadas`, `total`,
+        `error`, `inicio`, `fin` y `listo` (True si terminó sin errores)
+    """
+    estado = dict(iniciar_calentamiento())
+    estado["listo"] = estado["fin"] is not None and estado["error"] is None
+    return estado
+
+def cubo_progresivo():
+    """
+    Cubo de conteos parcial, para mostrar mientras el calentamiento construye el completo.
+
+    Returns:
+        Tupla (cubo, avance): el cubo con lo leído hasta ahora (None si aún no
+        hay filas) y la fracción leída del censo (None si no se conoce). Es
+        None cuando corresponde usar `cargar_cubo()`: el cubo completo ya está
+        disponible, o el calentamiento terminó o falló.
+    """
+    if cubo_disponible() or estado_calentamiento()["fin"] is not None:
+        return None
+    return CUBO_PARCIAL.cubo(), CUBO_PARCIAL.avance
+
+if __name__ == "__main__":
+    print("Calentando cachés de datos...")
+    for nombre, segundos in calentar().items():
+        print(f"  {nombre}: {segundos:.1f} s")
+    print("¡Proceso completado!")
@@ -0,0 +1,326 @@
+import threading
+
+import numpy as np
+import pandas as pd
+
+# Edad máxima del cubo: edades mayores se acumulan en la última celda
+EDAD_MAX = 100
+EDADES = np.arange(EDAD_MAX + 1)
+SEXO_ETIQUETAS = {1: "Hombre", 2: "Mujer"}
+NIVELES_CUBO = ['region_id', 'comuna_id', 'sexo', 'edad']
+
+def contar_celdas(censo, edad_max=EDAD_MAX):
+    """
+    Conteos observados por región × comuna × sexo × edad simple (sin celdas vacías).
+
+    Son aditivos: los conteos de varios bloques del censo suman los del censo
+    completo (ver `sumar_conteos`).
+    """
+    edad = censo['edad'].clip(upper=edad_max).rename('edad')
+    return censo.groupby(['region_id', 'comuna_id', 'sexo', edad]).size()
+
+def sumar_conteos(conteos):
+    """Suma una lista de conteos de `contar_celdas` (de distintos bloques del censo)."""
+    conteos = [c for c in conteos if c is not None]
+    if len(conteos) == 1:
+        return conteos[0]
+    return pd.concat(conteos).groupby(level=NIVELES_CUBO).sum()
+
+def densificar_cubo(conteos, edad_max=EDAD_MAX):
+    """
+    Cubo denso a partir de los conteos de `contar_celdas`.
+
+    Cada par (región, comuna) observado tiene una fila por sexo y por edad
+    entre 0 y `edad_max`, aunque el conteo sea cero.
+    """
+    pares = conteos.index.droplevel(['sexo', 'edad']).unique().sort_values()
+    sexos = np.array(sorted(set(conteos.index.get_level_values('sexo')) | set(SEXO_ETIQUETAS)))
+    edades = np.arange(edad_max + 1)
+    celdas_por_par = len(sexos) * len(edades)
+
+    indice = pd.MultiIndex.from_arrays([
+        np.repeat(pares.get_level_values('region_id'), celdas_por_par),
+        np.repeat(pares.get_level_values('comuna_id'), celdas_por_par),
+        np.tile(np.repeat(sexos, len(edades)), len(pares)),
+        np.tile(edades, len(pares) * len(sexos)),
+    ], names=NIVELES_CUBO)
+
+    cubo = conteos.reindex(indice, fill_value=0).rename('poblacion').reset_index()
+    cubo['region_id'] = cubo['region_id'].astype('int8')
+    cubo['comuna_id'] = cubo['comuna_id'].astype('int32')
+    cubo['sexo'] = cubo['sexo'].astype('uint8')
+    cubo['edad'] = cubo['edad'].astype('uint8')
+    cubo['poblacion'] = cubo['poblacion'].astype('int64')
+    return cubo
+
+def construir_cubo(censo, edad_max=EDAD_MAX):
+    """
+    Construye el cubo denso de conteos región × comuna × sexo × edad simple.
+
+    Cada par (región, comuna) observado en el censo tiene una fila por sexo y
+    por edad entre 0 y `edad_max`, aunque el conteo sea cero. Con ~350 comunas
+    son unas 70 mil celdas, contra ~17 millones de filas del microdato.
+
+    Args:
+        censo: DataFrame del censo con `region_id`, `comuna_id`, `sexo` y `edad`
+        edad_max: Última edad del cubo (las mayores se suman en ella)
+
+    Returns:
+        DataFrame con columnas region_id, comuna_id, sexo, edad, poblacion
+    """
+    return densificar_cubo(contar_celdas(censo, edad_max), edad_max)
+
+class CuboParcial:
+    """
+    Cubo de conteos que se completa bloque a bloque mientras se lee el censo.
+
+    Como los conteos son aditivos, el cubo de lo leído hasta ahora es la suma
+    de los de cada bloque y, al terminar la lectura, coincide con
+    `construir_cubo` sobre el censo completo. Es seguro entre hilos: la carga
+    agrega bloques mientras las páginas piden instantáneas.
+    """
+
+    def __init__(self, edad_max=EDAD_MAX):
+        self.edad_max = edad_max
+        self._candado = threading.Lock()
+        self.reiniciar()
+
+    def reiniciar(self):
+        """Descarta lo acumulado (al empezar una nueva lectura del censo)."""
+        with self._candado:
+            self._conteos = None
+            self._bloques = 0
+            self._instantanea = (0, None)
+            self.filas = 0
+            self.avance = None
+
+    def agregar(self, conteos, avance=None):
+        """
+        Suma los conteos de un bloque ya leído.
+
+        Args:
+            conteos: Conteos del bloque (`contar_celdas`)
+            avance: Fracción del censo leída hasta ahora (None si no se conoce)
+        """
+        with self._candado:
+            self._conteos = sumar_conteos([self._conteos, conteos])
+            self._bloques += 1
+            self.filas += int(conteos.sum())
+            self.avance = avance
+
+    def cubo(self):
+        """Cubo denso con lo acumulado hasta ahora (None si todavía no hay filas)."""
+        with self._candado:
+            bloques, conteos = self._bloques, self._conteos
+            if self._instantanea[0] == bloques:
+                return self._instantanea[1]
+        cubo = densificar_cubo(conteos, self.edad_max) if conteos is not None else None
+        with self._candado:
+            if self._bloques == bloques:
+                self._instantanea = (bloques, cubo)
+        return cubo
+
+def filtrar_cubo(cubo, region_id=None, comuna_id=None):
+    """Devuelve las celdas del cubo de una región y/o comuna (None = todas)."""
+    if region_id is not None:
+        cubo = cubo[cubo['region_id'] == region_id]
+    if comuna_id is not None:
+        cubo = cubo[cubo['comuna_id'] == comuna_id]
+    return cubo
+
+def histograma_edad(cubo, clave=None):
+    """
+    Histograma de edad simple a partir del cubo.
+
+    Args:
+        cubo: Cubo de conteos (o un subconjunto)
+        clave: Columna(s) por la que separar los histogramas (None = uno total)
+
+    Returns:
+        DataFrame con una fila por grupo y una columna por edad
+    """
+    if clave is None:
+        hist = cubo.groupby('edad')['poblacion'].sum()
+        return hist.reindex(EDADES, fill_value=0).to_frame().T
+    hist = cubo.groupby([clave, 'edad'])['poblacion'].sum().unstack('edad', fill_value=0)
+    return hist.reindex(columns=EDADES, fill_value=0)
+
+def cuantiles_histograma(hist, q):
+    """
+    Cuantil `q` de cada fila de un histograma de edades simples.
+
+    Usa la misma interpolación lineal que `pandas.Series.quantile`, por lo que
+    la mediana coincide con `median()` calculada sobre los microdatos.
+    """
+    conteos = np.asarray(hist, dtype=np.int64)
+    edades = np.asarray(hist.columns, dtype=float)
+    acumulado = conteos.cumsum(axis=1)
+    n = acumulado[:, -1]
+    posicion = q * np.maximum(n - 1, 0)
+    bajo = np.floor(posicion).astype(np.int64)
+    alto = np.ceil(posicion).astype(np.int64)
+    # El valor en la posición k (0-based) es la primera edad cuyo acumulado supera k
+    edad_bajo = edades[(acumulado > bajo[:, None]).argmax(axis=1)]
+    edad_alto = edades[(acumulado > alto[:, None]).argmax(axis=1)]
+    resultado = edad_bajo + (edad_alto - edad_bajo) * (posicion - bajo)
+    return pd.Series(np.where(n > 0, resultado, np.nan), index=hist.index)
+
+def resumen_cubo(cubo, clave, estadisticas_edad=('mean', 'median')):
+    """
+    Resumen por `clave` equivalente al de `utils._resumen_poblacion`, pero exacto y desde el cubo.
+
+    Args:
+        cubo: Cubo de conteos (o un subconjunto)
+        clave: 'region_id' o 'comuna_id'
+        estadisticas_edad: Subconjunto ordenado de 'mean', 'median', 'std'
+
+    Returns:
+        DataFrame con poblacion_total, estadísticas de edad y pct_mujeres
+    """
+    hist = histograma_edad(cubo, clave)
+    conteos = hist.to_numpy(dtype=float)
+    edades = hist.columns.to_numpy(dtype=float)
+    n = conteos.sum(axis=1)
+    hist = hist[n > 0]
+    conteos, n = conteos[n > 0], n[n > 0]
+
+    media = conteos @ edades / n
+    # Desviación estándar muestral (ddof=1), como `Series.std`
+    varianza = (conteos * (edades[None, :] - media[:, None]) ** 2).sum(axis=1) / np.maximum(n - 1, 1)
+    estadisticas = {
+        'mean': ('edad_promedio', lambda: media),
+        'median': ('edad_mediana', lambda: cuantiles_histograma(hist, 0.5).to_numpy()),
+        'std': ('edad_std', lambda: np.sqrt(varianza)),
+    }
+
+    resumen = pd.DataFrame({'poblacion_total': n.astype(np.int64)}, index=hist.index)
+    for estadistica in estadisticas_edad:
+        nombre, calcular = estadisticas[estadistica]
+        resumen[nombre] = calcular()
+    mujeres = cubo[cubo['sexo'] == 2].groupby(clave)['poblacion'].sum()
+    resumen['pct_mujeres'] = mujeres.reindex(resumen.index, fill_value=0) / n * 100
+    return resumen.round(2).reset_index()
+
+def resumen_comunal(cubo):
+    """
+    Estadísticas exactas de todas las comunas (población, edad promedio y mediana, % mujeres).
+
+    Se calcula una sola vez sobre el cubo completo; la mediana sale del
+    histograma de edades simples. Incluye `region_id` para poder servir una
+    región con un filtro sobre ~350 filas.
+    """
+    resumen = resumen_cubo(cubo, 'comuna_id', ['mean', 'median'])
+    region_por_comuna = cubo.drop_duplicates('comuna_id').set_index('comuna_id')['region_id']
+    resumen.insert(1, 'region_id', resumen['comuna_id'].map(region_por_comuna).astype('int8'))
+    return resumen.sort_values(['region_id', 'comuna_id']).reset_index(drop=True)
+
+def histograma_acumulado(cubo, por=None):
+    """
+    Histograma de edad acumulado: la columna `a` cuenta las personas con edad < a.
+
+    La población de cualquier tramo de edades es la diferencia de dos
+    columnas, así que reagrupar con otros cortes cuesta O(tramos) por grupo,
+    sin volver a recorrer el cubo ni los microdatos.
+
+    Args:
+        cubo: Cubo de conteos (o un subconjunto)
+        por: Columnas por las que separar los histogramas (None = uno total)
+
+    Returns:
+        DataFrame con una fila por grupo y columnas 0..EDAD_MAX + 1
+    """
+    por = list(por or [])
+    if por:
+        hist = cubo.groupby(por + ['edad'])['poblacion'].sum().unstack('edad', fill_value=0)
+    else:
+        hist = cubo.groupby('edad')['poblacion'].sum().to_frame('total').T
+    conteos = hist.reindex(columns=EDADES, fill_value=0).to_numpy(dtype=np.int64)
+    acumulado = np.concatenate([np.zeros((len(conteos), 1), dtype=np.int64), conteos.cumsum(axis=1)], axis=1)
+    return pd.DataFrame(acumulado, index=hist.index, columns=np.arange(EDAD_MAX + 2))
+
+def contar_entre_edades(acumulado, bins, labels):
+    """
+    Población de cada tramo de edad a partir de un histograma acumulado.
+
+    Los tramos son [bins[i], bins[i + 1]), como la columna `grupo_edad` y
+    los mapas de bits de `filtros.py`. Un borde sobre `EDAD_MAX` incluye a
+    todas las edades mayores, que el cubo acumula en la última.
+
+    Returns:
+        DataFrame con una fila por grupo y una columna por etiqueta
+    """
+    bordes = np.clip(np.asarray(bins), 0, acumulado.shape[1] - 1)
+    valores = acumulado.to_numpy()[:, bordes]
+    return pd.DataFrame(np.diff(valores, axis=1), index=acumulado.index, columns=labels)
+
+def tramos_edad(ancho, hasta=80, abierto=True):
+    """
+    Bordes y etiquetas de tramos de `ancho` años desde los 0.
+
+    Con `abierto`, el último tramo empieza en `hasta` y no tiene tope
+    ('80+'); si no, los tramos cubren hasta `hasta` años inclusive. Los
+    bordes son para `contar_entre_edades` con tramos [a, b).
+
+    Returns:
+        Tupla (bordes, etiquetas)
+    """
+    ultimo = [hasta, EDAD_MAX + 1] if abierto else [hasta + 1]
+    bordes = sorted(set(range(0, hasta + (0 if abierto else 1), ancho)) | set(ultimo))
+    etiquetas = [f"{a}-{b - 1}" if b - 1 > a else f"{a}" for a, b in zip(bordes, bordes[1:])]
+    if abierto:
+        etiquetas[-1] = f"{hasta}+"
+    return bordes, etiquetas
+
+def conteo_por_tramos(acumulado, bins, labels, por=None):
+    """
+    Población por tramo de edad desde un histograma acumulado, en formato largo.
+
+    Args:
+        acumulado: Histograma acumulado (`histograma_acumulado`), con `por` entre sus niveles
+        bins: Bordes de los tramos [a, b)
+        labels: Etiquetas de los tramos
+        por: Niveles por los que separar (los demás se suman); 'sexo' sale como `sexo_cat`
+
+    Returns:
+        DataFrame con las columnas de `por`, `grupo_edad` y `poblacion`
+    """
+    por = list(por or [])
+    acumulado = acumulado.groupby(level=por).sum() if por else acumulado.sum().to_frame('total').T
+    conteos = contar_entre_edades(acumulado, bins, labels)
+    conteos.columns = pd.CategoricalIndex(labels, categories=labels, ordered=True, name='grupo_edad')
+    if por:
+        largo = conteos.stack().rename('poblacion').reset_index()
+    else:
+        largo = pd.DataFrame({'grupo_edad': conteos.columns, 'poblacion': conteos.iloc[0].to_numpy()})
+    claves = [c for c in por if c != 'sexo'] + ['grupo_edad']
+    if 'sexo' in por:
+        largo['sexo_cat'] = pd.Categorical(largo['sexo'].map(SEXO_ETIQUETAS),
+                                           categories=list(SEXO_ETIQUETAS.values()))
+        claves.append('sexo_cat')
+    return largo.sort_values(claves)[claves + ['poblacion']].reset_index(drop=True)
+
+def conteo_por_grupos(cubo, bins, labels, por=None, por_sexo=False):
+    """
+    Población por grupos de edad [a, b) desde el cubo.
+
+    Para reagrupar varias veces el mismo cubo conviene guardar su
+    `histograma_acumulado` y usar `conteo_por_tramos`.
+
+    Args:
+        cubo: Cubo de conteos (o un subconjunto)
+        bins: Bordes de los grupos
+        labels: Etiquetas de los grupos
+        por: Columnas adicionales de agrupación (p. ej. ['region_id'])
+        por_sexo: Si se separa además por `sexo_cat`
+
+    Returns:
+        DataFrame con las columnas de agrupación, `grupo_edad` y `poblacion`
+    """
+    claves = list(por or []) + (['sexo'] if por_sexo else [])
+    return conteo_por_tramos(histograma_acumulado(cubo, claves), bins, labels, claves)
+
+def conteo_por_sexo(cubo, por=None):
+    """Población por `sexo_cat` (y opcionalmente por otras columnas) desde el cubo."""
+    celdas = cubo.assign(sexo_cat=cubo['sexo'].map(SEXO_ETIQUETAS))
+    claves = list(por or []) + ['sexo_cat']
+    return celdas.groupby(claves)['poblacion'].sum().reset_index()
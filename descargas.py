@@ -0,0 +1,234 @@
+"""
+Descarga de los archivos de datos publicados en el release del repositorio.
+
+Cada archivo se baja una sola vez al directorio local de datos y desde ahí se
+lee en adelante. Las descargas se reanudan donde quedaron (HTTP Range), se
+reintentan ante errores de red y se verifican contra `SHA256SUMS`.
+
+Variables de entorno:
+    CENSO_DATOS    Directorio local de datos (por defecto `data`)
+    CENSO_ESPEJO   URL base de un espejo del release (por defecto GitHub)
+    CENSO_SIN_RED  Si vale 1, nunca se accede a la red: solo se usan archivos locales
+
+Ejemplos:
+    python descargas.py                 # baja lo que falte y registra sus checksums
+    python descargas.py --verificar     # recalcula los checksums de lo ya bajado
+    CENSO_ESPEJO=http://localhost:8000 python descargas.py
+"""
+import argparse
+import hashlib
+import os
+import re
+import time
+
+import requests
+
+URL_RELEASE = "https://github.com/lsoto10/tarea_3/releases/download/data"
+URL_BASE = os.environ.get("CENSO_ESPEJO", URL_RELEASE).rstrip("/")
+DIR_DATOS = os.environ.get("CENSO_DATOS", "data")
+SIN_RED = os.environ.get("CENSO_SIN_RED", "") not in ("", "0")
+
+# Archivos del release, por nombre lógico
+ARCHIVOS = {
+    "censo": "Microdato_Censo2017-Personas.csv",
+    "regiones": "Regiones.zip",
+    "comunas": "Comunas.zip",
+}
+
+# Checksums conocidos, en el formato de `sha256sum` (`<hash>  <archivo>`)
+RUTA_CHECKSUMS = os.path.join(DIR_DATOS, "SHA256SUMS")
+
+def url_archivo(nombre):
+    """URL del archivo lógico `nombre` en el release (o en el espejo configurado)."""
+    return f"{URL_BASE}/{ARCHIVOS[nombre]}"
+
+def ruta_archivo(nombre):
+    """Ruta local del archivo lógico `nombre` dentro del directorio de datos."""
+    return os.path.join(DIR_DATOS, ARCHIVOS[nombre])
+
+def sha256_archivo(ruta, bloque=1024 ** 2):
+    """SHA-256 de un archivo, leído por bloques."""
+    h = hashlib.sha256()
+    with open(ruta, "rb") as f:
+        for parte in iter(lambda: f.read(bloque), b""):
+            h.update(parte)
+    return h.hexdigest()
+
+def leer_checksums(ruta=RUTA_CHECKSUMS):
+    """Diccionario archivo → SHA-256 leído de `ruta` (vacío si no existe)."""
+    if not os.path.exists(ruta):
+        return {}
+    checksums = {}
+    with open(ruta, encoding="utf-8") as f:
+        for linea in f:
+            if linea.strip():
+                valor, archivo = linea.split(maxsplit=1)
+                checksums[archivo.strip().lstrip("*")] = valor.lower()
+    return checksums
+
+def registrar_checksum(archivo, valor, ruta=RUTA_CHECKSUMS):
+    """Agrega (o reemplaza) el checksum de `archivo` en `ruta`."""
+    checksums = leer_checksums(ruta)
+    checksums[archivo] = valor
+    os.makedirs(os.path.dirname(ruta) or ".", exist_ok=True)
+    with open(ruta, "w", encoding="utf-8") as f:
+        for nombre in sorted(checksums):
+            f.write(f"{checksums[nombre]}  {nombre}\n")
+
+def _tamano_total(respuesta, desde):
+    """Tamaño completo del archivo según la respuesta (None si el servidor no lo informa)."""
+    rango = respuesta.headers.get("Content-Range", "")
+    coincidencia = re.match(r"bytes \d+-\d+/(\d+)", rango)
+    if coincidencia:
+        return int(coincidencia.group(1))
+    largo = respuesta.headers.get("Content-Length")
+    return desde + int(largo) if largo is not None else None
+
+def _descargar_parcial(url, parcial, tiempo_espera, bloque):
+    """
+    Continúa la descarga de `url` en `parcial` desde el byte en que quedó.
+
+    Si el servidor no acepta rangos (responde 200) se empieza de cero. Lanza
+    `IOError` si la conexión se corta antes de completar el archivo.
+    """
+    desde = os.path.getsize(parcial) if os.path.exists(parcial) else 0
+    encabezados = {"Range": f"bytes={desde}-"} if desde else {}
+    with requests.get(url, headers=encabezados, stream=True, timeout=tiempo_espera) as respuesta:
+        if respuesta.status_code == 416:
+            # El rango pedido empieza al final: el parcial ya está completo
+            return
+        respuesta.raise_for_status()
+        if respuesta.status_code != 206:
+            desde = 0
+        total = _tamano_total(respuesta, desde)
+        with open(parcial, "ab" if desde else "wb") as f:
+            for parte in respuesta.iter_content(chunk_size=bloque):
+                f.write(parte)
+    if total is not None and os.path.getsize(parcial) != total:
+        raise IOError(f"Descarga incompleta de {url}: {os.path.getsize(parcial):,} de {total:,} bytes")
+
+def descargar(url, destino, sha256=None, reintentos=4, espera=2.0, tiempo_espera=30,
+              bloque=1024 ** 2, sin_red=None):
+    """
+    Baja `url` a `destino` si todavía no existe, reanudando descargas interrumpidas.
+
+    Los bytes se escriben en `destino + '.part'`, que solo se renombra a
+    `destino` cuando el archivo está completo y su checksum es correcto, así
+    que un archivo presente en `destino` siempre está íntegro.
+
+    Args:
+        url: URL del archivo
+        destino: Ruta local
+        sha256: Checksum esperado (None = no se verifica)
+        reintentos: Intentos ante errores de red (cada uno reanuda el anterior)
+        espera: Segundos antes del primer reintento (se duplica en cada uno)
+        tiempo_espera: Timeout de conexión y lectura, en segundos
+        bloque: Bytes por escritura
+        sin_red: Si es True no se accede a la red (por defecto `CENSO_SIN_RED`)
+
+    Returns:
+        Ruta local del archivo
+    """
+    if os.path.exists(destino):
+        return destino
+    if SIN_RED if sin_red is None else sin_red:
+        raise FileNotFoundError(f"No está {destino} y el modo sin red (CENSO_SIN_RED) impide descargarlo")
+
+    os.makedirs(os.path.dirname(destino) or ".", exist_ok=True)
+    parcial = destino + ".part"
+    for intento in range(reintentos):
+        try:
+            _descargar_parcial(url, parcial, tiempo_espera, bloque)
+            break
+        except (requests.RequestException, IOError):
+            if intento == reintentos - 1:
+                raise
+            time.sleep(espera * 2 ** intento)
+
+    if sha256 is not None:
+        obtenido = sha256_archivo(parcial)
+        if obtenido != sha256.lower():
+            os.remove(parcial)
+            raise ValueError(f"Checksum incorrecto en {url}: {obtenido} (se esperaba {sha256})")
+    os.replace(parcial, destino)
+    return destino
+
+def _ruta_origen(ruta):
+    return ruta + ".origen"
+
+def registrar_origen(ruta, url):
+    """
+    Anota junto a `ruta` la URL de la que se bajó y el tamaño y la fecha del archivo.
+
+    Ver `origen_descarga`.
+    """
+    info = os.stat(ruta)
+    with open(_ruta_origen(ruta), "w", encoding="utf-8") as f:
+        f.write(f"{url}\n{info.st_size}:{info.st_mtime_ns}\n")
+
+def origen_descarga(ruta):
+    """
+    URL de la que se bajó `ruta`, o None si no se bajó del release o cambió desde entonces.
+
+    Permite que la versión de los datos de un archivo recién bajado siga
+    siendo la misma que antes de bajarlo (la URL).
+    """
+    try:
+        with open(_ruta_origen(ruta), encoding="utf-8") as f:
+            url, firma = f.read().split()
+        info = os.stat(ruta)
+    except (OSError, ValueError):
+        return None
+    return url if firma == f"{info.st_size}:{info.st_mtime_ns}" else None
+
+def obtener_archivo(nombre):
+    """
+    Ruta local del archivo lógico `nombre`, bajándolo del release si falta.
+
+    Se verifica contra `SHA256SUMS` si allí está su checksum; si no, se
+    registra el de la descarga para poder verificarla después.
+    """
+    destino = ruta_archivo(nombre)
+    if os.path.exists(destino):
+        return destino
+    esperado = leer_checksums().get(ARCHIVOS[nombre])
+    descargar(url_archivo(nombre), destino, sha256=esperado)
+    registrar_origen(destino, url_archivo(nombre))
+    if esperado is None:
+        registrar_checksum(ARCHIVOS[nombre], sha256_archivo(destino))
+    return destino
+
+def verificar_archivos():
+    """
+    Compara los archivos locales con `SHA256SUMS`.
+
+    Returns:
+        Diccionario nombre lógico → 'ok', 'falta', 'sin checksum' o 'incorrecto'
+    """
+    checksums = leer_checksums()
+    estado = {}
+    for nombre, archivo in ARCHIVOS.items():
+        ruta = ruta_archivo(nombre)
+        if not os.path.exists(ruta):
+            estado[nombre] = "falta"
+        elif archivo not in checksums:
+            estado[nombre] = "sin checksum"
+        else:
+            estado[nombre] = "ok" if sha256_archivo(ruta) == checksums[archivo] else "incorrecto"
+    return estado
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Baja al directorio de datos los archivos del release.")
+    parser.add_argument("--verificar", action="store_true", help="Solo verifica los archivos ya bajados")
+    args = parser.parse_args()
+
+    if args.verificar:
+        estado = verificar_archivos()
+        for nombre, resultado in estado.items():
+            print(f"  {ARCHIVOS[nombre]}: {resultado}")
+        raise SystemExit(1 if "incorrecto" in estado.values() else 0)
+
+    for nombre in ARCHIVOS:
+        print(f"  {ARCHIVOS[nombre]} ← {url_archivo(nombre)}")
+        print(f"    {obtener_archivo(nombre)}")
+    print("¡Proceso completado!")
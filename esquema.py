@@ -0,0 +1,7 @@
+# Esquema del CSV del censo, sin dependencias de la app: lo usan tanto
+# `utils.py` como los scripts de línea de comandos (ver `reducirdatos.py`).
+
+# Columnas del censo que usa la aplicación y su nombre interno
+COL_MAP = {"REGION": "region_id", "COMUNA": "comuna_id", "P08": "sexo",
+           "P09": "edad", "P16": "trabajo", "ESCOLARIDAD": "escolaridad"}
+DTYPES_CENSO = {"REGION": "int8", "COMUNA": "int32", "P08": "uint8", "P09": "uint8"}
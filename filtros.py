@@ -0,0 +1,182 @@
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+from tramos import construir_indice_tramos
+
+# Atributos con un mapa de bits por valor. Región y comuna no lo necesitan: en
+# el censo ordenado cada una ya es un tramo contiguo de filas.
+ATRIBUTOS_BITS = ['sexo', 'tramo_edad', 'trabajo', 'escolaridad']
+
+# Valor con que se indexan los datos faltantes de `trabajo` y `escolaridad`
+SIN_DATO = -1
+
+# Índice de mapas de bits: `bits[atributo][valor]` tiene el bit i encendido si
+# la fila i del censo tiene ese valor (empaquetado con `np.packbits`, orden de
+# bits 'little'), con los valores en orden. `tramos` es el `IndiceTramos` del
+# mismo censo.
+IndiceBits = namedtuple("IndiceBits", ["filas", "tramos", "bits"])
+
+# Bits encendidos de cada byte posible (para numpy < 2, sin `np.bitwise_count`)
+_BITS_POR_BYTE = np.unpackbits(np.arange(256, dtype=np.uint8)[:, None], axis=1).sum(axis=1)
+
+def _contar_bits(bytes_):
+    """Cantidad de bits encendidos en un arreglo de bytes."""
+    if hasattr(np, 'bitwise_count'):
+        return int(np.bitwise_count(bytes_).sum(dtype=np.int64))
+    return int(_BITS_POR_BYTE[bytes_].sum(dtype=np.int64))
+
+def tramo_edad(edad, bins):
+    """
+    Número de tramo de edad de cada fila.
+
+    Los tramos son [bins[i], bins[i + 1]) y el último queda abierto, como
+    indican las etiquetas de `GRUPO_EDAD_LABELS` ('0-17', ..., '65+').
+    """
+    return np.searchsorted(np.asarray(bins[1:-1]), np.asarray(edad), side='right').astype(np.int8)
+
+def _valores_atributo(censo, atributo, bins):
+    """Valores de `atributo` por fila, listos para indexar (faltantes como `SIN_DATO`)."""
+    if atributo == 'tramo_edad':
+        return tramo_edad(censo['edad'].to_numpy(), bins)
+    serie = censo[atributo]
+    if serie.hasnans:
+        return serie.to_numpy(dtype=np.int32, na_value=SIN_DATO)
+    return serie.to_numpy()
+
+def construir_indice_bits(censo, bins, labels):
+    """
+    Construye un mapa de bits por cada valor de `ATRIBUTOS_BITS`.
+
+    Cada mapa ocupa un bit por persona (~2 MB con el censo completo), así que
+    cualquier combinación de filtros se resuelve con AND/OR sobre arreglos de
+    bytes y un conteo de bits, sin tocar las columnas del censo.
+
+    Args:
+        censo: DataFrame del censo ordenado por región y comuna (ver `tramos.py`)
+        bins: Bordes de los tramos de edad
+        labels: Etiquetas de los tramos de edad
+
+    Returns:
+        IndiceBits
+    """
+    tramos = construir_indice_tramos(censo)
+    bits = {}
+    for atributo in ATRIBUTOS_BITS:
+        valores = _valores_atributo(censo, atributo, bins)
+        # Los tramos de edad se indexan por su etiqueta; el resto, por su código
+        clave = (lambda v: labels[v]) if atributo == 'tramo_edad' else (lambda v: v)
+        codigos = sorted(pd.unique(valores).tolist(), key=lambda v: (v == SIN_DATO, v))
+        bits[atributo] = {clave(v): np.packbits(valores == v, bitorder='little') for v in codigos}
+    return IndiceBits(len(censo), tramos, bits)
+
+def valores_atributo(indice, atributo):
+    """Valores indexados de `atributo`, en orden (`SIN_DATO` al final)."""
+    return list(indice.bits[atributo])
+
+def region_por_comuna(indice):
+    """Región de cada comuna indexada (Series comuna_id → region_id, en el orden del censo)."""
+    tramos = indice.tramos
+    posicion = np.searchsorted(tramos.inicio_region, tramos.inicio_comuna[:-1], side='right') - 1
+    return pd.Series(tramos.regiones[posicion], index=pd.Index(tramos.comunas, name='comuna_id'),
+                     name='region_id')
+
+def rangos_seleccion(indice, regiones=None, comunas=None):
+    """
+    Tramos de filas de la selección geográfica.
+
+    Args:
+        indice: IndiceBits
+        regiones: Regiones a incluir (None = todas)
+        comunas: Comunas a incluir (None = todas las de `regiones`)
+
+    Returns:
+        Lista de (region_id, inicio, fin)
+    """
+    tramos = indice.tramos
+    region_de_comuna = region_por_comuna(indice).to_numpy()
+    if comunas is not None:
+        elegidas = np.isin(tramos.comunas, list(comunas))
+        if regiones is not None:
+            elegidas &= np.isin(region_de_comuna, list(regiones))
+        return [(region_de_comuna[j].item(), int(tramos.inicio_comuna[j]), int(tramos.inicio_comuna[j + 1]))
+                for j in np.flatnonzero(elegidas)]
+    elegidas = np.arange(len(tramos.regiones))
+    if regiones is not None:
+        elegidas = np.flatnonzero(np.isin(tramos.regiones, list(regiones)))
+    return [(tramos.regiones[i].item(), int(tramos.inicio_region[i]), int(tramos.inicio_region[i + 1]))
+            for i in elegidas]
+
+def _mascara_tramo(indice, filtros, inicio, fin):
+    """
+    Bytes del mapa de bits de las filas [inicio, fin) que cumplen `filtros`.
+
+    Devuelve (primer byte, arreglo de bytes): el AND entre atributos del OR
+    de los valores pedidos en cada uno, con los bits fuera del tramo apagados.
+    """
+    b0, b1 = inicio // 8, (fin + 7) // 8
+    mascara = np.full(b1 - b0, 0xFF, dtype=np.uint8)
+    for atributo, valores in filtros.items():
+        if valores is None:
+            continue
+        union = np.zeros(b1 - b0, dtype=np.uint8)
+        for valor in valores:
+            bits = indice.bits[atributo].get(valor)
+            if bits is not None:
+                union |= bits[b0:b1]
+        mascara &= union
+    if len(mascara):
+        mascara[0] &= (0xFF << (inicio - 8 * b0)) & 0xFF
+        mascara[-1] &= (1 << (fin - 8 * (b1 - 1))) - 1
+    return b0, mascara
+
+def contar(indice, regiones=None, comunas=None, **filtros):
+    """
+    Personas que cumplen todos los filtros.
+
+    Args:
+        indice: IndiceBits
+        regiones, comunas: Selección geográfica (ver `rangos_seleccion`)
+        **filtros: Atributo de `ATRIBUTOS_BITS` → valores aceptados (None = sin filtro)
+
+    Returns:
+        Cantidad de personas
+    """
+    return int(contar_por_region(indice, regiones, comunas, **filtros).sum())
+
+def contar_por_region(indice, regiones=None, comunas=None, **filtros):
+    """Personas que cumplen los filtros en cada región de la selección (Series por `region_id`)."""
+    conteos = {}
+    for region_id, inicio, fin in rangos_seleccion(indice, regiones, comunas):
+        _, mascara = _mascara_tramo(indice, filtros, inicio, fin)
+        conteos[region_id] = conteos.get(region_id, 0) + _contar_bits(mascara)
+    return pd.Series(conteos, dtype='int64', name='poblacion').rename_axis('region_id')
+
+def contar_por(indice, atributo, regiones=None, comunas=None, **filtros):
+    """Personas que cumplen los filtros, separadas por cada valor de `atributo` (Series)."""
+    valores = valores_atributo(indice, atributo)
+    conteos = np.zeros(len(valores), dtype=np.int64)
+    for _, inicio, fin in rangos_seleccion(indice, regiones, comunas):
+        b0, mascara = _mascara_tramo(indice, filtros, inicio, fin)
+        for k, valor in enumerate(valores):
+            conteos[k] += _contar_bits(mascara & indice.bits[atributo][valor][b0:b0 + len(mascara)])
+    return pd.Series(conteos, index=pd.Index(valores, name=atributo), name='poblacion')
+
+def posiciones(indice, regiones=None, comunas=None, limite=None, **filtros):
+    """
+    Posiciones (para `censo.iloc`) de las filas que cumplen los filtros, en orden.
+
+    Args:
+        limite: Cantidad máxima de posiciones a devolver (None = todas)
+    """
+    partes, total = [], 0
+    for _, inicio, fin in rangos_seleccion(indice, regiones, comunas):
+        b0, mascara = _mascara_tramo(indice, filtros, inicio, fin)
+        filas = np.flatnonzero(np.unpackbits(mascara, bitorder='little')) + 8 * b0
+        partes.append(filas)
+        total += len(filas)
+        if limite is not None and total >= limite:
+            break
+    filas = np.concatenate(partes) if partes else np.array([], dtype=np.int64)
+    return filas[:limite] if limite is not None else filas
@@ -0,0 +1,234 @@
+import json
+import os
+from collections import namedtuple
+
+import folium
+import geopandas as gpd
+import numpy as np
+import shapely
+import streamlit as st
+from branca.element import MacroElement
+from folium.features import GeoJsonStyleMapper
+from folium.map import Layer
+from folium.utilities import get_obj_in_upper_tree
+from jinja2 import Template
+
+from instrumentacion import instrumentado
+from utils import DIR_CACHE, DIR_PAQUETE, cargar_geometrias, obtener_geometrias
+
+# Geometrías simplificadas por capa y nivel de detalle
+DIR_GEOMETRIAS = os.path.join(DIR_CACHE, "geometrias")
+CAPAS = ("regiones", "comunas")
+ID_POR_CAPA = {"regiones": "region_id", "comunas": "comuna_id"}
+
+# Tolerancia de simplificación (grados, EPSG:4326) por nivel de detalle
+NIVELES_SIMPLIFICACION = {
+    "baja": 0.02,
+    "media": 0.005,
+    "alta": 0.001,
+}
+
+# Zoom máximo de Leaflet para el que basta cada nivel
+ZOOM_POR_NIVEL = {"baja": 5, "media": 8, "alta": 18}
+
+# Cuantización de coordenadas del GeoJSON (4 decimales ≈ 11 m) y tamaño
+# máximo del payload de geometrías que se envía al navegador
+DECIMALES_COORDENADAS = 4
+PRESUPUESTO_PAYLOAD_MB = 8
+
+# Payload de una capa: ids de sus elementos y la geometría GeoJSON de cada uno,
+# ya serializada (texto), en el mismo orden
+CapaGeojson = namedtuple("CapaGeojson", ["id_campo", "ids", "geometrias"])
+
+# GeoJSON de una vista: el FeatureCollection serializado (`texto`) y sus
+# elementos solo con propiedades (`features`, con geometría None), para estilos y tooltips
+GeojsonVista = namedtuple("GeojsonVista", ["texto", "features"])
+
+def nivel_por_zoom(zoom):
+    """Elige el nivel de detalle más liviano que se ve bien con el zoom dado."""
+    for nivel, zoom_max in ZOOM_POR_NIVEL.items():
+        if zoom <= zoom_max:
+            return nivel
+    return "alta"
+
+def simplificar_geometrias(gdf, tolerancia):
+    """
+    Simplifica un conjunto de polígonos preservando la topología entre vecinos.
+
+    Usa simplificación de cobertura (los bordes compartidos se simplifican una
+    sola vez, sin huecos ni traslapes) y conserva anillos interiores y todas
+    las partes de los multipolígonos, incluidas las islas. Si la cobertura no
+    es válida, cae a `simplify(preserve_topology=True)` por geometría.
+    """
+    gdf = gdf.copy()
+    try:
+        gdf["geometry"] = gdf.geometry.simplify_coverage(tolerancia)
+    except Exception:
+        gdf["geometry"] = gdf.geometry.simplify(tolerancia, preserve_topology=True)
+    gdf["geometry"] = gdf.geometry.make_valid()
+    return gdf
+
+def _ruta_geometrias(capa, nivel, destino=DIR_GEOMETRIAS):
+    return os.path.join(destino, f"{capa}_{nivel}.parquet")
+
+def construir_geometrias_simplificadas(regiones, comunas, destino=DIR_GEOMETRIAS):
+    """
+    Genera en disco (GeoParquet) todas las capas en todos los niveles de detalle.
+
+    Args:
+        regiones: GeoDataFrame de regiones en EPSG:4326
+        comunas: GeoDataFrame de comunas en EPSG:4326
+        destino: Directorio de salida
+
+    Returns:
+        Lista de archivos escritos
+    """
+    os.makedirs(destino, exist_ok=True)
+    escritos = []
+    for capa, gdf in zip(CAPAS, (regiones, comunas)):
+        for nivel, tolerancia in NIVELES_SIMPLIFICACION.items():
+            ruta = _ruta_geometrias(capa, nivel, destino)
+            simplificar_geometrias(gdf, tolerancia).to_parquet(ruta + ".tmp")
+            os.replace(ruta + ".tmp", ruta)
+            escritos.append(ruta)
+    return escritos
+
+def geometrias_simplificadas_vigentes(destino=DIR_GEOMETRIAS):
+    """Indica si existen todas las capas y niveles en `destino`."""
+    return all(os.path.exists(_ruta_geometrias(capa, nivel, destino))
+               for capa in CAPAS for nivel in NIVELES_SIMPLIFICACION)
+
+@instrumentado(cache=st.cache_resource)
+def cargar_geometrias_web(capa, nivel):
+    """
+    Devuelve la capa (`regiones` o `comunas`) simplificada al nivel pedido.
+
+    Lee el GeoParquet precalculado; si aún no existe, lo genera una vez desde
+    las geometrías originales (salvo con un paquete de datos, que ya lo trae). El resultado se comparte entre sesiones y es de
+    solo lectura.
+    """
+    if not DIR_PAQUETE and not geometrias_simplificadas_vigentes():
+        regiones, comunas = obtener_geometrias()
+        construir_geometrias_simplificadas(regiones, comunas)
+    return gpd.read_parquet(_ruta_geometrias(capa, nivel))
+
+@instrumentado(cache=st.cache_resource)
+def capa_geojson(capa, nivel, region_id=None):
+    """
+    Geometrías GeoJSON de una capa, serializadas una sola vez por (capa, nivel, región).
+
+    Cada geometría queda como texto, con coordenadas cuantizadas a
+    `DECIMALES_COORDENADAS`; `unir_propiedades` arma el FeatureCollection de
+    cada vista pegando esos textos con las propiedades del momento, sin
+    volver a serializar geometrías.
+
+    Args:
+        capa: 'regiones' o 'comunas'
+        nivel: Nivel de detalle (ver `NIVELES_SIMPLIFICACION`)
+        region_id: Región a la que limitar las comunas (None = todas)
+
+    Returns:
+        CapaGeojson
+    """
+    gdf = cargar_geometrias_web(capa, nivel)
+    if region_id is not None and capa == "comunas":
+        gdf = gdf[gdf["region_id_com"] == region_id]
+    id_campo = ID_POR_CAPA[capa]
+    geometrias = shapely.transform(gdf.geometry.values, lambda coords: np.round(coords, DECIMALES_COORDENADAS))
+    return CapaGeojson(id_campo, gdf[id_campo].tolist(), shapely.to_geojson(geometrias).tolist())
+
+@instrumentado(cache=st.cache_data)
+def tamano_capa_geojson(capa, nivel, region_id=None):
+    """Tamaño en bytes de las geometrías serializadas de `capa_geojson`."""
+    return sum(len(geometria) for geometria in capa_geojson(capa, nivel, region_id).geometrias)
+
+def nivel_dentro_de_presupuesto(capa, nivel, region_id=None, presupuesto_mb=PRESUPUESTO_PAYLOAD_MB):
+    """
+    Devuelve `nivel` o, si su payload supera el presupuesto, el más detallado que sí cabe.
+
+    Así la vista nacional de comunas se dibuja completa (sin recortar
+    registros) bajando el detalle en vez de la cantidad de elementos.
+    """
+    niveles = list(NIVELES_SIMPLIFICACION)
+    for candidato in reversed(niveles[:niveles.index(nivel) + 1]):
+        if tamano_capa_geojson(capa, candidato, region_id) <= presupuesto_mb * 1024 ** 2:
+            return candidato
+    return niveles[0]
+
+def unir_propiedades(capa, datos, campos):
+    """
+    Arma el GeoJSON de una vista con las geometrías de `capa` y las columnas `campos` de `datos`.
+
+    Solo se serializan las propiedades; las geometrías se pegan tal cual
+    vienen de `capa_geojson`. Los elementos sin fila en `datos` se omiten y
+    los valores faltantes quedan como `null`.
+
+    Returns:
+        GeojsonVista
+    """
+    id_campo = capa.id_campo
+    valores = datos.drop(columns="geometry", errors="ignore").set_index(id_campo)
+    campos = [c for c in dict.fromkeys(campos) if c in valores.columns and c != id_campo]
+    valores = valores[campos]
+    valores = valores.astype(object).where(valores.notna(), None)
+    propiedades = valores.to_dict("index")
+
+    features, partes = [], []
+    for id_valor, geometria in zip(capa.ids, capa.geometrias):
+        if id_valor in propiedades:
+            feature = {"type": "Feature", "properties": {id_campo: id_valor, **propiedades[id_valor]},
+                       "geometry": None}
+            features.append(feature)
+            partes.append(f'{{"type":"Feature","properties":{json.dumps(feature["properties"])},'
+                          f'"geometry":{geometria}}}')
+    texto = '{"type":"FeatureCollection","features":[' + ",".join(partes) + "]}"
+    return GeojsonVista(texto, features)
+
+class _DatosGeojson(MacroElement):
+    """Agrega a la capa padre un FeatureCollection ya serializado, insertado tal cual en la página."""
+    _template = Template("""
+        {% macro script(this, kwargs) %}
+            {{ this._parent.get_name() }}_add({{ this.texto }});
+        {% endmacro %}
+    """)
+
+    def __init__(self, texto):
+        super().__init__()
+        self._name = "DatosGeojson"
+        self.texto = texto
+
+class GeoJsonSerializado(folium.GeoJson):
+    """
+    `folium.GeoJson` para un `GeojsonVista`: no vuelve a serializar las geometrías.
+
+    Los estilos y los tooltips se calculan con los elementos sin geometría
+    (`vista.features`); los datos que se dibujan son el texto de la vista.
+    """
+
+    def __init__(self, vista, **kwargs):
+        super().__init__({"type": "FeatureCollection", "features": vista.features}, **kwargs)
+        # Los mapas de estilo se calculan una vez, con todos los elementos:
+        # `render` puede llamarse más de una vez (st_folium renderiza el mapa
+        # dos veces) y no debe recalcularlos
+        if (self.style or self.highlight) and self.data["features"]:
+            mapper = GeoJsonStyleMapper(self.data, self.feature_identifier, self)
+            if self.style:
+                self.style_map = mapper.get_style_map(self.style_function)
+            if self.highlight:
+                self.highlight_map = mapper.get_highlight_map(self.highlight_function)
+        # Lo que folium incrusta queda reducido a un elemento sin geometría
+        # (Leaflet lo ignora), que solo usa el tooltip para validar sus campos
+        self.data = {"type": "FeatureCollection", "features": vista.features[:1]}
+        self.add_child(_DatosGeojson(vista.texto))
+
+    def render(self, **kwargs):
+        self.parent_map = get_obj_in_upper_tree(self, folium.Map)
+        Layer.render(self, **kwargs)
+
+if __name__ == "__main__":
+    print("Cargando geometrías originales...")
+    regiones, comunas = cargar_geometrias()
+    print(f"Simplificando en niveles {list(NIVELES_SIMPLIFICACION)}...")
+    for ruta in construir_geometrias_simplificadas(regiones, comunas):
+        print(f"  {ruta}")
+    print("¡Proceso completado!")
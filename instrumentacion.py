@@ -0,0 +1,374 @@
+"""
+Medición por etapa de las funciones de datos y de los bloques de las páginas.
+
+Cada etapa medida deja un evento con su duración, filas de entrada y salida,
+bytes serializados (si corresponde), si salió del caché y la memoria del
+proceso al terminar. Los eventos de la ejecución en curso se muestran en el
+panel de depuración de cada página y además se emiten como logs JSON por el
+logger `censo.instrumentacion` (nivel con `CENSO_LOG_NIVEL`, por defecto INFO).
+
+Las funciones cacheadas llevan además métricas acumuladas por proceso
+(aciertos, cálculos, tiempo de cálculo, entradas y memoria retenidas,
+descartes), exportables en formato de texto de Prometheus. Sus límites
+`max_entries`/`ttl` se configuran por función en `.streamlit/cache.toml`.
+"""
+import functools
+import http.server
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import tomllib
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import numpy as np
+
+import pandas as pd
+import streamlit as st
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+logger = logging.getLogger("censo.instrumentacion")
+if not logger.handlers:
+    _manejador = logging.StreamHandler()
+    _manejador.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(_manejador)
+    logger.setLevel(os.environ.get("CENSO_LOG_NIVEL", "INFO").upper())
+    logger.propagate = False
+
+# Límites de caché por función: secciones `[nombre]` con `max_entries` y `ttl` (segundos)
+RUTA_CONFIG_CACHE = os.environ.get("CENSO_CACHE_CONFIG", os.path.join(".streamlit", "cache.toml"))
+
+def leer_config_cache(ruta=RUTA_CONFIG_CACHE):
+    """Opciones de caché por función leídas de `ruta` (vacío si no existe)."""
+    if not os.path.exists(ruta):
+        return {}
+    with open(ruta, "rb") as f:
+        return tomllib.load(f)
+
+_config_cache = leer_config_cache()
+
+# Eventos de la ejecución en curso. Streamlit corre cada ejecución de una
+# página en su propio hilo, así que basta con un registro por hilo.
+_local = threading.local()
+
+def _eventos():
+    if not hasattr(_local, "eventos"):
+        _local.eventos = []
+    return _local.eventos
+
+def _calculos():
+    """Pila de banderas "se calculó" de las funciones cacheadas en curso (pueden anidarse)."""
+    if not hasattr(_local, "calculos"):
+        _local.calculos = []
+    return _local.calculos
+
+def memoria_proceso_mb():
+    """Pico de memoria residente del proceso en MB (None si el sistema no lo informa)."""
+    if resource is None:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def contar_filas(valor):
+    """Filas de un DataFrame, elementos de un GeoJSON o suma de las partes de una tupla."""
+    if isinstance(valor, pd.DataFrame):
+        return len(valor)
+    if isinstance(valor, dict) and "features" in valor:
+        return len(valor["features"])
+    if isinstance(valor, (tuple, list)):
+        partes = [contar_filas(parte) for parte in valor]
+        partes = [p for p in partes if p is not None]
+        return sum(partes) if partes else None
+    return None
+
+def tamano_estimado(valor):
+    """
+    Bytes aproximados que ocupa un resultado en memoria.
+
+    DataFrames por `memory_usage(deep=True)` (más 16 bytes por coordenada en
+    las geometrías), arreglos por `nbytes`, GeoJSON por su largo serializado;
+    tuplas y listas suman sus partes.
+    """
+    if isinstance(valor, pd.DataFrame):
+        total = int(valor.memory_usage(deep=True).sum())
+        if hasattr(valor, "geometry") and "geometry" in valor.columns:
+            import shapely
+            total += int(shapely.get_num_coordinates(valor.geometry.values).sum()) * 16
+        return total
+    if isinstance(valor, pd.Series):
+        return int(valor.memory_usage(deep=True))
+    if isinstance(valor, np.ndarray):
+        return int(valor.nbytes)
+    if isinstance(valor, dict) and "features" in valor:
+        return len(json.dumps(valor, separators=(",", ":")))
+    if isinstance(valor, (tuple, list)):
+        return sum(tamano_estimado(parte) for parte in valor)
+    return sys.getsizeof(valor)
+
+class MetricasCache:
+    """
+    Métricas acumuladas de una función cacheada.
+
+    Lleva una sombra de las entradas del caché (tamaño y hora de cálculo) con
+    la misma política de `max_entries` y `ttl` que el caché real, para estimar
+    la memoria retenida y los descartes sin depender de APIs internas de
+    Streamlit. Los aciertos no se pueden asociar a una entrada, así que la
+    sombra descarta por antigüedad de cálculo en vez de por último uso.
+    """
+
+    def __init__(self, nombre, tipo, max_entries=None, ttl=None):
+        self.nombre = nombre
+        self.tipo = tipo
+        self.max_entries = max_entries
+        # Streamlit acepta el ttl también como texto ("1h") o timedelta
+        self.ttl = pd.Timedelta(ttl).total_seconds() if isinstance(ttl, str) or hasattr(ttl, "total_seconds") else ttl
+        self.aciertos = 0
+        self.calculos = 0
+        self.segundos_calculo = 0.0
+        self.descartadas = 0
+        self._entradas = OrderedDict()
+        self._siguiente = 0
+        self._candado = threading.Lock()
+
+    def _expirar(self, ahora):
+        if self.ttl is None:
+            return
+        while self._entradas and ahora - next(iter(self._entradas.values()))[1] > self.ttl:
+            self._entradas.popitem(last=False)
+            self.descartadas += 1
+
+    def acierto(self):
+        with self._candado:
+            self.aciertos += 1
+
+    def calculo(self, segundos, resultado):
+        tamano = tamano_estimado(resultado)
+        with self._candado:
+            ahora = time.time()
+            self.calculos += 1
+            self.segundos_calculo += segundos
+            self._expirar(ahora)
+            self._entradas[self._siguiente] = (tamano, ahora)
+            self._siguiente += 1
+            if self.max_entries is not None:
+                while len(self._entradas) > self.max_entries:
+                    self._entradas.popitem(last=False)
+                    self.descartadas += 1
+
+    def vaciar(self):
+        with self._candado:
+            self.descartadas += len(self._entradas)
+            self._entradas.clear()
+
+    def resumen(self):
+        """Diccionario con todas las métricas de la función."""
+        with self._candado:
+            self._expirar(time.time())
+            return {
+                "funcion": self.nombre, "tipo": self.tipo,
+                "aciertos": self.aciertos, "calculos": self.calculos,
+                "segundos_calculo": round(self.segundos_calculo, 3),
+                "entradas": len(self._entradas),
+                "bytes": sum(tamano for tamano, _ in self._entradas.values()),
+                "descartadas": self.descartadas,
+                "max_entries": self.max_entries, "ttl": self.ttl,
+            }
+
+# Métricas de todas las funciones cacheadas del proceso, por nombre
+METRICAS_CACHE = {}
+
+def registrar(etapa, duracion_s, **datos):
+    """Agrega un evento al registro de la ejecución y lo emite como log JSON."""
+    evento = {"etapa": etapa, "ms": round(duracion_s * 1000, 1), **datos,
+              "memoria_mb": memoria_proceso_mb()}
+    _eventos().append(evento)
+    logger.info(json.dumps(evento, ensure_ascii=False, default=str))
+    return evento
+
+@contextmanager
+def medir(etapa, **datos):
+    """
+    Mide un bloque de código como una etapa.
+
+    Entrega un diccionario donde el bloque puede anotar datos del evento
+    (p. ej. `filas_salida` o `bytes`) antes de que se registre.
+    """
+    datos = dict(datos)
+    inicio = time.perf_counter()
+    try:
+        yield datos
+    finally:
+        registrar(etapa, time.perf_counter() - inicio, **datos)
+
+def instrumentado(cache=None, nombre=None, **opciones_cache):
+    """
+    Decorador que mide cada llamada a la función (etapa `nombre`, por defecto la función).
+
+    Con `cache` (`st.cache_data` o `st.cache_resource`) además la cachea con
+    `opciones_cache` y distingue aciertos de cálculos: reemplaza a la línea
+    `@st.cache_*` correspondiente. Los `max_entries`/`ttl` de la sección
+    `[nombre]` de `.streamlit/cache.toml` tienen prioridad sobre los del código.
+
+    Ejemplo:
+        @instrumentado(cache=st.cache_data, hash_funcs=HASH_CENSO)
+        def procesar_datos_region(censo): ...
+    """
+    def decorador(funcion):
+        etapa = nombre or funcion.__name__
+        opciones = {**opciones_cache, **_config_cache.get(etapa, {})}
+        metricas = None
+        if cache is not None:
+            metricas = METRICAS_CACHE.setdefault(etapa, MetricasCache(
+                etapa, "resource" if cache is st.cache_resource else "data",
+                opciones.get("max_entries"), opciones.get("ttl")))
+
+        @functools.wraps(funcion)
+        def calcular(*args, **kwargs):
+            # Solo se ejecuta cuando el caché no tiene el resultado
+            inicio = time.perf_counter()
+            resultado = funcion(*args, **kwargs)
+            calculos = _calculos()
+            if calculos:
+                calculos[-1] = True
+            metricas.calculo(time.perf_counter() - inicio, resultado)
+            return resultado
+
+        cacheada = cache(**opciones)(calcular) if cache is not None else funcion
+
+        @functools.wraps(funcion)
+        def envoltura(*args, **kwargs):
+            calculos = _calculos()
+            calculos.append(False)
+            inicio = time.perf_counter()
+            try:
+                resultado = cacheada(*args, **kwargs)
+            finally:
+                calculado = calculos.pop()
+            if metricas is not None and not calculado:
+                metricas.acierto()
+            entrada = next((a for a in list(args) + list(kwargs.values()) if isinstance(a, pd.DataFrame)), None)
+            registrar(etapa, time.perf_counter() - inicio,
+                      cache=None if cache is None else ("miss" if calculado else "hit"),
+                      filas_entrada=None if entrada is None else len(entrada),
+                      filas_salida=contar_filas(resultado))
+            return resultado
+
+        if cache is not None:
+            def vaciar():
+                cacheada.clear()
+                metricas.vaciar()
+            envoltura.clear = vaciar
+        return envoltura
+    return decorador
+
+def metricas_cache():
+    """Métricas de todas las funciones cacheadas, una fila por función."""
+    return [m.resumen() for m in METRICAS_CACHE.values()]
+
+# Métricas de Prometheus: (nombre, tipo, ayuda, campo del resumen)
+_SERIES_PROMETHEUS = [
+    ("censo_cache_aciertos_total", "counter", "Llamadas resueltas desde el caché", "aciertos"),
+    ("censo_cache_calculos_total", "counter", "Llamadas que calcularon el resultado (misses)", "calculos"),
+    ("censo_cache_segundos_calculo_total", "counter", "Tiempo total de cálculo en misses", "segundos_calculo"),
+    ("censo_cache_entradas", "gauge", "Entradas retenidas (estimadas)", "entradas"),
+    ("censo_cache_bytes", "gauge", "Memoria retenida por las entradas (estimada)", "bytes"),
+    ("censo_cache_descartadas_total", "counter", "Entradas descartadas por max_entries, ttl o vaciado", "descartadas"),
+    ("censo_cache_max_entries", "gauge", "Límite de entradas configurado", "max_entries"),
+    ("censo_cache_ttl_segundos", "gauge", "TTL configurado en segundos", "ttl"),
+]
+
+def metricas_prometheus():
+    """Métricas de caché en el formato de texto de Prometheus."""
+    resumenes = metricas_cache()
+    lineas = []
+    for nombre, tipo, ayuda, campo in _SERIES_PROMETHEUS:
+        lineas += [f"# HELP {nombre} {ayuda}", f"# TYPE {nombre} {tipo}"]
+        for r in resumenes:
+            if isinstance(r[campo], (int, float)):
+                lineas.append(f'{nombre}{{funcion="{r["funcion"]}",tipo="{r["tipo"]}"}} {r[campo]}')
+    lineas += ["# HELP censo_memoria_proceso_mb Pico de memoria residente del proceso",
+               "# TYPE censo_memoria_proceso_mb gauge",
+               f"censo_memoria_proceso_mb {memoria_proceso_mb() or 0}"]
+    return "\n".join(lineas) + "\n"
+
+def escribir_metricas(ruta):
+    """Escribe `metricas_prometheus()` en `ruta` de forma atómica (colector de archivos de texto)."""
+    temporal = ruta + ".tmp"
+    with open(temporal, "w", encoding="utf-8") as f:
+        f.write(metricas_prometheus())
+    os.replace(temporal, ruta)
+
+class _ManejadorMetricas(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        cuerpo = metricas_prometheus().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(cuerpo)))
+        self.end_headers()
+        self.wfile.write(cuerpo)
+
+    def log_message(self, *args):
+        pass
+
+@st.cache_resource
+def iniciar_exportador_metricas():
+    """
+    Arranca (una vez por proceso) la exportación de métricas de caché.
+
+    - `CENSO_METRICAS_PUERTO`: sirve `/metrics` por HTTP en ese puerto
+      (interfaz `CENSO_METRICAS_HOST`, por defecto 127.0.0.1).
+    - `CENSO_METRICAS_ARCHIVO`: reescribe ese archivo cada
+      `CENSO_METRICAS_INTERVALO` segundos (por defecto 15).
+
+    Returns:
+        Servidor HTTP en marcha, o None si no se configuró puerto
+    """
+    servidor = None
+    puerto = os.environ.get("CENSO_METRICAS_PUERTO")
+    if puerto:
+        servidor = http.server.ThreadingHTTPServer(
+            (os.environ.get("CENSO_METRICAS_HOST", "127.0.0.1"), int(puerto)), _ManejadorMetricas)
+        threading.Thread(target=servidor.serve_forever, name="metricas-http", daemon=True).start()
+    ruta = os.environ.get("CENSO_METRICAS_ARCHIVO")
+    if ruta:
+        intervalo = float(os.environ.get("CENSO_METRICAS_INTERVALO", 15))
+
+        def escribir_periodicamente():
+            while True:
+                escribir_metricas(ruta)
+                time.sleep(intervalo)
+
+        threading.Thread(target=escribir_periodicamente, name="metricas-archivo", daemon=True).start()
+    return servidor
+
+def iniciar_medicion():
+    """Vacía el registro de eventos; se llama al comienzo de cada página."""
+    _eventos().clear()
+
+def eventos_medidos():
+    """Eventos registrados en la ejecución en curso, en orden."""
+    return list(_eventos())
+
+def mostrar_panel_depuracion():
+    """Panel plegable con los tiempos de cada etapa de la ejecución en curso y las métricas de caché."""
+    eventos = eventos_medidos()
+    with st.expander(f"🐞 Depuración: {len(eventos)} etapas medidas", expanded=False):
+        if eventos:
+            tabla = pd.DataFrame(eventos)
+            st.dataframe(tabla, use_container_width=True, hide_index=True)
+            calculos = int((tabla["cache"] == "miss").sum()) if "cache" in tabla else 0
+            st.caption(f"{calculos} cálculos fuera de caché. El tiempo de una etapa incluye "
+                       "el de las etapas anidadas que llama.")
+        else:
+            st.caption("No se midieron etapas en esta ejecución.")
+        st.markdown("**Cachés del proceso** (acumulado desde el arranque; memoria estimada)")
+        st.dataframe(pd.DataFrame(metricas_cache()), use_container_width=True, hide_index=True)
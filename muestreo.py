@@ -0,0 +1,114 @@
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+# Índice de muestreo: para cada estrato, sus filas en un orden aleatorio fijo.
+# Las filas del estrato `estratos[i]` son `posiciones[inicio[i]:inicio[i + 1]]`.
+IndiceMuestreo = namedtuple("IndiceMuestreo", ["columna", "estratos", "inicio", "posiciones"])
+
+def construir_indice_muestreo(censo, columna='region_id', semilla=42):
+    """
+    Baraja una vez las filas del censo dentro de cada estrato.
+
+    Cualquier prefijo del bloque de un estrato es una muestra aleatoria simple
+    de ese estrato, así que después se pueden servir muestras de cualquier
+    tamaño en O(k) sin volver a muestrear.
+
+    Args:
+        censo: DataFrame del censo
+        columna: Columna de estrato ('region_id' o 'comuna_id')
+        semilla: Semilla del barajado (muestras reproducibles)
+
+    Returns:
+        IndiceMuestreo
+    """
+    valores = censo[columna].to_numpy()
+    clave_aleatoria = np.random.default_rng(semilla).random(len(valores))
+    orden = np.lexsort((clave_aleatoria, valores))
+    estratos, conteos = np.unique(valores, return_counts=True)
+    inicio = np.concatenate([[0], np.cumsum(conteos)])
+    tipo = np.int32 if len(valores) < np.iinfo(np.int32).max else np.int64
+    return IndiceMuestreo(columna, estratos, inicio, orden.astype(tipo))
+
+def tamanos_estratos(indice):
+    """Número de filas de cada estrato, como Series indexada por estrato."""
+    return pd.Series(np.diff(indice.inicio), index=indice.estratos, name='poblacion')
+
+def asignar_tamanos(indice, n_total, minimo_por_estrato=0):
+    """
+    Reparte `n_total` filas entre estratos proporcionalmente a su tamaño.
+
+    Cada estrato recibe al menos `minimo_por_estrato` filas (o todas las que
+    tiene, si son menos), para que las regiones pequeñas no queden con unas
+    pocas observaciones.
+    """
+    tamanos = tamanos_estratos(indice)
+    proporcional = np.round(n_total * tamanos / tamanos.sum()).astype(np.int64)
+    return np.minimum(np.maximum(proporcional, minimo_por_estrato), tamanos)
+
+def _filas_estrato(indice, i, k):
+    """Primeras `k` posiciones (ya barajadas) del estrato i-ésimo."""
+    return indice.posiciones[indice.inicio[i]:min(indice.inicio[i] + k, indice.inicio[i + 1])]
+
+def muestra_estratificada(censo, indice, n_total, minimo_por_estrato=0):
+    """
+    Muestra estratificada con pesos de expansión.
+
+    Args:
+        censo: DataFrame del censo (el mismo con que se construyó `indice`)
+        indice: IndiceMuestreo del censo
+        n_total: Tamaño aproximado de la muestra
+        minimo_por_estrato: Filas mínimas por estrato
+
+    Returns:
+        DataFrame con las filas muestreadas y la columna `peso` (= N_h / n_h,
+        personas que representa cada fila)
+    """
+    asignacion = asignar_tamanos(indice, n_total, minimo_por_estrato)
+    tamanos = tamanos_estratos(indice)
+    partes, pesos = [], []
+    for i, (k, n_estrato) in enumerate(zip(asignacion.to_numpy(), tamanos.to_numpy())):
+        filas = _filas_estrato(indice, i, k)
+        partes.append(filas)
+        pesos.append(np.full(len(filas), n_estrato / max(len(filas), 1)))
+    posiciones = np.concatenate(partes) if partes else np.array([], dtype=np.int64)
+    muestra = censo.iloc[posiciones].reset_index(drop=True)
+    muestra['peso'] = np.concatenate(pesos) if pesos else np.array([])
+    return muestra
+
+def muestra_por_estrato(censo, indice, k, condicion=None):
+    """
+    Hasta `k` filas aleatorias de cada estrato, opcionalmente filtradas.
+
+    Sin filtro cuesta O(k) por estrato. Con `condicion` (función que recibe un
+    DataFrame y devuelve una máscara booleana) se evalúa solo sobre prefijos
+    crecientes del bloque barajado, hasta juntar `k` filas que la cumplan.
+    """
+    partes = []
+    for i in range(len(indice.estratos)):
+        n_estrato = indice.inicio[i + 1] - indice.inicio[i]
+        m = k
+        while True:
+            filas = censo.iloc[_filas_estrato(indice, i, m)]
+            if condicion is not None:
+                filas = filas[condicion(filas)]
+            if len(filas) >= k or m >= n_estrato:
+                break
+            m *= 2
+        partes.append(filas.iloc[:k])
+    if not partes:
+        return censo.iloc[:0]
+    return pd.concat(partes, ignore_index=True)
+
+def estimar_media(muestra, columna, por=None):
+    """Media ponderada por `peso` de `columna` (total o por grupos)."""
+    valores = muestra[columna].astype(float) * muestra['peso']
+    if por is None:
+        return valores.sum() / muestra['peso'].sum()
+    return valores.groupby(muestra[por]).sum() / muestra['peso'].groupby(muestra[por]).sum()
+
+def estimar_proporcion(muestra, columna, valor, por=None):
+    """Proporción ponderada (en %) de filas con `columna == valor`."""
+    indicador = (muestra[columna] == valor).astype(float)
+    return estimar_media(muestra.assign(_indicador=indicador), '_indicador', por) * 100
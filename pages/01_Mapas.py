@@ -1,13 +1,25 @@
 import streamlit as st
 import folium
 import geopandas as gpd
+import numpy as np
 import pandas as pd
+from branca.colormap import StepColormap
+from branca.utilities import color_brewer
 from streamlit_folium import st_folium
-from utils import cargar_datos, procesar_datos_comuna, procesar_datos_region, obtener_regiones_disponibles, crear_datos_optimizados, obtener_muestra_censo, preparar_datos_mapa_ligeros, optimizar_geometrias_para_web
+from calentamiento import iniciar_calentamiento, cubo_progresivo
+from instrumentacion import instrumentado, iniciar_exportador_metricas, iniciar_medicion, medir, mostrar_panel_depuracion
+from utils import obtener_geometrias, version_datos, cargar_cubo, cargar_estadisticas_comunales, estadisticas_comunales_region, agregar_densidad, obtener_regiones_disponibles, preparar_datos_mapa_ligeros
+from geometrias import cargar_geometrias_web, capa_geojson, tamano_capa_geojson, nivel_por_zoom, nivel_dentro_de_presupuesto, unir_propiedades, GeoJsonSerializado
+from cubo import resumen_cubo, resumen_comunal
 
 # Configuración de página
 st.set_page_config(page_title="Mapas - Censo 2017", page_icon="🗺️", layout="wide")
 
+# Calentamiento de cachés en segundo plano, si esta es la primera página abierta
+iniciar_calentamiento()
+iniciar_exportador_metricas()
+iniciar_medicion()
+
 # CSS personalizado
 st.markdown("""
 <style>
@@ -36,27 +48,72 @@ st.markdown("""
 </div>
 """, unsafe_allow_html=True)
 
-# Cargar datos (OPTIMIZADO)
-@st.cache_data
-def load_and_process_data():
+# Avance (fracción del censo) con que la carga progresiva vuelve a dibujar la página
+PASO_REFRESCO = 0.1
+
+def resumir_datos_mapa(cubo, estadisticas_comunales, regiones, comunas):
+    """Datos regionales y comunales del mapa, con densidad, a partir del cubo."""
+    datos_regionales = resumen_cubo(cubo, 'region_id', ['mean', 'median', 'std'])
+    
+    # Densidad con superficies precalculadas en proyección de áreas iguales
+    datos_regionales = agregar_densidad(datos_regionales, regiones, 'region_id')
+    estadisticas_comunales = agregar_densidad(estadisticas_comunales, comunas, 'comuna_id')
+    return estadisticas_comunales, datos_regionales
+
+# Cargar datos (OPTIMIZADO, compartidos entre sesiones)
+@instrumentado(cache=st.cache_resource, max_entries=1)
+def load_and_process_data(version):
     """Carga datos optimizados para mapas."""
-    regiones, comunas, censo = cargar_datos()
+    regiones, comunas = obtener_geometrias()
     regiones_lista = obtener_regiones_disponibles(regiones)
     
-    # Crear datos pre-agregados para mejor rendimiento
-    datos_regionales, edad_region, sexo_region, censo_sample = crear_datos_optimizados(censo)
-    
-    return regiones, comunas, censo_sample, regiones_lista, datos_regionales
+    # Cubo de conteos: agregaciones exactas sin recorrer los microdatos
+    estadisticas_comunales, datos_regionales = resumir_datos_mapa(
+        cargar_cubo(), cargar_estadisticas_comunales(), regiones, comunas
+    )
+    return regiones, comunas, estadisticas_comunales, regiones_lista, datos_regionales
 
+@st.fragment(run_every=2)
+def seguir_carga_progresiva(avance_mostrado):
+    """Avance de la lectura del censo; redibuja la página cuando hay bastantes datos nuevos o terminó."""
+    progresivo = cubo_progresivo()
+    if progresivo is None:
+        st.rerun()
+    cubo_parcial, avance = progresivo
+    if cubo_parcial is not None and (avance_mostrado is None or (avance or 0) - avance_mostrado >= PASO_REFRESCO):
+        st.rerun()
+    if avance_mostrado is None:
+        st.info("⏳ Esperando los primeros datos del censo para dibujar el mapa...")
+    else:
+        st.progress(avance or 0.0, text=f"📥 Mapa con cifras parciales ({avance_mostrado:.0%} del censo); "
+                                       f"lectura en curso: {avance or 0:.0%}")
+
+# Mientras se construye el cubo, el mapa se dibuja con lo leído del censo hasta ahora
+progresivo = cubo_progresivo()
 try:
     with st.spinner("🔄 Cargando datos geográficos optimizados..."):
-        regiones, comunas, censo_sample, regiones_lista, datos_regionales = load_and_process_data()
-        st.success("✅ Datos geográficos cargados exitosamente!")
+        if progresivo is None:
+            regiones, comunas, estadisticas_comunales, regiones_lista, datos_regionales = load_and_process_data(version_datos())
+            st.success("✅ Datos geográficos cargados exitosamente!")
+        else:
+            cubo_parcial, avance_parcial = progresivo
+            regiones, comunas = obtener_geometrias()
+            regiones_lista = obtener_regiones_disponibles(regiones)
+            if cubo_parcial is not None:
+                estadisticas_comunales, datos_regionales = resumir_datos_mapa(
+                    cubo_parcial, resumen_comunal(cubo_parcial), regiones, comunas
+                )
         
 except Exception as e:
     st.error(f"❌ Error al cargar los datos: {str(e)}")
     st.stop()
 
+if progresivo is not None:
+    if cubo_parcial is None:
+        seguir_carga_progresiva(None)
+        st.stop()
+    seguir_carga_progresiva(avance_parcial or 0.0)
+
 # Sidebar para controles
 st.sidebar.markdown("""
 <div class="sidebar-section">
@@ -74,6 +131,7 @@ nivel_geografico = st.sidebar.radio(
 # Variables disponibles
 variables_regionales = {
     'poblacion_total': '👥 Población Total',
+    'densidad_poblacional': '🏘️ Densidad Poblacional',
     'edad_promedio': '🎂 Edad Promedio',
     'pct_mujeres': '👩 Porcentaje de Mujeres'
 }
@@ -85,6 +143,10 @@ variables_comunales = {
     'pct_mujeres': '👩 Porcentaje de Mujeres'
 }
 
+# Nivel de detalle de las geometrías según el zoom actual del mapa
+vista_mapa = "regional" if nivel_geografico == "🏛️ Regional" else "comunal"
+zoom_actual = st.session_state.get(f"zoom_{vista_mapa}")
+
 if nivel_geografico == "🏛️ Regional":
     # Selector de variable para nivel regional
     variable_seleccionada = st.sidebar.selectbox(
@@ -97,31 +159,38 @@ if nivel_geografico == "🏛️ Regional":
     # Usar datos regionales pre-agregados (OPTIMIZADO)
     datos_procesados = datos_regionales.copy()
     
-    # Unir con geometrías
-    mapa_gdf = regiones.merge(datos_procesados, left_on='region_id', right_on='region_id', how='left')
+    # Configuración del mapa
+    region_mapa = None
+    center_lat, center_lon = -35.0, -71.0
+    zoom_start = zoom_actual or 4
+    nivel_detalle = nivel_dentro_de_presupuesto('regiones', nivel_por_zoom(zoom_start))
+    
+    # Unir con geometrías pre-simplificadas
+    mapa_gdf = cargar_geometrias_web('regiones', nivel_detalle).drop(columns='area_km2', errors='ignore').merge(
+        datos_procesados, left_on='region_id', right_on='region_id', how='left'
+    )
     
     # Optimizar para web con funciones específicas
     campos_necesarios = ['poblacion_total', 'edad_promedio', 'pct_mujeres']
-    mapa_gdf = preparar_datos_mapa_ligeros(mapa_gdf, campos_necesarios, max_registros=20)
-    
-    # Configuración del mapa
-    center_lat, center_lon = -35.0, -71.0
-    zoom_start = 4
+    if variable_seleccionada == 'densidad_poblacional':
+        campos_necesarios.append('densidad_poblacional')
+    mapa_gdf = preparar_datos_mapa_ligeros(mapa_gdf, campos_necesarios, simplificar=False)
     
 else:  # Comunal
-    # Selector de región para filtrar comunas
+    # Selector de región para filtrar comunas (None = todo el país)
     if 'region_nombre' in regiones.columns:
         region_opciones = dict(zip(regiones_lista['region_id'], regiones_lista['region_nombre']))
         region_seleccionada = st.sidebar.selectbox(
             "🏛️ Región:",
-            options=list(region_opciones.keys()),
-            format_func=lambda x: f"{x} - {region_opciones[x]}",
+            options=list(region_opciones.keys()) + [None],
+            format_func=lambda x: "🇨🇱 Todas las regiones" if x is None else f"{x} - {region_opciones[x]}",
             help="Selecciona la región para visualizar sus comunas"
         )
     else:
         region_seleccionada = st.sidebar.selectbox(
             "🏛️ Región:",
-            options=regiones_lista['region_id'].tolist(),
+            options=regiones_lista['region_id'].tolist() + [None],
+            format_func=lambda x: "🇨🇱 Todas las regiones" if x is None else x,
             help="Selecciona la región para visualizar sus comunas"
         )
     
@@ -133,44 +202,38 @@ else:  # Comunal
         help="Selecciona la variable que quieres visualizar en el mapa"
     )
     
-    # Filtrar comunas por región
-    comunas_filtradas = comunas[comunas['region_id_com'] == region_seleccionada].copy()
+    region_mapa = region_seleccionada
+    zoom_start = zoom_actual or (8 if region_seleccionada is not None else 4)
+    nivel_detalle = nivel_dentro_de_presupuesto('comunas', nivel_por_zoom(zoom_start), region_mapa)
     
-    # Procesar datos comunales (OPTIMIZADO)
-    datos_procesados = procesar_datos_comuna(censo_sample, region_seleccionada)
+    # Filtrar comunas por región (geometrías pre-simplificadas)
+    comunas_web = cargar_geometrias_web('comunas', nivel_detalle)
+    if region_seleccionada is not None:
+        comunas_filtradas = comunas_web[comunas_web['region_id_com'] == region_seleccionada].copy()
+    else:
+        comunas_filtradas = comunas_web.copy()
     
-    # Calcular densidad poblacional si es necesario
-    if variable_seleccionada == 'densidad_poblacional':
-        # Calcular área en km²
-        comunas_filtradas['area_km2'] = comunas_filtradas.to_crs('EPSG:3857').geometry.area / 1e6
-        datos_procesados = datos_procesados.merge(
-            comunas_filtradas[['comuna_id', 'area_km2']], 
-            on='comuna_id', 
-            how='left'
-        )
-        datos_procesados['densidad_poblacional'] = datos_procesados['poblacion_total'] / datos_procesados['area_km2']
-        datos_procesados['densidad_poblacional'] = datos_procesados['densidad_poblacional'].fillna(0)
+    # Estadísticas comunales exactas, precalculadas sobre el censo completo
+    datos_procesados = estadisticas_comunales_region(estadisticas_comunales, region_seleccionada)
     
-    # Unir con geometrías
-    mapa_gdf = comunas_filtradas.merge(datos_procesados, on='comuna_id', how='left')
+    # Unir con geometrías (densidad y superficie ya vienen en datos_procesados)
+    mapa_gdf = comunas_filtradas.drop(columns='area_km2', errors='ignore').merge(datos_procesados, on='comuna_id', how='left')
     
-    # Optimizar para web - limitar registros en vista comunal
+    # Optimizar para web (todas las comunas; el detalle se ajusta al presupuesto)
     campos_necesarios = ['poblacion_total', 'edad_promedio', 'pct_mujeres']
     if variable_seleccionada == 'densidad_poblacional':
         campos_necesarios.append('densidad_poblacional')
     
-    # Limitar comunas a máximo 50 para evitar problemas de tamaño
-    mapa_gdf = preparar_datos_mapa_ligeros(mapa_gdf, campos_necesarios, max_registros=50)
+    mapa_gdf = preparar_datos_mapa_ligeros(mapa_gdf, campos_necesarios, simplificar=False)
     
     # Configuración del mapa centrado en la región
     if len(mapa_gdf) > 0:
         bounds = mapa_gdf.total_bounds
         center_lat = (bounds[1] + bounds[3]) / 2
         center_lon = (bounds[0] + bounds[2]) / 2
-        zoom_start = 8
     else:
         center_lat, center_lon = -35.0, -71.0
-        zoom_start = 6
+        zoom_start = zoom_actual or 6
 
 # Configuración de colores
 esquemas_color = {
@@ -180,6 +243,65 @@ esquemas_color = {
     'pct_mujeres': 'RdPu'
 }
 
+def crear_geojson_mapa(nivel, mapa_gdf, campos, region_id=None):
+    """GeoJSON de la vista actual: payload de geometrías cacheado + valores de `mapa_gdf`."""
+    if 'comuna_id' in mapa_gdf.columns:
+        return unir_propiedades(capa_geojson('comunas', nivel, region_id), mapa_gdf, campos)
+    return unir_propiedades(capa_geojson('regiones', nivel), mapa_gdf, campos)
+
+def agregar_capa_coropletica(mapa, geojson, variable, tooltip_fields=None, tooltip_aliases=None):
+    """
+    Dibuja el coroplético y los tooltips como una única capa GeoJson.
+
+    Replica los colores de `folium.Choropleth` (6 clases de igual ancho con el
+    esquema ColorBrewer de la variable) sin duplicar las geometrías ni volver
+    a serializarlas (ver `GeoJsonSerializado`).
+    """
+    valores = [f['properties'][variable] for f in geojson.features if f['properties'].get(variable) is not None]
+    vmin, vmax = min(valores), max(valores)
+    if vmin == vmax:
+        vmax = vmin + 1
+    escala = StepColormap(
+        color_brewer(esquemas_color.get(variable, 'YlOrRd'), n=6),
+        index=np.linspace(vmin, vmax, 7).tolist(),
+        vmin=vmin, vmax=vmax,
+        caption=variables_regionales.get(variable, variables_comunales.get(variable, variable))
+    )
+    
+    def estilo(feature):
+        valor = feature['properties'].get(variable)
+        return {
+            'fillColor': escala(valor) if valor is not None else 'lightgray',
+            'fillOpacity': 0.7 if valor is not None else 0.4,
+            'color': 'black',
+            'weight': 1,
+            'opacity': 0.2,
+        }
+    
+    tooltip = None
+    if tooltip_fields:
+        tooltip = folium.features.GeoJsonTooltip(
+            fields=tooltip_fields,
+            aliases=tooltip_aliases,
+            localize=True,
+            sticky=False,
+            labels=True,
+            style="""
+                background-color: white;
+                border: 2px solid black;
+                border-radius: 3px;
+                box-shadow: 3px;
+            """
+        )
+    
+    GeoJsonSerializado(
+        geojson,
+        style_function=estilo,
+        highlight_function=lambda x: {'weight': 3, 'color': 'red', 'opacity': 1},
+        tooltip=tooltip
+    ).add_to(mapa)
+    escala.add_to(mapa)
+
 # Sidebar adicional con información
 st.sidebar.markdown("---")
 st.sidebar.markdown("""
@@ -212,7 +334,7 @@ if len(mapa_gdf) > 0 and variable_seleccionada in mapa_gdf.columns:
 if len(mapa_gdf) > 0 and variable_seleccionada in mapa_gdf.columns and mapa_gdf[variable_seleccionada].notna().sum() > 0:
     try:
         # Mostrar información sobre optimización
-        st.info(f"🎯 Datos optimizados: {len(mapa_gdf)} registros | Geometrías simplificadas para mejor rendimiento")
+        st.info(f"🎯 Datos optimizados: {len(mapa_gdf)} registros | Geometrías pre-simplificadas (detalle {nivel_detalle})")
         
         # Crear mapa base
         m = folium.Map(
@@ -221,80 +343,43 @@ if len(mapa_gdf) > 0 and variable_seleccionada in mapa_gdf.columns and mapa_gdf[
             tiles='CartoDB positron'
         )
         
-        # Preparar datos para el choropleth - solo los campos necesarios
-        choropleth_data = mapa_gdf[['comuna_id' if 'comuna_id' in mapa_gdf.columns else 'region_id', variable_seleccionada]].copy()
-        
-        # Crear GeoJSON simplificado solo con las propiedades necesarias
-        geojson_data = mapa_gdf[['geometry', 'comuna_id' if 'comuna_id' in mapa_gdf.columns else 'region_id']].copy()
-        
-        # Añadir capa coroplética
-        folium.Choropleth(
-            geo_data=geojson_data.to_json(),
-            data=choropleth_data,
-            columns=['comuna_id' if 'comuna_id' in mapa_gdf.columns else 'region_id', variable_seleccionada],
-            key_on='feature.properties.comuna_id' if 'comuna_id' in mapa_gdf.columns else 'feature.properties.region_id',
-            fill_color=esquemas_color.get(variable_seleccionada, 'YlOrRd'),
-            fill_opacity=0.7,
-            line_opacity=0.2,
-            legend_name=variables_regionales.get(variable_seleccionada, variables_comunales.get(variable_seleccionada, variable_seleccionada)),
-            nan_fill_color="lightgray",
-            nan_fill_opacity=0.4
-        ).add_to(m)
-        
-        # Crear tooltips con datos mínimos para reducir tamaño
-        tooltip_gdf = mapa_gdf.copy()
-        
         # Añadir tooltips informativos (con datos limitados)
         if nivel_geografico == "🏛️ Regional":
-            if 'region_nombre' in tooltip_gdf.columns:
+            if 'region_nombre' in mapa_gdf.columns:
                 tooltip_fields = ['region_nombre', 'poblacion_total', 'edad_promedio']
                 tooltip_aliases = ['Región:', 'Población:', 'Edad Promedio:']
             else:
                 tooltip_fields = ['region_id', 'poblacion_total', 'edad_promedio']
                 tooltip_aliases = ['Región ID:', 'Población:', 'Edad Promedio:']
         else:
-            if 'comuna_nombre' in tooltip_gdf.columns:
+            if 'comuna_nombre' in mapa_gdf.columns:
                 tooltip_fields = ['comuna_nombre', 'poblacion_total', 'edad_promedio']
                 tooltip_aliases = ['Comuna:', 'Población:', 'Edad Promedio:']
             else:
                 tooltip_fields = ['comuna_id', 'poblacion_total', 'edad_promedio']
                 tooltip_aliases = ['Comuna ID:', 'Población:', 'Edad Promedio:']
         
-        # Filtrar campos que existen y crear GeoJSON minimal para tooltips
-        tooltip_fields_existentes = [f for f in tooltip_fields if f in tooltip_gdf.columns]
-        tooltip_aliases_existentes = [tooltip_aliases[i] for i, f in enumerate(tooltip_fields) if f in tooltip_gdf.columns]
+        tooltip_fields_existentes = [f for f in tooltip_fields if f in mapa_gdf.columns]
+        tooltip_aliases_existentes = [tooltip_aliases[i] for i, f in enumerate(tooltip_fields) if f in mapa_gdf.columns]
         
-        if tooltip_fields_existentes:
-            # Crear un GeoDataFrame minimal solo para tooltips
-            tooltip_columns = ['geometry'] + tooltip_fields_existentes
-            tooltip_minimal = tooltip_gdf[tooltip_columns].copy()
-            
-            folium.GeoJson(
-                tooltip_minimal.to_json(),
-                style_function=lambda feature: {
-                    'fillColor': 'transparent',
-                    'color': 'black',
-                    'weight': 1,
-                    'fillOpacity': 0
-                },
-                highlight_function=lambda x: {'weight': 3, 'color': 'red'},
-                tooltip=folium.features.GeoJsonTooltip(
-                    fields=tooltip_fields_existentes,
-                    aliases=tooltip_aliases_existentes,
-                    localize=True,
-                    sticky=False,
-                    labels=True,
-                    style="""
-                        background-color: white;
-                        border: 2px solid black;
-                        border-radius: 3px;
-                        box-shadow: 3px;
-                    """
-                )
-            ).add_to(m)
+        # Una sola capa: geometrías serializadas una vez (cacheadas) + propiedades del rerun
+        with medir("geojson_mapa", nivel=nivel_detalle, filas_entrada=len(mapa_gdf)) as evento:
+            geojson_mapa = crear_geojson_mapa(
+                nivel_detalle, mapa_gdf, [variable_seleccionada] + tooltip_fields_existentes, region_mapa
+            )
+            agregar_capa_coropletica(m, geojson_mapa, variable_seleccionada, tooltip_fields_existentes, tooltip_aliases_existentes)
+            evento['filas_salida'] = len(geojson_mapa.features)
+            evento['bytes'] = tamano_capa_geojson(
+                'regiones' if nivel_geografico == "🏛️ Regional" else 'comunas', nivel_detalle, region_mapa)
         
         # Mostrar el mapa con tamaño optimizado
-        map_data = st_folium(m, width=1400, height=600, returned_objects=["last_object_clicked"])
+        with medir("st_folium"):
+            map_data = st_folium(m, width=1400, height=600, returned_objects=["last_object_clicked", "zoom"])
+        
+        # Si el zoom pide otro nivel de detalle, recargar con esas geometrías
+        if map_data.get('zoom') and nivel_por_zoom(map_data['zoom']) != nivel_por_zoom(zoom_start):
+            st.session_state[f"zoom_{vista_mapa}"] = map_data['zoom']
+            st.rerun()
         
         # Información adicional basada en clicks
         if map_data['last_object_clicked']:
@@ -316,8 +401,8 @@ if len(mapa_gdf) > 0 and variable_seleccionada in mapa_gdf.columns and mapa_gdf[
         
         # Intentar con geometrías aún más simplificadas
         try:
-            mapa_gdf_ultra_simple = simplify_geometries(mapa_gdf, tolerance=0.05)
-            st.warning(f"⚡ Usando geometrías ultra-simplificadas ({len(mapa_gdf_ultra_simple)} registros)")
+            geojson_simple = crear_geojson_mapa('baja', mapa_gdf, [variable_seleccionada], region_mapa)
+            st.warning(f"⚡ Usando geometrías ultra-simplificadas ({len(geojson_simple.features)} registros)")
             
             # Crear mapa básico sin tooltips complejos
             m_simple = folium.Map(
@@ -327,16 +412,7 @@ if len(mapa_gdf) > 0 and variable_seleccionada in mapa_gdf.columns and mapa_gdf[
             )
             
             # Solo choropleth básico
-            folium.Choropleth(
-                geo_data=mapa_gdf_ultra_simple[['geometry', 'comuna_id' if 'comuna_id' in mapa_gdf_ultra_simple.columns else 'region_id']].to_json(),
-                data=mapa_gdf_ultra_simple,
-                columns=['comuna_id' if 'comuna_id' in mapa_gdf_ultra_simple.columns else 'region_id', variable_seleccionada],
-                key_on='feature.properties.comuna_id' if 'comuna_id' in mapa_gdf_ultra_simple.columns else 'feature.properties.region_id',
-                fill_color=esquemas_color.get(variable_seleccionada, 'YlOrRd'),
-                fill_opacity=0.7,
-                line_opacity=0.2,
-                legend_name=variables_regionales.get(variable_seleccionada, variables_comunales.get(variable_seleccionada, variable_seleccionada)),
-            ).add_to(m_simple)
+            agregar_capa_coropletica(m_simple, geojson_simple, variable_seleccionada)
             
             map_data = st_folium(m_simple, width=1400, height=600)
             st.success("✅ Mapa cargado con optimización ultra!")
@@ -363,9 +439,12 @@ with st.expander("📚 Información sobre las Variables"):
     st.markdown("""
     **👥 Población Total:** Número total de personas registradas en el censo.
     
-    **🏘️ Densidad Poblacional:** Habitantes por kilómetro cuadrado.
+    **🏘️ Densidad Poblacional:** Habitantes por kilómetro cuadrado (superficie en proyección de áreas iguales).
     
     **🎂 Edad Promedio:** Promedio de edad de la población.
     
     **👩 Porcentaje de Mujeres:** Porcentaje de mujeres respecto al total de población.
-    """)
\ No newline at end of file
+    """)
+
+# Tiempos por etapa de esta ejecución
+mostrar_panel_depuracion()
@@ -4,11 +4,23 @@ import plotly.express as px
 import plotly.graph_objects as go
 from plotly.subplots import make_subplots
 import altair as alt
-from utils import cargar_datos, procesar_datos_region, obtener_regiones_disponibles, crear_datos_optimizados, obtener_muestra_censo
+import time
+from calentamiento import iniciar_calentamiento
+from instrumentacion import instrumentado, iniciar_exportador_metricas, iniciar_medicion, medir, registrar, mostrar_panel_depuracion
+from utils import cargar_datos, cargar_censo_region, obtener_geometrias, version_datos, cargar_cubo, obtener_regiones_disponibles, indice_muestreo, indice_bits, GRUPO_EDAD_BINS, GRUPO_EDAD_LABELS, REGIONES_EN_MEMORIA
+from muestreo import muestra_por_estrato
+from cubo import (filtrar_cubo, resumen_cubo, conteo_por_sexo, conteo_por_tramos, contar_entre_edades,
+                  histograma_acumulado, histograma_edad, tramos_edad, EDAD_MAX, SEXO_ETIQUETAS)
+from filtros import SIN_DATO, contar_por, contar_por_region, posiciones, region_por_comuna, valores_atributo
 
 # Configuración de página
 st.set_page_config(page_title="Gráficas - Censo 2017", page_icon="📈", layout="wide")
 
+# Calentamiento de cachés en segundo plano, si esta es la primera página abierta
+iniciar_calentamiento()
+iniciar_exportador_metricas()
+iniciar_medicion()
+
 # CSS personalizado
 st.markdown("""
 <style>
@@ -43,15 +55,21 @@ st.markdown("""
 </div>
 """, unsafe_allow_html=True)
 
-# Cargar datos (OPTIMIZADO)
-@st.cache_data
-def load_chart_data():
-    """Carga datos optimizados para gráficas."""
-    regiones, comunas, censo = cargar_datos()
+# Cargar datos (OPTIMIZADO, compartidos entre sesiones)
+@instrumentado(cache=st.cache_resource, max_entries=1)
+def load_chart_data(version):
+    """Carga datos optimizados para gráficas (sin microdatos: basta el cubo)."""
+    regiones, comunas = obtener_geometrias()
     regiones_lista = obtener_regiones_disponibles(regiones)
     
-    # Crear datos pre-agregados para mejor rendimiento
-    datos_regionales, edad_region, sexo_region, censo_sample = crear_datos_optimizados(censo)
+    # Agregaciones exactas desde el cubo de conteos
+    cubo = cargar_cubo()
+    datos_regionales = resumen_cubo(cubo, 'region_id', ['mean', 'median', 'std'])
+    # Histogramas de edad acumulados: cualquier agrupación de edades sale de ellos
+    # restando columnas, sin volver a recorrer el cubo
+    edades = histograma_acumulado(cubo, ['region_id', 'comuna_id', 'sexo'])
+    edad_region = conteo_por_tramos(edades, GRUPO_EDAD_BINS, GRUPO_EDAD_LABELS, por=['region_id'])
+    sexo_region = conteo_por_sexo(cubo, por=['region_id'])
     
     # Unir con nombres de regiones
     if 'region_nombre' in regiones.columns:
@@ -68,11 +86,30 @@ def load_chart_data():
             on='region_id', how='left'
         )
     
-    return regiones, comunas, censo_sample, regiones_lista, datos_regionales, edad_region, sexo_region
+    return regiones, comunas, cubo, edades, regiones_lista, datos_regionales, edad_region, sexo_region
+
+@instrumentado(cache=st.cache_resource, max_entries=1)
+def load_sample_index(version):
+    """Microdatos e índice pre-barajado por región, solo para las vistas que muestrean."""
+    regiones, comunas, censo = cargar_datos()
+    return censo, indice_muestreo(censo, 'region_id')
+
+@instrumentado(cache=st.cache_resource, max_entries=REGIONES_EN_MEMORIA)
+def load_region_sample_index(region_id, version):
+    """Microdatos de una región e índice pre-barajado por comuna, para las vistas de una región."""
+    censo = cargar_censo_region(region_id)
+    return censo, indice_muestreo(censo, 'comuna_id')
+
+@instrumentado(cache=st.cache_resource, max_entries=1)
+def load_filter_index(version):
+    """Microdatos e índice de mapas de bits, solo para la vista de filtros cruzados."""
+    regiones, comunas, censo = cargar_datos()
+    return censo, indice_bits(censo)
 
 try:
     with st.spinner("🔄 Cargando y procesando datos optimizados..."):
-        regiones, comunas, censo_sample, regiones_lista, datos_regionales, edad_region, sexo_region = load_chart_data()
+        (regiones, comunas, cubo, edades, regiones_lista,
+         datos_regionales, edad_region, sexo_region) = load_chart_data(version_datos())
         st.success("✅ Datos cargados exitosamente!")
 except Exception as e:
     st.error(f"❌ Error al cargar los datos: {str(e)}")
@@ -92,11 +129,14 @@ tipo_analisis = st.sidebar.selectbox(
         "🏛️ Comparación Regional",
         "👥 Distribución Demográfica",
         "🎂 Análisis por Edad",
-        "⚖️ Distribución por Sexo"
+        "⚖️ Distribución por Sexo",
+        "🔎 Filtros Cruzados"
     ],
     help="Selecciona el tipo de análisis que quieres visualizar"
 )
 
+inicio_analisis = time.perf_counter()
+
 # ===== ANÁLISIS 1: COMPARACIÓN REGIONAL =====
 if tipo_analisis == "🏛️ Comparación Regional":
     st.subheader("🏛️ Comparación entre Regiones")
@@ -188,12 +228,16 @@ elif tipo_analisis == "👥 Distribución Demográfica":
                                         if 'region_nombre' in regiones_lista.columns and len(regiones_lista[regiones_lista['region_id']==x]) > 0 else "")
     )
     
+    ancho_tramo = st.sidebar.slider("📏 Ancho de los grupos de edad (años):", 1, 20, 5)
+    
     # Filtrar datos según selección
     if region_seleccionada == 'Nacional':
-        censo_filtrado = censo_sample.copy()
+        cubo_filtrado = cubo
+        edades_filtradas = edades
         titulo_region = "Nacional"
     else:
-        censo_filtrado = censo_sample[censo_sample['region_id'] == region_seleccionada].copy()
+        cubo_filtrado = filtrar_cubo(cubo, region_seleccionada)
+        edades_filtradas = edades.xs(region_seleccionada, level='region_id', drop_level=False)
         if 'region_nombre' in regiones.columns:
             nombre_region = regiones[regiones['region_id'] == region_seleccionada]['region_nombre'].iloc[0]
             titulo_region = f"Región {region_seleccionada} - {nombre_region}"
@@ -201,32 +245,29 @@ elif tipo_analisis == "👥 Distribución Demográfica":
             titulo_region = f"Región {region_seleccionada}"
     
     # Métricas de la región seleccionada
+    hist_edad = histograma_edad(cubo_filtrado).iloc[0]
+    poblacion_filtrada = hist_edad.sum()
     col1, col2, col3, col4 = st.columns(4)
     with col1:
-        st.metric("👥 Población", f"{len(censo_filtrado):,}")
+        st.metric("👥 Población", f"{poblacion_filtrada:,}")
     with col2:
-        edad_prom = censo_filtrado['edad'].mean()
+        edad_prom = (hist_edad.index * hist_edad).sum() / poblacion_filtrada
         st.metric("🎂 Edad Promedio", f"{edad_prom:.1f} años")
     with col3:
-        pct_mujeres = (censo_filtrado['sexo_cat'] == 'Mujer').sum() / len(censo_filtrado) * 100
+        pct_mujeres = cubo_filtrado.loc[cubo_filtrado['sexo'] == 2, 'poblacion'].sum() / poblacion_filtrada * 100
         st.metric("👩 % Mujeres", f"{pct_mujeres:.1f}%")
     with col4:
-        pct_jovenes = (censo_filtrado['edad'] <= 25).sum() / len(censo_filtrado) * 100
+        pct_jovenes = hist_edad.loc[:25].sum() / poblacion_filtrada * 100
         st.metric("👶 % ≤25 años", f"{pct_jovenes:.1f}%")
     
     # Gráfica 1: Pirámide Poblacional con Altair (más rápida)
     st.markdown(f"### 🔺 Pirámide Poblacional - {titulo_region}")
     
-    # Crear datos para la pirámide usando Altair
-    censo_piramide = censo_filtrado.copy()
-    censo_piramide['grupo_edad'] = pd.cut(
-        censo_piramide['edad'],
-        bins=list(range(0, 85, 5)) + [100],
-        labels=[f"{i}-{i+4}" for i in range(0, 80, 5)] + ["80+"]
-    )
-    
-    # Contar por grupo de edad y sexo
-    piramide_data = censo_piramide.groupby(['grupo_edad', 'sexo_cat']).size().reset_index(name='count')
+    # Contar por grupo de edad y sexo desde los histogramas acumulados
+    bins_piramide, labels_piramide = tramos_edad(ancho_tramo, hasta=80)
+    piramide_data = conteo_por_tramos(
+        edades_filtradas, bins_piramide, labels_piramide, por=['sexo']
+    ).rename(columns={'poblacion': 'count'})
     
     # Para los hombres, hacer los valores negativos para la izquierda
     piramide_data.loc[piramide_data['sexo_cat'] == 'Hombre', 'count'] *= -1
@@ -241,7 +282,7 @@ elif tipo_analisis == "👥 Distribución Demográfica":
                 axis=alt.Axis(title='Población'),
                 scale=alt.Scale(domain=[-piramide_data['count'].abs().max() * 1.1, 
                                       piramide_data['count'].abs().max() * 1.1])),
-        y=alt.Y('grupo_edad:N', axis=alt.Axis(title='Grupo de Edad')),
+        y=alt.Y('grupo_edad:N', axis=alt.Axis(title='Grupo de Edad'), sort=labels_piramide[::-1]),
         color=alt.Color('sexo_cat:N', 
                        scale=alt.Scale(range=['lightblue', 'pink']),
                        legend=alt.Legend(title="Sexo")),
@@ -253,23 +294,51 @@ elif tipo_analisis == "👥 Distribución Demográfica":
     )
     
     st.altair_chart(piramide_chart, use_container_width=True)
+    
+    # Gráfica 2: Distribución de edad por comuna (solo con una región elegida)
+    if region_seleccionada != 'Nacional':
+        st.markdown(f"### 🏘️ Distribución de Edad por Comuna - {titulo_region}")
+        muestra_comuna = st.sidebar.slider("Tamaño de muestra (por comuna):", 100, 5000, 500)
+        
+        # Solo se leen los microdatos de la región elegida (LRU de REGIONES_EN_MEMORIA regiones)
+        with st.spinner("🔄 Cargando microdatos de la región..."):
+            censo_reg, indice_comunas = load_region_sample_index(region_seleccionada, version_datos())
+        with medir("muestra_por_comuna", filas_entrada=len(censo_reg)) as evento:
+            censo_muestra = muestra_por_estrato(censo_reg, indice_comunas, muestra_comuna)[['comuna_id', 'edad']]
+            evento['filas_salida'] = len(censo_muestra)
+        
+        if 'comuna_nombre' in comunas.columns:
+            nombres_comuna = dict(zip(comunas['comuna_id'], comunas['comuna_nombre']))
+        else:
+            nombres_comuna = {}
+        censo_muestra['comuna_label'] = censo_muestra['comuna_id'].map(
+            lambda x: nombres_comuna.get(x, f"Comuna {x}"))
+        
+        boxplot_comunas = alt.Chart(censo_muestra).mark_boxplot(extent='min-max').encode(
+            x=alt.X('comuna_label:N', axis=alt.Axis(title='Comuna', labelAngle=-45)),
+            y=alt.Y('edad:Q', axis=alt.Axis(title='Edad (años)')),
+            color=alt.Color('comuna_label:N', legend=None)
+        ).properties(
+            width=800,
+            height=400,
+            title=f"Distribución de Edad por Comuna (Boxplot) - {titulo_region}"
+        )
+        
+        st.altair_chart(boxplot_comunas, use_container_width=True)
 
 # ===== ANÁLISIS 3: ANÁLISIS POR EDAD =====
 elif tipo_analisis == "🎂 Análisis por Edad":
     st.subheader("🎂 Distribución por Grupos de Edad")
     
-    # Crear grupos de edad más detallados
-    censo_edad = censo_sample.copy()
-    censo_edad['grupo_edad_detallado'] = pd.cut(
-        censo_edad['edad'],
-        bins=[0, 5, 15, 25, 35, 45, 55, 65, 75, 100],
-        labels=['0-4', '5-14', '15-24', '25-34', '35-44', '45-54', '55-64', '65-74', '75+']
-    )
-    
     # Gráfica 1: Distribución general por edad usando Altair
     st.markdown("### 📊 Distribución de Población por Grupos de Edad")
     
-    distribucion_edad = censo_edad['grupo_edad_detallado'].value_counts().reset_index()
+    # Grupos de edad más detallados, contados desde los histogramas acumulados
+    distribucion_edad = conteo_por_tramos(
+        edades,
+        bins=[0, 5, 15, 25, 35, 45, 55, 65, 75, EDAD_MAX + 1],
+        labels=['0-4', '5-14', '15-24', '25-34', '35-44', '45-54', '55-64', '65-74', '75+']
+    )
     distribucion_edad.columns = ['grupo_edad', 'count']
     
     pie_chart = alt.Chart(distribucion_edad).mark_arc().encode(
@@ -291,11 +360,18 @@ elif tipo_analisis == "🎂 Análisis por Edad":
     # Filtros para la visualización
     max_edad = st.sidebar.slider("Edad máxima a mostrar:", 0, 100, 80)
     muestra_size = st.sidebar.slider("Tamaño de muestra (por región):", 100, 10000, 1000)
-    
-    # Crear muestra para visualización más rápida
-    censo_muestra = censo_sample[censo_sample['edad'] <= max_edad].groupby('region_id').apply(
-        lambda x: x.sample(min(len(x), muestra_size), random_state=42)
-    ).reset_index(drop=True)
+    ancho_tramo = st.sidebar.slider("📏 Ancho de los grupos de edad (años):", 1, 20, 5)
+    
+    # Muestra por región desde el índice pre-barajado (mismo tamaño en todas las regiones);
+    # los microdatos se cargan recién aquí, la primera vez que se abre esta vista
+    with st.spinner("🔄 Cargando microdatos para la muestra..."):
+        censo, indice_regiones = load_sample_index(version_datos())
+    with medir("muestra_por_estrato", filas_entrada=len(censo)) as evento:
+        censo_muestra = muestra_por_estrato(
+            censo, indice_regiones, muestra_size,
+            condicion=lambda filas: filas['edad'] <= max_edad
+        )[['region_id', 'edad']]
+        evento['filas_salida'] = len(censo_muestra)
     
     # Añadir nombres de región si están disponibles
     if 'region_nombre' in regiones.columns:
@@ -321,14 +397,160 @@ elif tipo_analisis == "🎂 Análisis por Edad":
     
     st.altair_chart(boxplot_chart, use_container_width=True)
 
+    # Gráfica 3: Población por edad hasta la edad máxima, con el ancho de grupo elegido
+    st.markdown(f"### 📏 Población hasta los {max_edad} años (grupos de {ancho_tramo} años)")
+
+    # Exacto y sin microdatos: cada grupo es una resta entre dos edades del histograma acumulado
+    bins_edad, labels_edad = tramos_edad(ancho_tramo, hasta=max_edad, abierto=False)
+    poblacion_hasta = conteo_por_tramos(edades, bins_edad, labels_edad).rename(columns={'poblacion': 'count'})
+    total_hasta = contar_entre_edades(edades, [0, max_edad + 1], ['total'])['total'].sum()
+    st.metric(f"👥 Personas de {max_edad} años o menos",
+              f"{total_hasta:,}", f"{total_hasta / edades.iloc[:, -1].sum() * 100:.1f}% de la población",
+              delta_color="off")
+
+    bar_hasta = alt.Chart(poblacion_hasta).mark_bar(color='#1f77b4').encode(
+        x=alt.X('grupo_edad:N', axis=alt.Axis(title='Grupo de Edad'), sort=labels_edad),
+        y=alt.Y('count:Q', axis=alt.Axis(title='Población')),
+        tooltip=['grupo_edad', 'count']
+    ).properties(
+        width=600,
+        height=400,
+        title=f"Población por Grupos de {ancho_tramo} Años (Nacional)"
+    )
+
+    st.altair_chart(bar_hasta, use_container_width=True)
+
+# ===== ANÁLISIS 5: FILTROS CRUZADOS =====
+elif tipo_analisis == "🔎 Filtros Cruzados":
+    st.subheader("🔎 Filtros Cruzados sobre los Microdatos")
+    
+    # Microdatos e índice de mapas de bits; se cargan la primera vez que se abre esta vista
+    with st.spinner("🔄 Cargando microdatos e índice de filtros..."):
+        censo, indice = load_filter_index(version_datos())
+    if indice is None:
+        st.error("❌ El censo cargado no está ordenado por región y comuna: no se puede usar el índice de filtros.")
+        st.stop()
+    
+    def etiqueta_codigo(valor):
+        return "Sin dato" if valor == SIN_DATO else f"Código {valor}"
+    
+    # Filtros (una lista vacía o el rango completo = sin filtro)
+    nombres_region = (dict(zip(regiones_lista['region_id'], regiones_lista['region_nombre']))
+                      if 'region_nombre' in regiones_lista.columns else {})
+    regiones_filtro = st.sidebar.multiselect(
+        "🏛️ Regiones:",
+        options=list(regiones_lista['region_id']),
+        format_func=lambda x: f"{x} - {nombres_region[x]}" if x in nombres_region else f"Región {x}"
+    )
+    region_comuna = region_por_comuna(indice)
+    if regiones_filtro:
+        region_comuna = region_comuna[region_comuna.isin(regiones_filtro)]
+    nombres_comuna = (dict(zip(comunas['comuna_id'], comunas['comuna_nombre']))
+                      if 'comuna_nombre' in comunas.columns else {})
+    comunas_filtro = st.sidebar.multiselect(
+        "🏘️ Comunas:",
+        options=region_comuna.index.tolist(),
+        format_func=lambda x: f"{x} - {nombres_comuna[x]}" if x in nombres_comuna else f"Comuna {x}"
+    )
+    sexo_filtro = st.sidebar.multiselect(
+        "⚧ Sexo:", options=valores_atributo(indice, 'sexo'),
+        format_func=lambda x: SEXO_ETIQUETAS.get(x, etiqueta_codigo(x))
+    )
+    edad_filtro = st.sidebar.multiselect("🎂 Tramo de edad:", options=valores_atributo(indice, 'tramo_edad'))
+    trabajo_filtro = st.sidebar.multiselect(
+        "💼 Trabajo (P16):", options=valores_atributo(indice, 'trabajo'), format_func=etiqueta_codigo
+    )
+    valores_escolaridad = valores_atributo(indice, 'escolaridad')
+    rango_escolaridad = st.sidebar.select_slider(
+        "🎓 Escolaridad:",
+        options=valores_escolaridad,
+        value=(valores_escolaridad[0], valores_escolaridad[-1]),
+        format_func=lambda x: etiqueta_codigo(x) if x == SIN_DATO else str(x)
+    )
+    desde = valores_escolaridad.index(rango_escolaridad[0])
+    hasta = valores_escolaridad.index(rango_escolaridad[1])
+    
+    seleccion = dict(regiones=regiones_filtro or None, comunas=comunas_filtro or None)
+    filtros_bits = dict(
+        sexo=sexo_filtro or None,
+        tramo_edad=edad_filtro or None,
+        trabajo=trabajo_filtro or None,
+        escolaridad=(None if (desde, hasta) == (0, len(valores_escolaridad) - 1)
+                     else valores_escolaridad[desde:hasta + 1])
+    )
+    
+    # Conteos con el índice: AND/OR de mapas de bits sobre los tramos de la selección
+    inicio_conteo = time.perf_counter()
+    with medir("filtros_cruzados", filas_entrada=indice.filas) as evento:
+        por_region = contar_por_region(indice, **seleccion, **filtros_bits)
+        por_sexo = contar_por(indice, 'sexo', **seleccion, **filtros_bits)
+        por_edad = contar_por(indice, 'tramo_edad', **seleccion, **filtros_bits)
+        total_filtrado = int(por_region.sum())
+        evento['filas_salida'] = total_filtrado
+    ms_conteo = (time.perf_counter() - inicio_conteo) * 1000
+    
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        st.metric("👥 Personas que cumplen los filtros", f"{total_filtrado:,}")
+    with col2:
+        st.metric("🇨🇱 % de la población nacional", f"{total_filtrado / max(indice.filas, 1) * 100:.2f}%")
+    with col3:
+        st.metric("⚡ Tiempo de los conteos", f"{ms_conteo:.1f} ms")
+    
+    # Gráfica 1: Personas por región
+    st.markdown("### 🏛️ Personas por Región")
+    conteo_region = por_region.reset_index()
+    conteo_region['region_label'] = conteo_region['region_id'].map(
+        lambda x: nombres_region.get(x, f"Región {x}"))
+    bar_region = alt.Chart(conteo_region).mark_bar().encode(
+        x=alt.X('region_label:N', axis=alt.Axis(title='Región', labelAngle=-45),
+                sort=alt.SortField(field='region_id', order='ascending')),
+        y=alt.Y('poblacion:Q', axis=alt.Axis(title='Personas')),
+        tooltip=['region_label', 'poblacion']
+    ).properties(height=350)
+    st.altair_chart(bar_region, use_container_width=True)
+    
+    # Gráficas 2 y 3: Personas por tramo de edad y por sexo
+    col1, col2 = st.columns(2)
+    with col1:
+        st.markdown("### 🎂 Por Tramo de Edad")
+        conteo_edad = por_edad.reset_index()
+        bar_edad = alt.Chart(conteo_edad).mark_bar(color='#4ECDC4').encode(
+            x=alt.X('tramo_edad:N', axis=alt.Axis(title='Tramo de Edad'), sort=None),
+            y=alt.Y('poblacion:Q', axis=alt.Axis(title='Personas')),
+            tooltip=['tramo_edad', 'poblacion']
+        ).properties(height=300)
+        st.altair_chart(bar_edad, use_container_width=True)
+    with col2:
+        st.markdown("### ⚖️ Por Sexo")
+        conteo_sexo = por_sexo.reset_index()
+        conteo_sexo['sexo_cat'] = conteo_sexo['sexo'].map(lambda x: SEXO_ETIQUETAS.get(x, etiqueta_codigo(x)))
+        bar_sexo = alt.Chart(conteo_sexo).mark_bar().encode(
+            x=alt.X('sexo_cat:N', axis=alt.Axis(title='Sexo')),
+            y=alt.Y('poblacion:Q', axis=alt.Axis(title='Personas')),
+            color=alt.Color('sexo_cat:N', scale=alt.Scale(range=['#87CEEB', '#FF69B4']), legend=None),
+            tooltip=['sexo_cat', 'poblacion']
+        ).properties(height=300)
+        st.altair_chart(bar_sexo, use_container_width=True)
+    
+    # Primeras filas que cumplen los filtros (selección de filas con el mismo índice)
+    st.markdown("### 📋 Personas que Cumplen los Filtros (primeras 1.000)")
+    filas = posiciones(indice, limite=1000, **seleccion, **filtros_bits)
+    st.dataframe(
+        censo.iloc[filas][['region_id', 'comuna_id', 'sexo_cat', 'edad', 'trabajo', 'escolaridad']],
+        use_container_width=True, hide_index=True
+    )
+
 # ===== ANÁLISIS 4: DISTRIBUCIÓN POR SEXO =====
 else:  # Distribución por Sexo
     st.subheader("⚖️ Análisis de Distribución por Sexo")
     
     # Métricas generales de género
-    total_personas = len(censo_sample)
-    total_mujeres = (censo_sample['sexo_cat'] == 'Mujer').sum()
-    total_hombres = (censo_sample['sexo_cat'] == 'Hombre').sum()
+    distribucion_sexo = conteo_por_sexo(cubo)
+    conteo_sexo = distribucion_sexo.set_index('sexo_cat')['poblacion']
+    total_personas = int(cubo['poblacion'].sum())
+    total_mujeres = int(conteo_sexo.get('Mujer', 0))
+    total_hombres = int(conteo_sexo.get('Hombre', 0))
     
     col1, col2, col3 = st.columns(3)
     with col1:
@@ -342,7 +564,6 @@ else:  # Distribución por Sexo
     # Gráfica 1: Distribución general usando Altair
     st.markdown("### 🥧 Distribución General por Sexo")
     
-    distribucion_sexo = censo_sample['sexo_cat'].value_counts().reset_index()
     distribucion_sexo.columns = ['sexo', 'count']
     
     pie_sexo = alt.Chart(distribucion_sexo).mark_arc().encode(
@@ -361,9 +582,7 @@ else:  # Distribución por Sexo
     # Gráfica 2: Distribución por región
     st.markdown("### 🏛️ Porcentaje de Mujeres por Región")
     
-    pct_mujeres_region = censo_sample.groupby('region_id').apply(
-        lambda x: (x['sexo_cat'] == 'Mujer').sum() / len(x) * 100
-    ).reset_index(name='pct_mujeres')
+    pct_mujeres_region = datos_regionales[['region_id', 'pct_mujeres']].copy()
     
     # Añadir nombres de región
     if 'region_nombre' in regiones.columns:
@@ -395,16 +614,10 @@ else:  # Distribución por Sexo
     # Gráfica 3: Distribución por edad y sexo
     st.markdown("### 👥 Distribución por Edad y Sexo")
     
-    # Crear grupos de edad
-    censo_sexo_edad = censo_sample.copy()
-    censo_sexo_edad['grupo_edad'] = pd.cut(
-        censo_sexo_edad['edad'],
-        bins=[0, 18, 30, 45, 65, 100],
-        labels=['0-17', '18-29', '30-44', '45-64', '65+']
-    )
-    
-    # Contar por grupo de edad y sexo
-    distribucion_edad_sexo = censo_sexo_edad.groupby(['grupo_edad', 'sexo_cat']).size().reset_index(name='count')
+    # Contar por grupo de edad y sexo desde los histogramas acumulados
+    distribucion_edad_sexo = conteo_por_tramos(
+        edades, GRUPO_EDAD_BINS, GRUPO_EDAD_LABELS, por=['sexo']
+    ).rename(columns={'poblacion': 'count'})
     
     bar_edad_sexo = alt.Chart(distribucion_edad_sexo).mark_bar().encode(
         x=alt.X('grupo_edad:N', axis=alt.Axis(title='Grupo de Edad')),
@@ -421,6 +634,8 @@ else:  # Distribución por Sexo
     
     st.altair_chart(bar_edad_sexo, use_container_width=True)
 
+registrar(f"análisis: {tipo_analisis}", time.perf_counter() - inicio_analisis)
+
 # Footer con información adicional
 st.markdown("---")
 with st.expander("📊 Información Técnica"):
@@ -439,9 +654,14 @@ with st.expander("📊 Información Técnica"):
     - Correlaciones entre variables demográficas
     
     **Optimizaciones:**
-    - Uso de muestras para visualizaciones grandes
+    - Cubo de conteos (región × comuna × sexo × edad) para agregaciones exactas
+    - Muestras estratificadas por región (pre-barajadas) solo para el boxplot de edades
+    - Mapas de bits por sexo, tramo de edad, trabajo y escolaridad para los filtros cruzados
     - Cache de datos para mejorar rendimiento
     - Visualizaciones interactivas con zoom y filtros
     
     **Nota:** Los datos pueden contener valores faltantes o inconsistencias menores debido al proceso de recolección del censo.
-    """)
\ No newline at end of file
+    """)
+
+# Tiempos por etapa de esta ejecución
+mostrar_panel_depuracion()
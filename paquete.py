@@ -0,0 +1,184 @@
+"""
+Paquete de datos versionado, construido fuera de la app.
+
+Hace de una vez todo el preprocesamiento (lectura del CSV, renombres,
+tipos, reproyección de geometrías, agregados, simplificación) y deja un
+directorio listo para servir:
+
+    censo_parquet/                 Microdatos columnar, particionados por región
+    censo.arrow                    Microdatos compactos para mapear en memoria
+    cubo.parquet                   Conteos región × comuna × sexo × edad
+    estadisticas_comunales.parquet Resumen exacto por comuna
+    geometrias/                    Regiones y comunas (EPSG:4326) y sus niveles simplificados
+    tablas/                        Códigos y nombres de regiones y comunas (CSV)
+    manifiesto.json                Versión, origen y checksums SHA-256 de cada archivo
+
+La app lo usa con `CENSO_PAQUETE=<directorio> streamlit run app.py`: al
+arrancar solo lee archivos, sin descargar ni generar nada.
+
+Ejemplos:
+    python paquete.py construir --salida dist/paquete
+    python paquete.py verificar dist/paquete
+"""
+import argparse
+import datetime
+import hashlib
+import json
+import os
+import shutil
+
+from cubo import construir_cubo, resumen_comunal
+from descargas import sha256_archivo
+from geometrias import construir_geometrias_simplificadas
+from utils import (PROCESOS_INGESTA, _fuente_censo, cargar_geometrias, exportar_censo_compartido,
+                   ingestar_censo_columnar, leer_censo_columnar, version_datos)
+
+FORMATO_PAQUETE = 1
+MANIFIESTO = "manifiesto.json"
+
+def _archivos(directorio):
+    """Rutas relativas (con `/`) de todos los archivos del paquete, salvo el manifiesto."""
+    rutas = []
+    for raiz, _, nombres in os.walk(directorio):
+        for nombre in nombres:
+            relativa = os.path.relpath(os.path.join(raiz, nombre), directorio).replace(os.sep, "/")
+            if relativa != MANIFIESTO:
+                rutas.append(relativa)
+    return sorted(rutas)
+
+def escribir_manifiesto(directorio, fuente):
+    """
+    Escribe `manifiesto.json` con el tamaño y el SHA-256 de cada archivo.
+
+    La versión del paquete es un hash de esos checksums: dos construcciones
+    con el mismo contenido tienen la misma versión.
+    """
+    archivos = {relativa: {"bytes": os.path.getsize(os.path.join(directorio, relativa)),
+                           "sha256": sha256_archivo(os.path.join(directorio, relativa))}
+                for relativa in _archivos(directorio)}
+    huella = hashlib.sha256("".join(f"{r}:{a['sha256']}" for r, a in archivos.items()).encode())
+    manifiesto = {
+        "formato": FORMATO_PAQUETE,
+        "version": huella.hexdigest()[:16],
+        "creado": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+        "fuente": fuente,
+        "archivos": archivos,
+    }
+    with open(os.path.join(directorio, MANIFIESTO), "w", encoding="utf-8") as f:
+        json.dump(manifiesto, f, indent=2, ensure_ascii=False)
+    return manifiesto
+
+def construir_paquete(salida, fuente=None, chunksize=500000, procesos=PROCESOS_INGESTA):
+    """
+    Construye el paquete de datos completo en `salida`.
+
+    Se arma en un directorio temporal que reemplaza a `salida` solo al final,
+    así que un paquete a medio construir nunca queda a la vista.
+
+    Args:
+        salida: Directorio del paquete
+        fuente: Ruta o URL del CSV del censo (por defecto `_fuente_censo()`)
+        chunksize: Filas por bloque leído del CSV
+        procesos: Procesos para ingerir el CSV en paralelo
+
+    Returns:
+        Manifiesto del paquete
+    """
+    fuente = fuente or _fuente_censo()
+    temporal = salida.rstrip("/\\") + ".tmp"
+    shutil.rmtree(temporal, ignore_errors=True)
+    os.makedirs(temporal)
+
+    print("Microdatos: copia columnar por región...")
+    dir_columnar = ingestar_censo_columnar(fuente, os.path.join(temporal, "censo_parquet"), chunksize, procesos)
+    censo = leer_censo_columnar(dir_columnar)
+    exportar_censo_compartido(censo, os.path.join(temporal, "censo.arrow"))
+
+    print("Agregados: cubo y estadísticas comunales...")
+    cubo = construir_cubo(censo)
+    del censo
+    cubo.to_parquet(os.path.join(temporal, "cubo.parquet"), index=False)
+    resumen_comunal(cubo).to_parquet(os.path.join(temporal, "estadisticas_comunales.parquet"), index=False)
+
+    print("Geometrías: originales y niveles simplificados...")
+    regiones, comunas = cargar_geometrias()
+    dir_geometrias = os.path.join(temporal, "geometrias")
+    os.makedirs(dir_geometrias)
+    regiones.to_parquet(os.path.join(dir_geometrias, "regiones.parquet"))
+    comunas.to_parquet(os.path.join(dir_geometrias, "comunas.parquet"))
+    construir_geometrias_simplificadas(regiones, comunas, dir_geometrias)
+
+    print("Tablas de códigos...")
+    dir_tablas = os.path.join(temporal, "tablas")
+    os.makedirs(dir_tablas)
+    columnas_regiones = [c for c in ["region_id", "region_nombre"] if c in regiones.columns]
+    columnas_comunas = [c for c in ["comuna_id", "region_id_com", "comuna_nombre", "provincia_nombre"]
+                        if c in comunas.columns]
+    (regiones[columnas_regiones].drop_duplicates("region_id").sort_values("region_id")
+     .to_csv(os.path.join(dir_tablas, "regiones.csv"), index=False))
+    (comunas[columnas_comunas].rename(columns={"region_id_com": "region_id"})
+     .drop_duplicates("comuna_id").sort_values("comuna_id")
+     .to_csv(os.path.join(dir_tablas, "comunas.csv"), index=False))
+
+    print("Manifiesto y checksums...")
+    manifiesto = escribir_manifiesto(temporal, version_datos(fuente))
+    shutil.rmtree(salida, ignore_errors=True)
+    os.replace(temporal, salida)
+    return manifiesto
+
+def verificar_paquete(directorio, checksums=True):
+    """
+    Compara el contenido de un paquete con su manifiesto.
+
+    Args:
+        directorio: Directorio del paquete
+        checksums: Si además del tamaño se recalcula el SHA-256 de cada archivo
+
+    Returns:
+        Lista de problemas encontrados (vacía si el paquete está íntegro)
+    """
+    ruta = os.path.join(directorio, MANIFIESTO)
+    if not os.path.exists(ruta):
+        return [f"Falta {MANIFIESTO}"]
+    with open(ruta, encoding="utf-8") as f:
+        manifiesto = json.load(f)
+    if manifiesto.get("formato") != FORMATO_PAQUETE:
+        return [f"Formato de paquete {manifiesto.get('formato')} no soportado (se espera {FORMATO_PAQUETE})"]
+
+    problemas = []
+    for relativa, esperado in manifiesto["archivos"].items():
+        archivo = os.path.join(directorio, relativa)
+        if not os.path.exists(archivo):
+            problemas.append(f"Falta {relativa}")
+        elif os.path.getsize(archivo) != esperado["bytes"]:
+            problemas.append(f"Tamaño distinto en {relativa}")
+        elif checksums and sha256_archivo(archivo) != esperado["sha256"]:
+            problemas.append(f"Checksum distinto en {relativa}")
+    for relativa in sorted(set(_archivos(directorio)) - set(manifiesto["archivos"])):
+        problemas.append(f"Archivo no declarado {relativa}")
+    return problemas
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Construye o verifica el paquete de datos de la app.")
+    comandos = parser.add_subparsers(dest="comando", required=True)
+    construir = comandos.add_parser("construir", help="Construye el paquete desde el CSV y los shapefiles")
+    construir.add_argument("--salida", default=os.path.join("dist", "paquete"), help="Directorio del paquete")
+    construir.add_argument("--fuente", default=None, help="CSV del censo (por defecto el local o el del release)")
+    construir.add_argument("--chunksize", type=int, default=500000, help="Filas por bloque del CSV")
+    construir.add_argument("--procesos", type=int, default=PROCESOS_INGESTA,
+                           help="Procesos para ingerir el CSV (por defecto, uno por núcleo)")
+    verificar = comandos.add_parser("verificar", help="Comprueba tamaños y checksums contra el manifiesto")
+    verificar.add_argument("directorio", help="Directorio del paquete")
+    verificar.add_argument("--rapido", action="store_true", help="Solo compara tamaños, sin checksums")
+    args = parser.parse_args()
+
+    if args.comando == "construir":
+        manifiesto = construir_paquete(args.salida, args.fuente, args.chunksize, args.procesos)
+        print(f"Paquete {manifiesto['version']} ({len(manifiesto['archivos'])} archivos) en: {args.salida}")
+        print("¡Proceso completado!")
+    else:
+        problemas = verificar_paquete(args.directorio, checksums=not args.rapido)
+        for problema in problemas:
+            print(f"  {problema}")
+        print("Paquete íntegro." if not problemas else f"{len(problemas)} problema(s) encontrados.")
+        raise SystemExit(1 if problemas else 0)
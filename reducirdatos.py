@@ -1,24 +1,169 @@
+"""
+Reduce el CSV del censo por bloques, en memoria acotada.
+
+Lee el archivo original en bloques de `--chunksize` filas, se queda con una
+fracción de las filas (muestreo de Bernoulli con semilla fija, o sistemático
+por estrato para respetar exactamente la proporción de cada región o comuna)
+y escribe el resultado a medida que avanza, en CSV o Parquet. La memoria
+usada depende del tamaño del bloque, no del archivo.
+
+Ejemplos:
+    python reducirdatos.py
+    python reducirdatos.py --fraccion 0.1 --columnas app --estratificar region_id
+    python reducirdatos.py --formato parquet --salida data/censo_reducido.parquet
+"""
+import argparse
+import os
+
+import numpy as np
 import pandas as pd
 
+from esquema import COL_MAP, DTYPES_CENSO
+
 # Nombre del archivo original y del nuevo archivo
 archivo_original = 'data/Microdato_Censo2017-Personas.csv'
 archivo_reducido = 'data/Microdato_Censo2017-Personas_reducido.csv'
 
-print(f"Cargando el archivo original: {archivo_original}...")
-# Cargar el dataset completo
-df = pd.read_csv(archivo_original)
+def _seleccion_bernoulli(chunk, fraccion, rng):
+    """Máscara de Bernoulli: cada fila entra con probabilidad `fraccion`."""
+    return rng.random(len(chunk)) < fraccion
+
+def _seleccion_estratificada(chunk, fraccion, columna, vistos, inicio, rng):
+    """
+    Máscara de muestreo sistemático dentro de cada estrato.
+
+    La fila k-ésima de un estrato entra si `floor((k + 1) * f + u)` supera a
+    `floor(k * f + u)`, con `u` un arranque aleatorio por estrato. Así cada
+    estrato aporta exactamente `fraccion` de sus filas (±1) sin conocer de
+    antemano su tamaño; `vistos` lleva la cuenta entre bloques.
+    """
+    estratos = chunk[columna].to_numpy()
+    nuevos = set(np.unique(estratos)) - set(inicio)
+    for estrato in sorted(nuevos):
+        inicio[estrato] = rng.random()
+        vistos[estrato] = 0
+
+    offset = pd.Series(estratos).map(vistos).to_numpy()
+    k = offset + chunk.groupby(columna, sort=False).cumcount().to_numpy()
+    u = pd.Series(estratos).map(inicio).to_numpy()
+    mascara = np.floor((k + 1) * fraccion + u) > np.floor(k * fraccion + u)
+
+    for estrato, cantidad in zip(*np.unique(estratos, return_counts=True)):
+        vistos[estrato] += int(cantidad)
+    return mascara
+
+def reducir_censo(entrada, salida, fraccion=0.75, semilla=42, columnas=None,
+                  renombrar=False, estratificar=None, formato='csv',
+                  chunksize=500000, sep=';', encoding='latin1'):
+    """
+    Extrae una submuestra del CSV del censo procesándolo por bloques.
+
+    Args:
+        entrada: Ruta (o URL) del CSV original
+        salida: Ruta del archivo de salida
+        fraccion: Fracción de filas a conservar (0-1)
+        semilla: Semilla del generador aleatorio (resultado reproducible)
+        columnas: Columnas a conservar (None = todas)
+        renombrar: Si se renombran las columnas según `COL_MAP`
+        estratificar: Columna de estrato ('region_id'/'comuna_id' o su nombre
+            original); None usa muestreo de Bernoulli simple
+        formato: 'csv' o 'parquet'
+        chunksize: Filas por bloque
+        sep: Separador del CSV de entrada (y de salida si es CSV)
+        encoding: Codificación del CSV de entrada (y de salida si es CSV)
+
+    Returns:
+        Tupla (filas leídas, filas escritas)
+
+    Raises:
+        FileNotFoundError: Si no existe el archivo de entrada
+        ValueError: Si la entrada está vacía o no tiene encabezado
+    """
+    if not entrada.startswith(('http://', 'https://')):
+        if not os.path.exists(entrada):
+            raise FileNotFoundError(f"No existe el CSV de entrada: {entrada}")
+        if os.path.getsize(entrada) == 0:
+            raise ValueError(f"El CSV de entrada está vacío: {entrada}")
+
+    nombres_originales = {v: k for k, v in COL_MAP.items()}
+    columna_estrato = nombres_originales.get(estratificar, estratificar)
+    usecols = None
+    if columnas is not None:
+        usecols = list(dict.fromkeys(list(columnas) + ([columna_estrato] if columna_estrato else [])))
+    dtype = {c: t for c, t in DTYPES_CENSO.items() if usecols is None or c in usecols}
+
+    rng = np.random.default_rng(semilla)
+    vistos, inicio = {}, {}
+    leidas = escritas = 0
+    escritor = None
+    temporal = salida + '.tmp'
+
+    try:
+        lector = pd.read_csv(entrada, sep=sep, encoding=encoding, usecols=usecols,
+                             dtype=dtype, chunksize=chunksize)
+        for i, chunk in enumerate(lector):
+            leidas += len(chunk)
+            if columna_estrato:
+                mascara = _seleccion_estratificada(chunk, fraccion, columna_estrato, vistos, inicio, rng)
+            else:
+                mascara = _seleccion_bernoulli(chunk, fraccion, rng)
+            muestra = chunk[mascara]
+            if columnas is not None:
+                muestra = muestra[list(columnas)]
+            if renombrar:
+                muestra = muestra.rename(columns=COL_MAP)
+            escritas += len(muestra)
+
+            if formato == 'parquet':
+                import pyarrow as pa
+                import pyarrow.parquet as pq
 
-print(f"El dataset original tiene {len(df)} filas.")
+                tabla = pa.Table.from_pandas(muestra, preserve_index=False)
+                if escritor is None:
+                    escritor = pq.ParquetWriter(temporal, tabla.schema)
+                escritor.write_table(tabla.cast(escritor.schema))
+            else:
+                muestra.to_csv(temporal, sep=sep, encoding=encoding, index=False,
+                               mode='w' if i == 0 else 'a', header=i == 0)
+            print(f"  Bloque {i + 1}: {leidas:,} filas leídas, {escritas:,} conservadas")
+    finally:
+        if escritor is not None:
+            escritor.close()
 
-# Vamos a quedarnos con el 75% de las filas para asegurar que baje de 2 GB.
-# frac=0.75 significa 75%. Puedes ajustar este número.
-# random_state=42 asegura que si lo ejecutas de nuevo, obtengas la misma muestra aleatoria.
-df_reducido = df.sample(frac=0.75, random_state=42)
+    if not os.path.exists(temporal):
+        raise ValueError(f"El CSV de entrada no tiene filas que leer: {entrada}")
+    os.replace(temporal, salida)
+    return leidas, escritas
 
-print(f"El nuevo dataset tendrá {len(df_reducido)} filas.")
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Reduce el CSV del censo por bloques, en memoria acotada.")
+    parser.add_argument("--entrada", default=archivo_original, help="CSV original del censo")
+    parser.add_argument("--salida", default=None, help="Archivo de salida")
+    parser.add_argument("--fraccion", type=float, default=0.75,
+                        help="Fracción de filas a conservar (por defecto 0.75, para bajar de 2 GB)")
+    parser.add_argument("--semilla", type=int, default=42, help="Semilla para una muestra reproducible")
+    parser.add_argument("--columnas", choices=["todas", "app"], default="todas",
+                        help="'app' conserva solo las columnas que usa cargar_datos (COL_MAP)")
+    parser.add_argument("--renombrar", action="store_true",
+                        help="Renombra las columnas como en la app (region_id, comuna_id, ...)")
+    parser.add_argument("--estratificar", choices=["region_id", "comuna_id"], default=None,
+                        help="Respeta exactamente la fracción dentro de cada región o comuna")
+    parser.add_argument("--formato", choices=["csv", "parquet"], default="csv")
+    parser.add_argument("--chunksize", type=int, default=500000, help="Filas por bloque")
+    args = parser.parse_args()
 
-print(f"Guardando el archivo reducido en: {archivo_reducido}...")
-# Guardar el nuevo dataframe en un nuevo archivo CSV
-df_reducido.to_csv(archivo_reducido, index=False)
+    salida = args.salida or (archivo_reducido if args.formato == "csv"
+                             else os.path.splitext(archivo_reducido)[0] + ".parquet")
+    columnas = list(COL_MAP) if args.columnas == "app" else None
 
-print("¡Proceso completado!")
\ No newline at end of file
+    print(f"Reduciendo {args.entrada} al {args.fraccion:.0%} por bloques de {args.chunksize:,} filas...")
+    try:
+        leidas, escritas = reducir_censo(args.entrada, salida, fraccion=args.fraccion,
+                                         semilla=args.semilla, columnas=columnas,
+                                         renombrar=args.renombrar, estratificar=args.estratificar,
+                                         formato=args.formato, chunksize=args.chunksize)
+    except (FileNotFoundError, ValueError) as e:
+        raise SystemExit(f"Error: {e}")
+    print(f"El dataset original tiene {leidas:,} filas; el nuevo tiene {escritas:,}.")
+    print(f"Archivo guardado en: {salida}")
+    print("¡Proceso completado!")
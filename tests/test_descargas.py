@@ -0,0 +1,76 @@
+import hashlib
+import importlib
+import os
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import descargas
+
+CONTENIDO = bytes(range(256)) * 4096
+
+
+class _Espejo(BaseHTTPRequestHandler):
+    """Sirve `CONTENIDO` en cualquier ruta, con soporte de `Range: bytes=N-`."""
+    rangos = []
+
+    def do_GET(self):
+        rango = self.headers.get("Range")
+        _Espejo.rangos.append(rango)
+        desde = int(re.match(r"bytes=(\d+)-", rango).group(1)) if rango else 0
+        if desde >= len(CONTENIDO):
+            self.send_response(416)
+            self.end_headers()
+            return
+        cuerpo = CONTENIDO[desde:]
+        self.send_response(206 if rango else 200)
+        if rango:
+            self.send_header("Content-Range", f"bytes {desde}-{len(CONTENIDO) - 1}/{len(CONTENIDO)}")
+        self.send_header("Content-Length", str(len(cuerpo)))
+        self.end_headers()
+        self.wfile.write(cuerpo)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def espejo(tmp_path, monkeypatch):
+    """Servidor HTTP local como `CENSO_ESPEJO`, con `CENSO_DATOS` en un directorio temporal."""
+    servidor = ThreadingHTTPServer(("127.0.0.1", 0), _Espejo)
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    _Espejo.rangos = []
+    monkeypatch.setenv("CENSO_ESPEJO", f"http://127.0.0.1:{servidor.server_port}")
+    monkeypatch.setenv("CENSO_DATOS", str(tmp_path))
+    monkeypatch.delenv("CENSO_SIN_RED", raising=False)
+    yield importlib.reload(descargas)
+    servidor.shutdown()
+    monkeypatch.undo()
+    importlib.reload(descargas)
+
+
+def test_reanuda_desde_el_parcial(espejo):
+    destino = espejo.ruta_archivo("censo")
+    with open(destino + ".part", "wb") as f:
+        f.write(CONTENIDO[:1000])
+    espejo.registrar_checksum(espejo.ARCHIVOS["censo"], hashlib.sha256(CONTENIDO).hexdigest())
+
+    assert espejo.obtener_archivo("censo") == destino
+    assert _Espejo.rangos == ["bytes=1000-"]
+    with open(destino, "rb") as f:
+        assert f.read() == CONTENIDO
+    assert not os.path.exists(destino + ".part")
+    assert espejo.origen_descarga(destino) == espejo.url_archivo("censo")
+
+
+def test_checksum_incorrecto(espejo):
+    destino = espejo.ruta_archivo("censo")
+    espejo.registrar_checksum(espejo.ARCHIVOS["censo"], "0" * 64)
+
+    with pytest.raises(ValueError, match="Checksum incorrecto"):
+        espejo.obtener_archivo("censo")
+    assert _Espejo.rangos == [None]
+    assert not os.path.exists(destino)
+    assert not os.path.exists(destino + ".part")
@@ -0,0 +1,33 @@
+import folium
+import pandas as pd
+import shapely
+
+from geometrias import CapaGeojson, GeoJsonSerializado, unir_propiedades
+
+
+def _vista(n=5):
+    cuadrados = [shapely.box(i, 0, i + 1, 1) for i in range(n)]
+    capa = CapaGeojson("comuna_id", list(range(n)), shapely.to_geojson(cuadrados).tolist())
+    datos = pd.DataFrame({"comuna_id": range(n), "valor": range(n)})
+    return unir_propiedades(capa, datos, ["valor"])
+
+
+def test_estilos_sobreviven_a_dos_renderizados():
+    vista = _vista()
+    colores = ["red", "blue", "green", "black", "white"]
+    capa = GeoJsonSerializado(
+        vista,
+        style_function=lambda f: {"fillColor": colores[f["properties"]["valor"]]},
+        highlight_function=lambda f: {"weight": 3},
+        tooltip=folium.features.GeoJsonTooltip(fields=["valor"]),
+    )
+    mapa = folium.Map()
+    capa.add_to(mapa)
+
+    # st_folium renderiza la página completa y luego el mapa por separado
+    html = mapa.get_root().render()
+    mapa.render()
+
+    assert len(capa.style_map) == len(vista.features)
+    assert len(capa.highlight_map) == 1
+    assert vista.texto in html
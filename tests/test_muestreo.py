@@ -0,0 +1,48 @@
+import numpy as np
+import pandas as pd
+
+from cubo import EDAD_MAX, construir_cubo, histograma_edad
+from muestreo import (construir_indice_muestreo, estimar_media, estimar_proporcion,
+                      muestra_estratificada, tamanos_estratos)
+
+
+def _censo_sintetico():
+    # Estratos muy desiguales y con edades y % de mujeres distintos: sin pesos,
+    # el mínimo por estrato sesga la muestra hacia los pequeños
+    rng = np.random.default_rng(0)
+    partes = []
+    for region_id, n, edad_media, p_mujer in [(1, 200_000, 50, 0.6), (2, 8_000, 20, 0.4), (3, 2_000, 10, 0.3)]:
+        partes.append(pd.DataFrame({
+            "region_id": np.full(n, region_id, dtype="int8"),
+            "comuna_id": np.full(n, region_id * 1000 + 1, dtype="int32"),
+            "sexo": np.where(rng.random(n) < p_mujer, 2, 1).astype("uint8"),
+            "edad": np.clip(rng.normal(edad_media, 8, n), 0, EDAD_MAX).astype("uint8"),
+        }))
+    return pd.concat(partes, ignore_index=True)
+
+
+def test_pesos_expanden_a_la_poblacion_de_cada_estrato():
+    censo = _censo_sintetico()
+    indice = construir_indice_muestreo(censo)
+    muestra = muestra_estratificada(censo, indice, 20_000, minimo_por_estrato=1_000)
+
+    expandido = muestra.groupby("region_id")["peso"].sum()
+    np.testing.assert_allclose(expandido.to_numpy(), tamanos_estratos(indice).to_numpy())
+
+
+def test_estimaciones_ponderadas_contra_el_cubo():
+    censo = _censo_sintetico()
+    muestra = muestra_estratificada(censo, construir_indice_muestreo(censo), 20_000, minimo_por_estrato=1_000)
+
+    hist = histograma_edad(construir_cubo(censo))
+    media_exacta = (hist.columns.to_numpy() * hist.to_numpy()).sum() / hist.to_numpy().sum()
+    pct_mujeres_exacto = (censo["sexo"] == 2).mean() * 100
+
+    assert abs(estimar_media(muestra, "edad") - media_exacta) < 0.3
+    assert abs(estimar_proporcion(muestra, "sexo", 2) - pct_mujeres_exacto) < 1.5
+    # Sin pesos, la misma muestra se aleja del valor exacto
+    assert abs(muestra["edad"].mean() - media_exacta) > 1.5
+
+    por_region = estimar_media(muestra, "edad", por="region_id")
+    exacta_region = censo.groupby("region_id")["edad"].mean()
+    np.testing.assert_allclose(por_region.to_numpy(), exacta_region.to_numpy(), atol=0.6)
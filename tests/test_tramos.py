@@ -0,0 +1,21 @@
+import numpy as np
+import pandas as pd
+
+from tramos import construir_indice_tramos, filas_comuna, filas_region, ordenar_censo
+
+
+def test_tramos_de_region_y_comuna():
+    rng = np.random.default_rng(1)
+    region = rng.integers(1, 5, 10_000)
+    # Las comunas de la región 1 tienen los códigos más altos: ordenadas dentro
+    # de cada región, pero no en el total
+    comuna = np.where(region == 1, 9000 + rng.integers(0, 5, 10_000), region * 100 + rng.integers(0, 7, 10_000))
+    censo = ordenar_censo(pd.DataFrame({"region_id": region, "comuna_id": comuna}))
+    indice = construir_indice_tramos(censo)
+
+    for comuna_id in [*np.unique(comuna), 5, 150, 99_999]:
+        filas = filas_comuna(censo, indice, comuna_id)
+        assert len(filas) == (censo["comuna_id"] == comuna_id).sum()
+        assert (filas["comuna_id"] == comuna_id).all()
+    for region_id in [0, 1, 2, 3, 4, 7]:
+        assert len(filas_region(censo, indice, region_id)) == (censo["region_id"] == region_id).sum()
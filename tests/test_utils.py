@@ -0,0 +1,13 @@
+import pandas as pd
+
+from utils import _hash_dataframe, marcar_version
+
+
+def test_frame_derivado_no_comparte_la_clave_del_original():
+    censo = marcar_version(pd.DataFrame({"region_id": [1, 1, 2], "edad": [10, 20, 30]}), "v1")
+    derivado = censo.assign(edad=censo["edad"] + 1)
+
+    # `assign` conserva attrs y la forma, pero no el contenido
+    assert derivado.attrs["version"] == "v1"
+    assert _hash_dataframe(derivado) != _hash_dataframe(censo)
+    assert _hash_dataframe(censo.copy()) == _hash_dataframe(censo)
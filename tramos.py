@@ -0,0 +1,92 @@
+from collections import namedtuple
+
+import numpy as np
+
+# Orden físico del censo: cada región, y dentro de ella cada comuna, ocupa un
+# bloque contiguo de filas
+ORDEN_CENSO = ['region_id', 'comuna_id']
+
+# Índice de tramos: las filas de `regiones[i]` son `inicio_region[i]:inicio_region[i + 1]`,
+# y las de `comunas[j]` son `inicio_comuna[j]:inicio_comuna[j + 1]`. Las regiones
+# quedan en orden; las comunas solo dentro de cada región, así que `orden_comunas`
+# es la permutación que las ordena (para buscarlas con `np.searchsorted`).
+IndiceTramos = namedtuple("IndiceTramos", ["regiones", "inicio_region", "comunas", "inicio_comuna",
+                                           "orden_comunas"])
+
+def _bordes(*columnas):
+    """Posiciones donde cambia el valor de alguna de las columnas (incluye 0 y el largo)."""
+    n = len(columnas[0])
+    cambios = np.zeros(max(n - 1, 0), dtype=bool)
+    for valores in columnas:
+        cambios |= valores[1:] != valores[:-1]
+    return np.concatenate([[0], np.flatnonzero(cambios) + 1, [n]])
+
+def esta_ordenado(censo):
+    """Indica si las filas del censo ya están ordenadas por `ORDEN_CENSO`."""
+    region = censo['region_id'].to_numpy()
+    comuna = censo['comuna_id'].to_numpy()
+    if len(region) < 2:
+        return True
+    sube = region[1:] > region[:-1]
+    igual = region[1:] == region[:-1]
+    return bool(np.all(sube | (igual & (comuna[1:] >= comuna[:-1]))))
+
+def ordenar_censo(censo):
+    """
+    Ordena las filas del censo por región y comuna (orden estable).
+
+    Dentro de cada comuna se conserva el orden original de las filas. Si el
+    censo ya está ordenado se devuelve tal cual, sin copiar.
+    """
+    if esta_ordenado(censo):
+        return censo
+    orden = np.lexsort((censo['comuna_id'].to_numpy(), censo['region_id'].to_numpy()))
+    return censo.iloc[orden].reset_index(drop=True)
+
+def construir_indice_tramos(censo):
+    """
+    Posiciones de inicio de cada región y de cada comuna en un censo ordenado.
+
+    Ocupa un par de arreglos del tamaño del número de regiones y de comunas,
+    y se construye con una sola pasada sobre las dos columnas.
+
+    Args:
+        censo: DataFrame del censo ordenado por `ORDEN_CENSO` (ver `ordenar_censo`)
+
+    Returns:
+        IndiceTramos
+    """
+    if not esta_ordenado(censo):
+        raise ValueError("El censo no está ordenado por región y comuna (ver `ordenar_censo`)")
+    region = censo['region_id'].to_numpy()
+    comuna = censo['comuna_id'].to_numpy()
+    inicio_region = _bordes(region)
+    inicio_comuna = _bordes(region, comuna)
+    comunas = comuna[inicio_comuna[:-1]]
+    return IndiceTramos(region[inicio_region[:-1]], inicio_region,
+                        comunas, inicio_comuna, np.argsort(comunas, kind='stable'))
+
+def _tramo(claves, inicio, clave, orden=None):
+    """
+    Rango [a, b) de filas de `clave` (vacío si no está en el índice).
+
+    Busca en O(log n) con `np.searchsorted`; `orden` es la permutación que
+    ordena `claves` si no vienen ya ordenadas.
+    """
+    k = int(np.searchsorted(claves, clave, sorter=orden))
+    if k == len(claves):
+        return 0, 0
+    i = k if orden is None else orden[k]
+    if claves[i] != clave:
+        return 0, 0
+    return int(inicio[i]), int(inicio[i + 1])
+
+def filas_region(censo, indice, region_id):
+    """Filas de una región: una rebanada contigua del censo (vista, sin copiar)."""
+    a, b = _tramo(indice.regiones, indice.inicio_region, region_id)
+    return censo.iloc[a:b]
+
+def filas_comuna(censo, indice, comuna_id):
+    """Filas de una comuna: una rebanada contigua del censo (vista, sin copiar)."""
+    a, b = _tramo(indice.comunas, indice.inicio_comuna, comuna_id, indice.orden_comunas)
+    return censo.iloc[a:b]
@@ -1,8 +1,31 @@
+import hashlib
+import io
+import json
+import multiprocessing
+import os
+import shutil
+import threading
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
 import geopandas as gpd
 import pandas as pd
 import streamlit as st
 import numpy as np
 
+from cubo import EDAD_MAX, CuboParcial, contar_celdas, resumen_comunal, sumar_conteos
+from descargas import DIR_DATOS, obtener_archivo, origen_descarga, url_archivo
+from esquema import COL_MAP, DTYPES_CENSO
+from filtros import construir_indice_bits, tramo_edad
+from instrumentacion import instrumentado
+from muestreo import construir_indice_muestreo, muestra_estratificada
+from tramos import ORDEN_CENSO, construir_indice_tramos, filas_comuna, filas_region, ordenar_censo
+
+# Los datos cacheados con `st.cache_resource` se comparten entre sesiones sin
+# copiarse; con copy-on-write ninguna página puede modificarlos en el lugar.
+# (En pandas >= 3 ya está siempre activo.)
+if int(pd.__version__.split('.')[0]) < 3:
+    pd.set_option("mode.copy_on_write", True)
+
 def _normaliza_cod(gdf, posibles, nuevo):
     """Renombra la primera columna encontrada en `posibles` a `nuevo`."""
     for col in posibles:
@@ -15,68 +38,558 @@ def _normaliza_cod(gdf, posibles, nuevo):
     )
     st.stop()
 
-@st.cache_data
+# Fuentes de datos publicadas en el release del repositorio (o en su espejo,
+# ver `descargas.py`); se bajan una vez al directorio local de datos
+URL_CENSO_CSV = url_archivo("censo")
+URL_REGIONES_ZIP = url_archivo("regiones")
+URL_COMUNAS_ZIP = url_archivo("comunas")
+
+# Rutas locales (ver estructura `data/` en el README)
+RUTA_CENSO_CSV = os.path.join(DIR_DATOS, "Microdato_Censo2017-Personas.csv")
+
+# Paquete de datos precompilado (ver `paquete.py`). Si la variable de entorno
+# CENSO_PAQUETE apunta a uno, la app lee todo desde ahí y no genera nada.
+DIR_PAQUETE = os.environ.get("CENSO_PAQUETE")
+DIR_CACHE = DIR_PAQUETE or os.path.join(DIR_DATOS, "cache")
+DIR_CENSO_COLUMNAR = os.path.join(DIR_CACHE, "censo_parquet")
+RUTA_CENSO_ARROW = os.path.join(DIR_CACHE, "censo.arrow")
+RUTA_CUBO = os.path.join(DIR_CACHE, "cubo.parquet")
+RUTA_ESTADISTICAS_COMUNALES = os.path.join(DIR_CACHE, "estadisticas_comunales.parquet")
+RUTA_MANIFIESTO = os.path.join(DIR_CACHE, "manifiesto.json")
+
+# Procesos para ingerir el CSV del censo en paralelo (por defecto, uno por núcleo)
+PROCESOS_INGESTA = int(os.environ.get("CENSO_PROCESOS", os.cpu_count() or 1))
+# Los procesos de la ingesta parten con 'spawn': la ingesta corre dentro del
+# servidor de Streamlit (hilo de calentamiento), y un `fork` de un proceso con
+# varios hilos puede dejar a un trabajador bloqueado en un candado heredado
+CONTEXTO_PROCESOS = multiprocessing.get_context("spawn")
+# Rangos del CSV por proceso: más rangos que procesos reparten mejor la carga
+# y entregan conteos parciales más seguido
+RANGOS_POR_PROCESO = 4
+
+# Regiones cuyo microdato se mantiene en memoria a la vez (LRU)
+REGIONES_EN_MEMORIA = 4
+
+# Proyección de áreas iguales (cilíndrica global) para calcular superficies;
+# Web Mercator (EPSG:3857) las infla mucho a las latitudes de Chile
+CRS_AREA_IGUAL = "EPSG:6933"
+
+# Categorías fijas de las columnas derivadas (se guardan como `category`).
+# Los grupos de edad son [a, b), como dicen sus etiquetas, en todas las vistas
+# (`grupo_edad`, mapas de bits y cubo); el último no tiene tope.
+SEXO_CATEGORIAS = pd.CategoricalDtype(["Hombre", "Mujer"])
+GRUPO_EDAD_BINS = [0, 18, 30, 45, 65, EDAD_MAX + 1]
+GRUPO_EDAD_LABELS = ['0-17', '18-29', '30-44', '45-64', '65+']
+
+def _fuente_censo():
+    """Devuelve la ruta local del CSV del censo si existe, si no la URL del release."""
+    if os.path.exists(RUTA_CENSO_CSV):
+        return RUTA_CENSO_CSV
+    return URL_CENSO_CSV
+
+def version_datos(fuente=None):
+    """
+    Token barato que identifica la versión de los datos del censo.
+
+    Para un CSV local combina ruta, tamaño y fecha de modificación (un `stat`,
+    sin leer el archivo); para la URL del release es la URL misma, también
+    después de bajarlo mientras no cambie: así la primera descarga no deja
+    dos versiones (y dos copias del censo) en los cachés. Con un paquete de
+    datos es la versión declarada en su manifiesto.
+    """
+    if DIR_PAQUETE and fuente is None:
+        return leer_manifiesto()['version']
+    fuente = fuente or _fuente_censo()
+    if os.path.exists(fuente):
+        origen = origen_descarga(fuente)
+        if origen is not None:
+            return origen
+        info = os.stat(fuente)
+        return f"{os.path.abspath(fuente)}:{info.st_size}:{info.st_mtime_ns}"
+    return fuente
+
+def leer_manifiesto(ruta=RUTA_MANIFIESTO):
+    """Manifiesto del paquete de datos (versión, origen y checksums de sus archivos)."""
+    with open(ruta, encoding="utf-8") as f:
+        return json.load(f)
+
+# Filas que se muestrean para la huella de contenido de `marcar_version`
+FILAS_HUELLA = 1024
+
+def _huella(df):
+    """Hash de forma y de `FILAS_HUELLA` filas repartidas en el frame (barato aun con el censo completo)."""
+    posiciones = np.unique(np.linspace(0, max(len(df) - 1, 0), min(len(df), FILAS_HUELLA)).astype(np.int64))
+    filas = pd.util.hash_pandas_object(df.iloc[posiciones], index=False).to_numpy()
+    forma = repr((len(df), tuple(df.columns))).encode()
+    return hashlib.sha1(forma + filas.tobytes()).hexdigest()
+
+def marcar_version(df, version):
+    """Anota en `df.attrs` la versión de datos y la huella del frame, para `_hash_dataframe`."""
+    df.attrs['version'] = version
+    df.attrs['huella'] = _huella(df)
+    return df
+
+def _version_marcada(df):
+    """
+    Versión de `marcar_version` si el frame no cambió desde entonces, si no None.
+
+    pandas copia `attrs` a los frames derivados (`assign`, filtros, `copy`...),
+    así que no basta con que el frame traiga la versión: su huella (forma y
+    una muestra de filas) tiene que seguir siendo la anotada.
+    """
+    version = df.attrs.get('version')
+    if version is not None and df.attrs.get('huella') == _huella(df):
+        return version
+    return None
+
+def _hash_dataframe(df):
+    """
+    Función de hash para `st.cache_data` que evita recorrer frames grandes.
+
+    Si el frame lleva la versión de datos (`marcar_version`) y no cambió desde
+    entonces, la clave es ese token más la huella. En otro caso se hashea el
+    contenido como siempre.
+    """
+    version = _version_marcada(df)
+    if version is not None:
+        return f"{version}:{df.attrs['huella']}"
+    return pd.util.hash_pandas_object(df, index=True).to_numpy().tobytes()
+
+# Opciones de caché para funciones que reciben el censo completo
+HASH_CENSO = {pd.DataFrame: _hash_dataframe}
+
+def _agregar_columnas_derivadas(censo):
+    """Agrega `sexo_cat` y `grupo_edad` (ambas categóricas) a un bloque del censo ya renombrado."""
+    censo["sexo_cat"] = (censo["sexo"].astype(pd.CategoricalDtype([1, 2]))
+                         .cat.rename_categories(SEXO_CATEGORIAS.categories))
+    censo['grupo_edad'] = pd.Categorical.from_codes(tramo_edad(censo['edad'].to_numpy(), GRUPO_EDAD_BINS),
+                                                    dtype=pd.CategoricalDtype(GRUPO_EDAD_LABELS, ordered=True))
+    return censo
+
+def _entero_minimo(serie):
+    """Convierte una serie numérica al entero nullable más angosto que contiene sus valores."""
+    serie = pd.to_numeric(serie, errors='coerce')
+    minimo, maximo = serie.min(), serie.max()
+    if pd.isna(minimo):
+        return serie.astype('UInt8')
+    for tipo in (['UInt8', 'UInt16', 'UInt32'] if minimo >= 0 else ['Int8', 'Int16', 'Int32']):
+        info = np.iinfo(tipo.lower())
+        if info.min <= minimo and maximo <= info.max:
+            return serie.astype(tipo)
+    return serie.astype('Int64')
+
+def compactar_censo(censo):
+    """
+    Reduce la huella en memoria del censo.
+
+    `trabajo` (P16) y `escolaridad` pasan al entero nullable más angosto (los
+    vacíos quedan como `<NA>`) y `sexo_cat`/`grupo_edad` se aseguran categóricas.
+    """
+    for col in ['trabajo', 'escolaridad']:
+        if col in censo.columns:
+            censo[col] = _entero_minimo(censo[col])
+    if 'sexo_cat' in censo.columns and not isinstance(censo['sexo_cat'].dtype, pd.CategoricalDtype):
+        censo['sexo_cat'] = censo['sexo_cat'].astype(SEXO_CATEGORIAS)
+    if 'grupo_edad' in censo.columns and not isinstance(censo['grupo_edad'].dtype, pd.CategoricalDtype):
+        censo['grupo_edad'] = censo['grupo_edad'].astype(
+            pd.CategoricalDtype(GRUPO_EDAD_LABELS, ordered=True))
+    return censo
+
+def memoria_mb(df):
+    """Memoria ocupada por un DataFrame en MB (incluye objetos Python)."""
+    return df.memory_usage(deep=True).sum() / 1024 ** 2
+
+def _leer_censo_csv(fuente, chunksize=500000):
+    """Itera el CSV del censo en bloques, ya proyectado y renombrado según `COL_MAP`."""
+    censo_iterator = pd.read_csv(fuente, sep=";", encoding="latin1",
+                                 usecols=COL_MAP.keys(),
+                                 dtype=DTYPES_CENSO,
+                                 chunksize=chunksize)
+    for chunk in censo_iterator:
+        yield chunk.rename(columns=COL_MAP)[list(COL_MAP.values())]
+
+def cache_columnar_vigente(fuente=None, destino=DIR_CENSO_COLUMNAR):
+    """
+    Indica si la copia columnar del censo existe y es más nueva que la fuente.
+
+    Cuando la fuente es una URL no hay fecha de modificación local con qué
+    comparar, así que basta con que la copia exista.
+    """
+    fuente = fuente or _fuente_censo()
+    if not os.path.isdir(destino):
+        return False
+    if os.path.exists(fuente):
+        return os.path.getmtime(destino) >= os.path.getmtime(fuente)
+    return True
+
+def _esquema_columnar():
+    """Esquema fijo de la copia columnar, igual para todos los bloques y procesos."""
+    import pyarrow as pa
+
+    return pa.schema([("region_id", pa.int8()), ("comuna_id", pa.int32()), ("sexo", pa.uint8()),
+                      ("edad", pa.uint8()), ("trabajo", pa.int64()), ("escolaridad", pa.int64())])
+
+def _escribir_bloques(bloques, destino, prefijo, al_escribir=None):
+    """
+    Escribe bloques ya renombrados del censo en el dataset particionado por `region_id`.
+
+    Si se da `al_escribir`, se llama con cada bloque después de escribirlo.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    esquema = _esquema_columnar()
+    filas = 0
+    for i, chunk in enumerate(bloques):
+        tabla = pa.Table.from_pandas(chunk, schema=esquema, preserve_index=False)
+        pq.write_to_dataset(tabla, destino, partition_cols=["region_id"],
+                            basename_template=f"{prefijo}-{i:04d}-{{i}}.parquet")
+        filas += len(chunk)
+        if al_escribir is not None:
+            al_escribir(chunk)
+    return filas
+
+class _TramoCSV(io.RawIOBase):
+    """Archivo de solo lectura: el encabezado del CSV seguido de los bytes [inicio, fin) del original."""
+
+    def __init__(self, ruta, encabezado, inicio, fin):
+        self._archivo = open(ruta, "rb")
+        self._archivo.seek(inicio)
+        self._encabezado = encabezado
+        self._pendiente = fin - inicio
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        if self._encabezado:
+            n = min(len(buffer), len(self._encabezado))
+            buffer[:n] = self._encabezado[:n]
+            self._encabezado = self._encabezado[n:]
+            return n
+        n = min(len(buffer), self._pendiente)
+        if n <= 0:
+            return 0
+        leidos = self._archivo.readinto(memoryview(buffer)[:n])
+        self._pendiente -= leidos
+        return leidos
+
+    def close(self):
+        self._archivo.close()
+        super().close()
+
+def rangos_csv(ruta, partes):
+    """
+    Divide un CSV en hasta `partes` rangos de bytes alineados a bordes de línea.
+
+    Returns:
+        Tupla (encabezado en bytes, lista de (inicio, fin)) que cubre todas las
+        filas de datos exactamente una vez
+    """
+    tamano = os.path.getsize(ruta)
+    with open(ruta, "rb") as f:
+        encabezado = f.readline()
+        cortes = [f.tell()]
+        for i in range(1, partes):
+            posicion = cortes[0] + (tamano - cortes[0]) * i // partes
+            if posicion <= cortes[-1]:
+                continue
+            # Avanzar hasta el inicio de la línea siguiente
+            f.seek(posicion - 1)
+            f.readline()
+            cortes.append(min(f.tell(), tamano))
+        cortes.append(tamano)
+    return encabezado, [(a, b) for a, b in zip(cortes, cortes[1:]) if b > a]
+
+def _ingestar_rango(ruta, encabezado, inicio, fin, destino, indice, chunksize, contar=False):
+    """
+    Trabajo de un proceso: lee su rango del CSV por bloques y escribe sus fragmentos Parquet.
+
+    Returns:
+        Conteos del cubo del rango si `contar` (ver `cubo.contar_celdas`), si no None
+    """
+    conteos = []
+    al_escribir = (lambda chunk: conteos.append(contar_celdas(chunk))) if contar else None
+    with io.BufferedReader(_TramoCSV(ruta, encabezado, inicio, fin), buffer_size=1024 ** 2) as tramo:
+        _escribir_bloques(_leer_censo_csv(tramo, chunksize), destino, f"parte-{indice:04d}", al_escribir)
+    return sumar_conteos(conteos) if conteos else None
+
+def ingestar_censo_columnar(fuente=None, destino=DIR_CENSO_COLUMNAR, chunksize=500000,
+                            procesos=PROCESOS_INGESTA, parcial=None):
+    """
+    Convierte el CSV del censo a un dataset Parquet particionado por `region_id`.
+
+    Solo se guardan las columnas de `COL_MAP`; las derivadas se recalculan al
+    leer. Se escribe en un directorio temporal y se renombra al final para que
+    una ingesta interrumpida nunca quede como caché válida.
+
+    Con un CSV local y `procesos` > 1, el archivo se parte en rangos de bytes
+    alineados a líneas (`rangos_csv`) y cada proceso parsea y escribe los
+    suyos directo en el dataset: no hay concatenación, el dataset es la
+    unión de los fragmentos. Los nombres de archivo conservan el orden de
+    las filas del CSV dentro de cada región.
+
+    Si se da `parcial`, se le van sumando los conteos del cubo de cada bloque
+    (o de cada rango, en paralelo) a medida que se leen, con el avance según
+    los bytes leídos del CSV.
+
+    Args:
+        fuente: Ruta o URL del CSV (por defecto `_fuente_censo()`)
+        destino: Directorio del dataset particionado
+        chunksize: Filas por bloque leído del CSV (en cada proceso)
+        procesos: Procesos en paralelo (1 = lectura secuencial)
+        parcial: `cubo.CuboParcial` a alimentar durante la lectura (opcional)
+
+    Returns:
+        Ruta del dataset escrito
+    """
+    fuente = fuente or _fuente_censo()
+    temporal = destino + ".tmp"
+    shutil.rmtree(temporal, ignore_errors=True)
+    os.makedirs(temporal)
+    if procesos > 1 and os.path.exists(fuente):
+        encabezado, rangos = rangos_csv(fuente, procesos * RANGOS_POR_PROCESO)
+        tamano, leidos = os.path.getsize(fuente), len(encabezado)
+        with ProcessPoolExecutor(max_workers=min(procesos, len(rangos)), mp_context=CONTEXTO_PROCESOS) as pool:
+            trabajos = {pool.submit(_ingestar_rango, fuente, encabezado, inicio, fin, temporal, i, chunksize,
+                                    parcial is not None): fin - inicio
+                        for i, (inicio, fin) in enumerate(rangos)}
+            for trabajo in as_completed(trabajos):
+                conteos = trabajo.result()
+                leidos += trabajos[trabajo]
+                if parcial is not None and conteos is not None:
+                    parcial.agregar(conteos, leidos / tamano)
+    elif os.path.exists(fuente):
+        tamano = os.path.getsize(fuente)
+        with open(fuente, "rb") as f:
+            al_escribir = None
+            if parcial is not None:
+                al_escribir = lambda chunk: parcial.agregar(contar_celdas(chunk), min(f.tell() / tamano, 1.0))
+            _escribir_bloques(_leer_censo_csv(f, chunksize), temporal, "parte-0000", al_escribir)
+    else:
+        al_escribir = (lambda chunk: parcial.agregar(contar_celdas(chunk))) if parcial is not None else None
+        _escribir_bloques(_leer_censo_csv(fuente, chunksize), temporal, "parte-0000", al_escribir)
+    shutil.rmtree(destino, ignore_errors=True)
+    os.replace(temporal, destino)
+    return destino
+
+def leer_censo_columnar(destino=DIR_CENSO_COLUMNAR, regiones=None, compactar=True):
+    """
+    Lee el dataset Parquet del censo con los mismos tipos que la carga desde CSV.
+
+    Args:
+        destino: Directorio del dataset particionado
+        regiones: Lista opcional de `region_id` a leer (solo esas particiones)
+        compactar: Si se aplica `compactar_censo` al resultado
+
+    Returns:
+        DataFrame del censo con columnas derivadas
+    """
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+
+    particiones = ds.partitioning(pa.schema([("region_id", pa.int8())]), flavor="hive")
+    dataset = ds.dataset(destino, format="parquet", partitioning=particiones)
+    filtro = ds.field("region_id").isin(list(regiones)) if regiones is not None else None
+    censo = dataset.to_table(filter=filtro).to_pandas()
+    # Las particiones no se leen en orden numérico de región
+    censo = _agregar_columnas_derivadas(ordenar_censo(censo[list(COL_MAP.values())]))
+    return compactar_censo(censo) if compactar else censo
+
+# Marca en los metadatos del archivo Arrow: filas ordenadas por `ORDEN_CENSO`
+METADATO_ORDEN = b"censo_orden"
+
+def _censo_compartido_ordenado(ruta):
+    """Indica si el archivo Arrow compartido se escribió con las filas ordenadas por región y comuna."""
+    import pyarrow as pa
+
+    metadatos = pa.ipc.open_file(pa.memory_map(ruta, "r")).schema.metadata or {}
+    return metadatos.get(METADATO_ORDEN) == ",".join(ORDEN_CENSO).encode()
+
+def censo_compartido_vigente(ruta=RUTA_CENSO_ARROW, origen=DIR_CENSO_COLUMNAR):
+    """Indica si el archivo Arrow compartido existe, ya viene ordenado y es más nuevo que la copia columnar."""
+    if not os.path.exists(ruta) or not _censo_compartido_ordenado(ruta):
+        return False
+    return not os.path.exists(origen) or os.path.getmtime(ruta) >= os.path.getmtime(origen)
+
+def exportar_censo_compartido(censo, ruta=RUTA_CENSO_ARROW):
+    """
+    Escribe las columnas base del censo como archivo Arrow IPC sin compresión.
+
+    Ese formato se puede mapear en memoria: todos los procesos del servidor
+    que lo abren comparten las mismas páginas físicas a través del caché del
+    sistema operativo. Las filas se escriben ordenadas por región y comuna,
+    de modo que cada una es un bloque contiguo (ver `tramos.py`).
+    """
+    import pyarrow as pa
+    import pyarrow.feather as feather
+
+    os.makedirs(os.path.dirname(ruta), exist_ok=True)
+    temporal = ruta + ".tmp"
+    tabla = pa.Table.from_pandas(ordenar_censo(censo[list(COL_MAP.values())]), preserve_index=False)
+    tabla = tabla.replace_schema_metadata({**(tabla.schema.metadata or {}),
+                                           METADATO_ORDEN: ",".join(ORDEN_CENSO).encode()})
+    feather.write_feather(tabla, temporal, compression="uncompressed")
+    os.replace(temporal, ruta)
+    return ruta
+
+def abrir_censo_compartido(ruta=RUTA_CENSO_ARROW):
+    """
+    Abre el censo desde el archivo Arrow mapeado en memoria.
+
+    Las columnas numéricas sin nulos apuntan directo al mapa (cero copia, solo
+    lectura); solo las columnas nullable y las derivadas ocupan memoria propia
+    del proceso.
+    """
+    import pyarrow as pa
+
+    tabla = pa.ipc.open_file(pa.memory_map(ruta, "r")).read_all()
+    censo = tabla.to_pandas(split_blocks=True)
+    if not _censo_compartido_ordenado(ruta):
+        # Archivo de una versión anterior (p. ej. de un paquete): se ordena en memoria
+        censo = ordenar_censo(censo)
+    return compactar_censo(_agregar_columnas_derivadas(censo))
+
+def area_km2(gdf):
+    """Superficie de cada geometría en km², medida en `CRS_AREA_IGUAL`."""
+    return gdf.geometry.to_crs(CRS_AREA_IGUAL).area / 1e6
+
+def agregar_densidad(datos, geometrias, id_campo):
+    """
+    Agrega `area_km2` y `densidad_poblacional` (hab/km²) a datos agregados.
+
+    Args:
+        datos: DataFrame con `id_campo` y `poblacion_total`
+        geometrias: GeoDataFrame con `id_campo` y `area_km2` (ver `cargar_geometrias`)
+        id_campo: 'region_id' o 'comuna_id'
+    """
+    areas = geometrias.drop_duplicates(id_campo).set_index(id_campo)['area_km2']
+    datos = datos.assign(area_km2=datos[id_campo].map(areas))
+    datos['densidad_poblacional'] = (datos['poblacion_total'] / datos['area_km2']).fillna(0)
+    return datos
+
+def _ruta_shapefile(nombre, carpeta, shp):
+    """
+    Shapefile ya extraído en `data/<carpeta>/` (estructura del README) o, si
+    no está, dentro del ZIP local, que se baja del release si falta.
+    """
+    extraido = os.path.join(DIR_DATOS, carpeta, shp)
+    if os.path.exists(extraido):
+        return extraido
+    return f"zip://{obtener_archivo(nombre)}!{carpeta}/{shp}"
+
+def cargar_geometrias():
+    """Carga y normaliza las geometrías de regiones y comunas desde el release (o del paquete)."""
+    if DIR_PAQUETE:
+        return (gpd.read_parquet(os.path.join(DIR_CACHE, "geometrias", "regiones.parquet")),
+                gpd.read_parquet(os.path.join(DIR_CACHE, "geometrias", "comunas.parquet")))
+
+    # --- 1. Geometrías (copia local de los ZIP del release, con subcarpetas) ---
+    st.info("Cargando geometrías de regiones...")
+    regiones = gpd.read_file(_ruta_shapefile("regiones", "Regiones", "Regional.shp")).to_crs(4326)
+
+    st.info("Cargando geometrías de comunas...")
+    comunas = gpd.read_file(_ruta_shapefile("comunas", "Comunas", "comunas.shp")).to_crs(4326)
+
+    # Normalizar nombres de columnas
+    regiones = _normaliza_cod(regiones,
+                ["codregion","REGION","REGION_C","COD_REG","COD_REGION", "REGIONCOD"], "region_id")
+    comunas = _normaliza_cod(comunas,
+                ["cod_comuna","COMUNA","COD_COMUNA","COMUNA_COD", "Cod_Comun","ID_COMUNA"], "comuna_id")
+
+    if 'codregion' in comunas.columns:
+        comunas = comunas.rename(columns={'codregion': 'region_id_com'})
+    if 'Region' in regiones.columns:
+        regiones['region_nombre'] = regiones['Region'].str.strip()
+    if 'Comuna' in comunas.columns:
+        comunas['comuna_nombre'] = comunas['Comuna'].str.strip()
+    if 'Provincia' in comunas.columns:
+        comunas['provincia_nombre'] = comunas['Provincia'].str.strip()
+
+    # Convertir tipos de datos
+    try:
+        regiones['region_id'] = pd.to_numeric(regiones['region_id'], errors='coerce').astype('int8')
+        comunas['comuna_id'] = pd.to_numeric(comunas['comuna_id'], errors='coerce').astype('int32')
+        if 'region_id_com' in comunas.columns:
+            comunas['region_id_com'] = pd.to_numeric(comunas['region_id_com'], errors='coerce').astype('int8')
+    except Exception as e:
+        st.error(f"Error al convertir tipos de datos: {e}")
+        st.stop()
+
+    # Superficies en km², calculadas una vez en proyección de áreas iguales
+    regiones['area_km2'] = area_km2(regiones)
+    comunas['area_km2'] = area_km2(comunas)
+
+    return regiones, comunas
+
+@instrumentado(cache=st.cache_resource)
+def obtener_geometrias():
+    """Geometrías de regiones y comunas, cargadas una vez e independientes del censo."""
+    return cargar_geometrias()
+
+# Una sola ingesta a la vez: el calentamiento y las páginas pueden pedirla juntos
+_CANDADO_INGESTA = threading.Lock()
+
+# Cubo en construcción, visible para las páginas mientras se lee el censo
+CUBO_PARCIAL = CuboParcial()
+
+def _asegurar_censo_columnar(parcial=None):
+    """
+    Genera la copia columnar del censo si no existe o quedó vieja (nunca con un paquete).
+
+    Args:
+        parcial: `cubo.CuboParcial` a alimentar si hay que leer el CSV (opcional)
+
+    Returns:
+        True si se generó la copia en esta llamada (y se alimentó `parcial`)
+    """
+    if DIR_PAQUETE:
+        return False
+    with _CANDADO_INGESTA:
+        if cache_columnar_vigente(_fuente_censo()):
+            return False
+        st.info("Generando copia columnar del censo (solo la primera vez, puede tardar)...")
+        ingestar_censo_columnar(obtener_archivo("censo"), parcial=parcial)
+        return True
+
+def _cargar_censo():
+    """
+    Carga el censo desde el archivo Arrow compartido.
+
+    Si hace falta, primero genera la copia columnar desde el CSV y luego el
+    archivo Arrow desde esa copia (ya con tipos compactos).
+    """
+    _asegurar_censo_columnar()
+    if not DIR_PAQUETE and not censo_compartido_vigente():
+        st.info("Preparando copia compartida del censo...")
+        censo = leer_censo_columnar(compactar=False)
+        memoria_antes = memoria_mb(censo)
+        censo = compactar_censo(censo)
+        st.info(f"Memoria del censo: {memoria_antes:,.0f} MB → {memoria_mb(censo):,.0f} MB")
+        exportar_censo_compartido(censo)
+        del censo
+    st.info("Abriendo el censo compartido (memoria mapeada)...")
+    return abrir_censo_compartido()
+
 def cargar_datos():
-    """Carga y procesa todos los datos necesarios para la aplicación desde URLs."""
+    """
+    Carga y procesa todos los datos necesarios para la aplicación desde URLs.
+
+    La caché queda indexada por `version_datos()`, así que un CSV local nuevo
+    invalida la carga (y todo lo que depende del censo) sin reiniciar la app.
+    Los objetos devueltos se comparten entre todas las sesiones (no se copian)
+    y deben tratarse como solo lectura.
+    """
+    return _cargar_datos_version(version_datos())
+
+@instrumentado(cache=st.cache_resource, nombre="cargar_datos", max_entries=1)
+def _cargar_datos_version(version):
+    """Carga efectiva de `cargar_datos` para una versión de los datos."""
     try:
-        URL_CENSO_CSV = "https://github.com/lsoto10/tarea_3/releases/download/data/Microdato_Censo2017-Personas.csv"
-        URL_REGIONES_ZIP = "https://github.com/lsoto10/tarea_3/releases/download/data/Regiones.zip"
-        URL_COMUNAS_ZIP = "https://github.com/lsoto10/tarea_3/releases/download/data/Comunas.zip"
+        regiones, comunas = obtener_geometrias()
 
-        # --- 1. Geometrías (Cargando desde URL de un ZIP con subcarpetas) ---
-        st.info("Cargando geometrías de regiones...")
-        regiones = gpd.read_file(f"zip+{URL_REGIONES_ZIP}!Regiones/Regional.shp").to_crs(4326)
-        
-        st.info("Cargando geometrías de comunas...")
-        # LÍNEA CORREGIDA:
-        comunas = gpd.read_file(f"zip+{URL_COMUNAS_ZIP}!Comunas/comunas.shp").to_crs(4326)
-
-        # Normalizar nombres de columnas
-        regiones = _normaliza_cod(regiones,
-                    ["codregion","REGION","REGION_C","COD_REG","COD_REGION", "REGIONCOD"], "region_id")
-        comunas = _normaliza_cod(comunas,
-                    ["cod_comuna","COMUNA","COD_COMUNA","COMUNA_COD", "Cod_Comun","ID_COMUNA"], "comuna_id")
-        
-        if 'codregion' in comunas.columns:
-            comunas = comunas.rename(columns={'codregion': 'region_id_com'})
-        if 'Region' in regiones.columns:
-            regiones['region_nombre'] = regiones['Region'].str.strip()
-        if 'Comuna' in comunas.columns:
-            comunas['comuna_nombre'] = comunas['Comuna'].str.strip()
-        if 'Provincia' in comunas.columns:
-            comunas['provincia_nombre'] = comunas['Provincia'].str.strip()
-
-        # --- 2. Censo (OPTIMIZADO desde URL) ---
-        st.info("Cargando datos del censo (esto puede tardar un momento)...")
-        col_map = {"REGION": "region_id", "COMUNA": "comuna_id", "P08": "sexo", 
-                   "P09": "edad", "P16": "trabajo", "ESCOLARIDAD": "escolaridad"}
-        
-        censo_iterator = pd.read_csv(URL_CENSO_CSV, sep=";", encoding="latin1",
-                                     usecols=col_map.keys(),
-                                     dtype={"REGION": "int8", "COMUNA": "int32", "P08": "uint8", "P09": "uint8"},
-                                     chunksize=500000)
-        
-        censo_chunks = []
-        for chunk in censo_iterator:
-            chunk = chunk.rename(columns=col_map)
-            chunk["sexo_cat"] = chunk["sexo"].map({1: "Hombre", 2: "Mujer"})
-            chunk['grupo_edad'] = pd.cut(chunk['edad'], 
-                                        bins=[0, 18, 30, 45, 65, 100],
-                                        labels=['0-17', '18-29', '30-44', '45-64', '65+'])
-            censo_chunks.append(chunk)
-        
-        censo = pd.concat(censo_chunks, ignore_index=True)
-        del censo_chunks
-
-        # Convertir tipos de datos
-        try:
-            regiones['region_id'] = pd.to_numeric(regiones['region_id'], errors='coerce').astype('int8')
-            comunas['comuna_id'] = pd.to_numeric(comunas['comuna_id'], errors='coerce').astype('int32')
-            if 'region_id_com' in comunas.columns:
-                comunas['region_id_com'] = pd.to_numeric(comunas['region_id_com'], errors='coerce').astype('int8')
-        except Exception as e:
-            st.error(f"Error al convertir tipos de datos: {e}")
-            st.stop()
+        # --- 2. Censo (copia columnar local, ingerida una vez desde el CSV) ---
+        censo = marcar_version(_cargar_censo(), version)
 
         st.success("¡Datos cargados y procesados con éxito!")
         return regiones, comunas, censo
@@ -85,54 +598,189 @@ def cargar_datos():
         st.error(f"Ocurrió un error crítico durante la carga de datos: {e}")
         st.stop()
 
-@st.cache_data
-def procesar_datos_comuna(censo, region_id=None):
-    if region_id:
-        censo_filtrado = censo[censo['region_id'] == region_id]
+def cubo_vigente(ruta=RUTA_CUBO, origen=DIR_CENSO_COLUMNAR):
+    """Indica si el cubo guardado existe y es más nuevo que la copia columnar vigente del censo."""
+    if not os.path.exists(ruta):
+        return False
+    if not cache_columnar_vigente(destino=origen):
+        return False
+    return os.path.getmtime(ruta) >= os.path.getmtime(origen)
+
+def cubo_disponible():
+    """Indica si el cubo completo ya está en disco, de modo que `cargar_cubo` no tiene que leer el censo."""
+    return bool(DIR_PAQUETE) or cubo_vigente()
+
+def cargar_cubo():
+    """
+    Cubo de conteos región × comuna × sexo × edad construido una vez desde el censo completo.
+
+    Es la fuente de todas las agregaciones de las páginas (ver `cubo.py`), de
+    modo que ninguna interacción vuelve a recorrer los microdatos. Se guarda
+    en disco: mientras esté vigente, las páginas lo leen sin cargar el censo,
+    y el tiempo hasta el primer render no depende del tamaño del censo.
+
+    Mientras se construye, lo leído hasta el momento queda en `CUBO_PARCIAL`.
+    """
+    return _cargar_cubo_version(version_datos())
+
+def _acumular_cubo_columnar(parcial, destino=DIR_CENSO_COLUMNAR):
+    """Alimenta `parcial` desde la copia columnar ya generada, una región a la vez."""
+    regiones = sorted(int(nombre.split("=", 1)[1]) for nombre in os.listdir(destino)
+                      if nombre.startswith("region_id="))
+    for i, region_id in enumerate(regiones, 1):
+        censo = leer_censo_columnar(destino, regiones=[region_id], compactar=False)
+        parcial.agregar(contar_celdas(censo, parcial.edad_max), i / len(regiones))
+
+@instrumentado(cache=st.cache_resource, nombre="cargar_cubo", max_entries=1)
+def _cargar_cubo_version(version):
+    """
+    Lee el cubo guardado o, si no está vigente, lo construye y lo guarda.
+
+    Los conteos se acumulan en `CUBO_PARCIAL` durante la misma lectura del CSV
+    que genera la copia columnar; si esa copia ya existía, se recorren sus
+    particiones. En ningún caso hace falta cargar el censo completo.
+    """
+    if DIR_PAQUETE or cubo_vigente():
+        cubo = pd.read_parquet(RUTA_CUBO)
     else:
-        censo_filtrado = censo
-    datos_comuna = censo_filtrado.groupby('comuna_id').agg({
-        'sexo': 'count',
-        'edad': ['mean', 'median'],
-        'sexo_cat': lambda x: (x == 'Mujer').sum() / len(x) * 100,
-    }).round(2)
-    datos_comuna.columns = ['poblacion_total', 'edad_promedio', 'edad_mediana', 'pct_mujeres']
-    return datos_comuna.reset_index()
-
-@st.cache_data
+        CUBO_PARCIAL.reiniciar()
+        if not _asegurar_censo_columnar(CUBO_PARCIAL):
+            _acumular_cubo_columnar(CUBO_PARCIAL)
+        cubo = CUBO_PARCIAL.cubo()
+        os.makedirs(os.path.dirname(RUTA_CUBO), exist_ok=True)
+        cubo.to_parquet(RUTA_CUBO + ".tmp", index=False)
+        os.replace(RUTA_CUBO + ".tmp", RUTA_CUBO)
+    return marcar_version(cubo, version)
+
+def cargar_censo_region(region_id):
+    """
+    Microdatos de una sola región, leídos bajo demanda desde su partición.
+
+    Se mantienen en memoria las `REGIONES_EN_MEMORIA` regiones usadas más
+    recientemente; al pedir otra se descarta la menos reciente (LRU).
+    """
+    return _cargar_censo_region_version(int(region_id), version_datos())
+
+@instrumentado(cache=st.cache_resource, nombre="cargar_censo_region", max_entries=REGIONES_EN_MEMORIA)
+def _cargar_censo_region_version(region_id, version):
+    """Lectura de la partición de `region_id` para una versión de los datos."""
+    _asegurar_censo_columnar()
+    # La región va en el token: los cachés que reciben el frame no deben
+    # confundir dos regiones de la misma versión
+    return marcar_version(leer_censo_columnar(regiones=[region_id]), f"{version}:region={region_id}")
+
+def cargar_estadisticas_comunales():
+    """Estadísticas exactas de todas las comunas, calculadas una vez desde el cubo completo."""
+    if DIR_PAQUETE:
+        return _estadisticas_comunales_paquete(version_datos())
+    return _estadisticas_comunales(cargar_cubo())
+
+@instrumentado(cache=st.cache_resource, nombre="estadisticas_comunales_paquete", max_entries=1)
+def _estadisticas_comunales_paquete(version):
+    """Estadísticas comunales ya calculadas en el paquete de datos."""
+    return pd.read_parquet(RUTA_ESTADISTICAS_COMUNALES)
+
+@instrumentado(cache=st.cache_resource, nombre="estadisticas_comunales", hash_funcs=HASH_CENSO, max_entries=1)
+def _estadisticas_comunales(cubo):
+    """Estadísticas comunales del cubo, cacheadas por su versión de datos."""
+    return resumen_comunal(cubo)
+
+def estadisticas_comunales_region(estadisticas, region_id=None):
+    """
+    Filtra las estadísticas comunales precalculadas de una región.
+
+    Devuelve las mismas columnas que `procesar_datos_comuna`, pero exactas
+    (sin muestra) y en tiempo proporcional al número de comunas.
+    """
+    if region_id:
+        estadisticas = estadisticas[estadisticas['region_id'] == region_id]
+    return estadisticas.drop(columns='region_id').reset_index(drop=True)
+
+def _resumen_poblacion(censo, clave, estadisticas_edad):
+    """
+    Agrega población, estadísticas de edad y % de mujeres por `clave`.
+
+    Todas las reducciones son nativas de groupby; el % de mujeres es la media
+    de un indicador booleano (`sexo == 2`) en vez de comparar strings por grupo.
+    """
+    nombres_edad = {'mean': 'edad_promedio', 'median': 'edad_mediana', 'std': 'edad_std'}
+    grupos = censo.groupby(clave)
+    resumen = grupos['edad'].agg(estadisticas_edad)
+    resumen = (resumen.to_frame() if isinstance(resumen, pd.Series) else resumen)
+    resumen.columns = [nombres_edad[e] for e in estadisticas_edad]
+    resumen.insert(0, 'poblacion_total', grupos['sexo'].count())
+    resumen['pct_mujeres'] = censo['sexo'].eq(2).groupby(censo[clave]).mean() * 100
+    return resumen.round(2).reset_index()
+
+@instrumentado(cache=st.cache_resource, hash_funcs=HASH_CENSO, max_entries=1)
+def indice_tramos(censo):
+    """
+    Índice de tramos por región y comuna del censo (ver `tramos.py`), construido una vez por versión.
+
+    Returns:
+        IndiceTramos, o None si el censo no está ordenado por región y comuna
+    """
+    try:
+        return construir_indice_tramos(censo)
+    except ValueError:
+        return None
+
+@instrumentado(cache=st.cache_resource, hash_funcs=HASH_CENSO, max_entries=1)
+def indice_bits(censo):
+    """
+    Mapas de bits por sexo, tramo de edad, trabajo y escolaridad (ver `filtros.py`), construidos una vez por versión.
+
+    Returns:
+        IndiceBits, o None si el censo no está ordenado por región y comuna
+    """
+    try:
+        return construir_indice_bits(censo, GRUPO_EDAD_BINS, GRUPO_EDAD_LABELS)
+    except ValueError:
+        return None
+
+def censo_region(censo, region_id):
+    """
+    Filas del censo de una región.
+
+    Con el censo cargado (versionado y ordenado por región y comuna) es una
+    rebanada contigua a partir de `indice_tramos`: no copia filas y su costo no
+    depende del total nacional. Para cualquier otro frame se filtra con una
+    máscara.
+    """
+    if _version_marcada(censo) is not None:
+        indice = indice_tramos(censo)
+        if indice is not None:
+            return filas_region(censo, indice, region_id)
+    return censo[censo['region_id'] == region_id]
+
+def censo_comuna(censo, comuna_id):
+    """
+    Filas del censo de una comuna.
+
+    Igual que `censo_region`: con el censo cargado es una rebanada contigua a
+    partir de `indice_tramos`; para cualquier otro frame, una máscara.
+    """
+    if _version_marcada(censo) is not None:
+        indice = indice_tramos(censo)
+        if indice is not None:
+            return filas_comuna(censo, indice, comuna_id)
+    return censo[censo['comuna_id'] == comuna_id]
+
+@instrumentado(cache=st.cache_data, hash_funcs=HASH_CENSO)
 def procesar_datos_comuna(censo, region_id=None):
     """Procesa datos del censo a nivel comunal."""
     if region_id:
-        censo_filtrado = censo[censo['region_id'] == region_id]
+        censo_filtrado = censo_region(censo, region_id)
     else:
         censo_filtrado = censo
     
-    # Agregaciones por comuna
-    datos_comuna = censo_filtrado.groupby('comuna_id').agg({
-        'sexo': 'count',  # población total
-        'edad': ['mean', 'median'],  # edad promedio y mediana
-        'sexo_cat': lambda x: (x == 'Mujer').sum() / len(x) * 100,  # % mujeres
-    }).round(2)
-    
-    # Aplanar nombres de columnas
-    datos_comuna.columns = ['poblacion_total', 'edad_promedio', 'edad_mediana', 'pct_mujeres']
-    datos_comuna = datos_comuna.reset_index()
-    
-    return datos_comuna
+    # Agregaciones por comuna: población, edad promedio y mediana, % mujeres
+    return _resumen_poblacion(censo_filtrado, 'comuna_id', ['mean', 'median'])
 
-@st.cache_data
+@instrumentado(cache=st.cache_data, hash_funcs=HASH_CENSO)
 def procesar_datos_region(censo):
     """Procesa datos del censo a nivel regional."""
-    datos_region = censo.groupby('region_id').agg({
-        'sexo': 'count',  # población total
-        'edad': 'mean',   # edad promedio
-        'sexo_cat': lambda x: (x == 'Mujer').sum() / len(x) * 100,  # % mujeres
-    }).round(2)
-    
-    datos_region.columns = ['poblacion_total', 'edad_promedio', 'pct_mujeres']
-    datos_region = datos_region.reset_index()
-    
-    return datos_region
+    return _resumen_poblacion(censo, 'region_id', ['mean'])
 
 def obtener_regiones_disponibles(regiones):
     """Obtiene lista de regiones disponibles con sus nombres."""
@@ -143,53 +791,60 @@ def obtener_regiones_disponibles(regiones):
     else:
         return regiones[['region_id']].drop_duplicates().sort_values('region_id')
 
-@st.cache_data
+@instrumentado(cache=st.cache_data, hash_funcs=HASH_CENSO)
 def crear_datos_optimizados(censo):
     """Crea versiones pre-agregadas de los datos para visualizaciones más rápidas."""
     
     # 1. Datos regionales agregados
-    datos_region = censo.groupby('region_id').agg({
-        'sexo': 'count',  # población total
-        'edad': ['mean', 'median', 'std'],   # estadísticas de edad
-        'sexo_cat': lambda x: (x == 'Mujer').sum() / len(x) * 100,  # % mujeres
-    }).round(2)
-    
-    datos_region.columns = ['poblacion_total', 'edad_promedio', 'edad_mediana', 'edad_std', 'pct_mujeres']
-    datos_region = datos_region.reset_index()
+    datos_region = _resumen_poblacion(censo, 'region_id', ['mean', 'median', 'std'])
     
     # 2. Datos por grupos de edad y región
     edad_region = censo.groupby(['region_id', 'grupo_edad']).size().reset_index(name='poblacion')
     
     # 3. Datos por sexo y región
-    sexo_region = censo.groupby(['region_id', 'sexo_cat']).size().reset_index(name='poblacion')
+    sexo_region = censo.groupby(['region_id', 'sexo_cat'], observed=True).size().reset_index(name='poblacion')
     
-    # 4. Datos para pirámides poblacionales (muestreados)
-    sample_size = min(100000, len(censo))  # Máximo 100k registros para pirámides
-    censo_sample = censo.sample(n=sample_size, random_state=42)
+    # 4. Muestra estratificada por región (máximo ~100k registros, con pesos)
+    censo_sample = obtener_muestra_censo(censo, size=100000)
     
     return datos_region, edad_region, sexo_region, censo_sample
 
-@st.cache_data
-def obtener_muestra_censo(censo, size=50000):
-    """Obtiene una muestra representativa del censo para visualizaciones rápidas."""
+@instrumentado(cache=st.cache_resource, hash_funcs=HASH_CENSO)
+def indice_muestreo(censo, columna='region_id'):
+    """Índice de muestreo por estrato del censo (ver `muestreo.py`), construido una vez por versión."""
+    return construir_indice_muestreo(censo, columna)
+
+@instrumentado(cache=st.cache_data, hash_funcs=HASH_CENSO)
+def obtener_muestra_censo(censo, size=50000, estrato='region_id', minimo_por_estrato=1000):
+    """
+    Obtiene una muestra representativa del censo para visualizaciones rápidas.
+
+    La muestra es estratificada (proporcional, con `minimo_por_estrato` filas
+    por región o comuna) y trae la columna `peso` para estimaciones; se sirve
+    desde el índice pre-barajado sin volver a muestrear.
+    """
     if len(censo) <= size:
-        return censo
-    return censo.sample(n=size, random_state=42)
+        return censo.assign(peso=1.0)
+    return muestra_estratificada(censo, indice_muestreo(censo, estrato), size, minimo_por_estrato)
 
-@st.cache_data
-def optimizar_geometrias_para_web(_gdf, tolerance=0.01, max_points=1000):
+@instrumentado()
+def optimizar_geometrias_para_web(gdf, tolerance=0.01, max_points=1000):
     """
     Optimiza geometrías para visualización web reduciendo puntos y simplificando formas.
     
+    No se cachea: la clave de caché no incluiría las geometrías, así que otro
+    GeoDataFrame con los mismos parámetros recibiría el resultado del primero.
+    Las páginas usan los niveles pre-simplificados de `geometrias.py`.
+    
     Args:
-        _gdf: GeoDataFrame con geometrías (underscore para evitar hashing)
+        gdf: GeoDataFrame con geometrías
         tolerance: Tolerancia para simplificación (mayor = más simple)
         max_points: Máximo número de puntos por geometría
     
     Returns:
         GeoDataFrame optimizado
     """
-    gdf_optimized = _gdf.copy()
+    gdf_optimized = gdf.copy()
     
     # Simplificar geometrías
     gdf_optimized['geometry'] = gdf_optimized['geometry'].simplify(
@@ -220,15 +875,20 @@ def optimizar_geometrias_para_web(_gdf, tolerance=0.01, max_points=1000):
     
     return gdf_optimized
 
-@st.cache_data
-def preparar_datos_mapa_ligeros(_gdf, campos_datos, max_registros=None):
+@instrumentado()
+def preparar_datos_mapa_ligeros(_gdf, campos_datos, simplificar=True):
     """
     Prepara datos optimizados para mapas web, manteniendo solo campos esenciales.
     
+    No se cachea: `_gdf` no forma parte de la clave de caché, así que vistas
+    distintas con los mismos argumentos recibirían el mismo resultado; con
+    geometrías pre-simplificadas solo selecciona columnas y redondea.
+    
     Args:
-        _gdf: GeoDataFrame original (underscore para evitar hashing)
+        _gdf: GeoDataFrame original
         campos_datos: Lista de campos de datos a mantener
-        max_registros: Máximo número de registros (None = todos)
+        simplificar: Si se simplifican las geometrías (False si ya vienen
+            pre-simplificadas, ver `geometrias.py`)
     
     Returns:
         GeoDataFrame optimizado para web
@@ -257,12 +917,9 @@ def preparar_datos_mapa_ligeros(_gdf, campos_datos, max_registros=None):
     # Crear GDF ligero
     gdf_ligero = _gdf[campos_disponibles].copy()
     
-    # Limitar registros si es necesario
-    if max_registros and len(gdf_ligero) > max_registros:
-        gdf_ligero = gdf_ligero.head(max_registros)
-    
     # Optimizar geometrías
-    gdf_ligero = optimizar_geometrias_para_web(gdf_ligero, tolerance=0.01, max_points=500)
+    if simplificar:
+        gdf_ligero = optimizar_geometrias_para_web(gdf_ligero, tolerance=0.01, max_points=500)
     
     # Redondear valores numéricos para reducir tamaño
     for col in gdf_ligero.columns: